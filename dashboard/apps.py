@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
 
 
 class DashboardConfig(AppConfig):
     name = 'dashboard'
+
+    def ready(self):
+        from .cache import check_shared_cache
+        from .sqlstats import install
+
+        connection_created.connect(install, dispatch_uid='dashboard.sqlstats.install')
+        checks.register(check_shared_cache, checks.Tags.caches)
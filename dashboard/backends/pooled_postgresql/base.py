@@ -0,0 +1,52 @@
+"""
+The PostgreSQL backend with pooled connections.
+
+`connect()` takes a connection from the pool of the process (see `pool.py`)
+instead of opening one, and `close()` - at the end of every request with the
+default `CONN_MAX_AGE` of 0 - hands it back, so requests don't pay for the
+connection setup. Configured by the `POOL` entry of the database settings:
+
+    'ENGINE': 'dashboard.backends.pooled_postgresql',
+    'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 10, 'TIMEOUT': 10, 'IDLE_TIMEOUT': 300, 'HEALTH_CHECK_INTERVAL': 30},
+
+Released connections keep their session (e.g. prepared statements), open
+transactions are rolled back.
+"""
+from django.db.backends.postgresql import base, creation
+
+from .pool import close_pools, get_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # The pooled connections would keep the test database in use
+        close_pools(database=test_database_name)
+
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}))
+        connection = self.pool.acquire()
+
+        # Set like the PostgreSQL backend does, for new and reused connections
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # A connection closed in a transaction stays referenced by the
+                # wrapper until its next connect(), it can't be shared meanwhile
+                self.pool.release(self.connection, discard=self.in_atomic_block)
@@ -0,0 +1,265 @@
+"""
+A thread-safe pool of psycopg2 connections with health checks, idle timeout
+eviction and metrics.
+
+Idle connections are reused most recently released first, so the ones left
+over after a peak get idle and are closed once idle for `idle_timeout`
+seconds, down to `min_size` connections. A connection idle for more than
+`health_check_interval` seconds runs `SELECT 1` before it's handed out, and is
+replaced if it fails. With `max_size` connections in use, `acquire()` waits
+up to `timeout` seconds for one to be released and then raises `PoolTimeout`.
+
+`get_pool()` keeps one pool per process, database alias and connection
+parameters.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2 import extensions
+
+DEFAULTS = {
+    'MIN_SIZE': 1,
+    'MAX_SIZE': 10,
+    'TIMEOUT': 10.0,
+    'IDLE_TIMEOUT': 300.0,
+    'HEALTH_CHECK_INTERVAL': 30.0,
+}
+
+METRICS = (
+    'created', 'closed', 'checkouts', 'waits', 'wait_time', 'timeouts', 'health_checks', 'health_check_failures',
+    'evictions',
+)
+
+pools = {}
+pools_pid = os.getpid()
+pools_lock = threading.Lock()
+# Pools inherited from the parent process, kept referenced so their
+# connections aren't closed from the child, which would end the parent's
+# sessions
+inherited_pools = []
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, database=None, min_size=1, max_size=10, timeout=10.0, idle_timeout=300.0,
+                 health_check_interval=30.0):
+        self.connect = connect
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+
+        self.condition = threading.Condition()
+        # [(connection, released at)], the most recently released last
+        self.idle = []
+        self.in_use = 0
+        self.closed = False
+        self.metrics = dict.fromkeys(METRICS, 0)
+
+    def acquire(self):
+        while True:
+            connection, released_at = self.checkout()
+
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self.checkin(None, discard=True)
+                    raise
+
+                self.count('created')
+            elif not self.is_healthy(connection, released_at):
+                self.checkin(connection, discard=True)
+                continue
+
+            self.count('checkouts')
+
+            return connection
+
+    def count(self, metric):
+        with self.condition:
+            self.metrics[metric] += 1
+
+    def checkout(self):
+        """
+        Takes an idle connection, or `(None, None)` for a new one.
+        """
+        deadline = time.monotonic() + self.timeout
+
+        with self.condition:
+            self.evict_idle()
+
+            while not self.idle and self.in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout('No connection released within {} seconds, all {} in use'.format(
+                        self.timeout,
+                        self.max_size
+                    ))
+
+                self.metrics['waits'] += 1
+                started = time.monotonic()
+                self.condition.wait(remaining)
+                self.metrics['wait_time'] += time.monotonic() - started
+
+            self.in_use += 1
+
+            if self.idle:
+                return self.idle.pop()
+
+            return None, None
+
+    def is_healthy(self, connection, released_at):
+        if connection.closed:
+            return False
+
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+
+        self.count('health_checks')
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            self.count('health_check_failures')
+            return False
+
+        return True
+
+    def release(self, connection, discard=False):
+        """
+        Returns `connection` to the pool, rolling back its open transaction,
+        or closes it with `discard` or if it's broken.
+        """
+        if not discard and not connection.closed:
+            status = connection.get_transaction_status()
+
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        self.checkin(connection, discard=discard or connection.closed)
+
+    def checkin(self, connection, discard=False):
+        with self.condition:
+            self.in_use -= 1
+
+            if connection is not None:
+                if discard or self.closed:
+                    self.close_connection(connection)
+                else:
+                    self.idle.append((connection, time.monotonic()))
+
+            self.evict_idle()
+            self.condition.notify()
+
+    def evict_idle(self):
+        """
+        Closes the connections idle for longer than `idle_timeout`, keeping
+        `min_size` connections open. Called with the lock held.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+
+        while self.idle and self.idle[0][1] < deadline and len(self.idle) + self.in_use > self.min_size:
+            connection, _ = self.idle.pop(0)
+            self.close_connection(connection)
+            self.metrics['evictions'] += 1
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+        self.metrics['closed'] += 1
+
+    def close(self):
+        """
+        Closes the idle connections, and the ones in use once released.
+        """
+        with self.condition:
+            self.closed = True
+
+            while self.idle:
+                self.close_connection(self.idle.pop()[0])
+
+    def stats(self):
+        with self.condition:
+            return OrderedDict([
+                ('database', self.database),
+                ('min_size', self.min_size),
+                ('max_size', self.max_size),
+                ('size', self.in_use + len(self.idle)),
+                ('in_use', self.in_use),
+                ('idle', len(self.idle)),
+            ] + [(metric, self.metrics[metric]) for metric in METRICS])
+
+
+def get_pool(alias, conn_params, options):
+    """
+    The pool of `alias` connecting with `conn_params`, configured by
+    `options` (the `POOL` entry of the database settings, see `DEFAULTS`).
+    """
+    global pools_pid
+
+    key = (alias, tuple(sorted(conn_params.items())))
+
+    with pools_lock:
+        if pools_pid != os.getpid():
+            inherited_pools.extend(pools.values())
+            pools.clear()
+            pools_pid = os.getpid()
+
+        pool = pools.get(key)
+
+        if pool is None or pool.closed:
+            options = dict(DEFAULTS, **options)
+            pool = pools[key] = ConnectionPool(
+                connect=lambda: psycopg2.connect(**conn_params),
+                database=conn_params.get('database'),
+                min_size=options['MIN_SIZE'],
+                max_size=options['MAX_SIZE'],
+                timeout=options['TIMEOUT'],
+                idle_timeout=options['IDLE_TIMEOUT'],
+                health_check_interval=options['HEALTH_CHECK_INTERVAL'],
+            )
+
+        return pool
+
+
+def close_pools(database=None):
+    """
+    Closes the pools of the current process, only those connecting to
+    `database` if given.
+    """
+    with pools_lock:
+        for key, pool in list(pools.items()):
+            if database is None or pool.database == database:
+                pool.close()
+                del pools[key]
+
+
+def pool_stats():
+    with pools_lock:
+        return [
+            OrderedDict([('alias', alias)] + list(pool.stats().items()))
+            for (alias, _), pool in pools.items()
+        ]
@@ -0,0 +1,140 @@
+"""
+Benchmarks comparing the model property path with the `collect()` paths and
+timing the list endpoints. Run them with `python manage.py benchmark`.
+"""
+import statistics
+import time
+import tracemalloc
+from functools import partial
+
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .models import (
+    Club,
+    Invoice,
+    InvoiceRow,
+    Party,
+    VisitorToParty,
+)
+
+MODELS = (Club, Party, VisitorToParty, Invoice, InvoiceRow)
+
+ENDPOINTS = (
+    '/dashboard/list/club/',
+    '/dashboard/list/party/',
+    '/dashboard/list/invoice/',
+    '/dashboard/list/invoice-row/',
+    '/dashboard/list/visitor-to-party/',
+    '/dashboard/list/invoice-row/?stream=1',
+)
+
+
+def property_cases():
+    """
+    Yields `(case, path, callable)` for every collectable property of every
+    model: the plain property path, `collect(field)` and, where the queryset
+    supports them, `collect_joined(field)` and `with_tree()`.
+    """
+    for model in MODELS:
+        manager = model.objects
+
+        for field in manager.all().collectable_fields():
+            case = '{}.{}'.format(model.__name__.lower(), field)
+
+            yield case, 'property', read(manager.all, field)
+            yield case, 'collect', read(partial(manager.collect, field), field)
+
+            if hasattr(manager, 'collect_joined'):
+                yield case, 'collect_joined', read(partial(manager.collect_joined, field), field)
+
+            if hasattr(manager, 'with_tree'):
+                yield case, 'with_tree', read(manager.with_tree, field)
+
+
+def read(get_queryset, field):
+    def run():
+        for instance in get_queryset():
+            getattr(instance, field)
+
+    return run
+
+
+def endpoint_cases():
+    client = Client(REMOTE_ADDR='192.0.2.1')
+
+    for url in ENDPOINTS:
+        yield url, 'endpoint', request(client, url)
+
+
+def request(client, url):
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    return run
+
+
+def measure(run, repeat):
+    """
+    Returns query count, wall times and peak traced memory of `run()`. The
+    peak memory comes from a separate run, so tracing doesn't skew timings.
+    """
+    # `connection.queries` is capped, so a full log would hide new queries
+    reset_queries()
+
+    with CaptureQueriesContext(connection) as context:
+        run()
+
+    wall_times = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        wall_times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'queries': len(context.captured_queries),
+        'wall_time': {
+            'min': min(wall_times),
+            'median': statistics.median(wall_times),
+            'max': max(wall_times),
+        },
+        'peak_memory': peak_memory,
+    }
+
+
+def run_benchmarks(scale, repeat=3, cases=None, log=None):
+    """
+    Measures all benchmark cases (optionally only those whose name starts
+    with one of `cases`) against the current data. Returns report entries.
+    """
+    results = []
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for case, path, run in list(property_cases()) + list(endpoint_cases()):
+            if cases and not case.startswith(tuple(cases)):
+                continue
+
+            result = measure(run, repeat)
+            result.update(scale=scale, case=case, path=path)
+            results.append(result)
+
+            if log is not None:
+                log('{scale:>6} {case:<45} {path:<15} {queries:>6} queries {median:>10.4f}s'.format(
+                    median=result['wall_time']['median'],
+                    **result
+                ))
+
+    return results
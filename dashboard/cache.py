@@ -0,0 +1,211 @@
+"""
+Result cache for querysets evaluated with `.cached()`.
+
+Results are stored in the `dashboard` cache (see `CACHES`, a locmem, file,
+memcached or Redis cache picked with `DASHBOARD_CACHE_URL`) under a key
+derived from the compiled SQL, its params and the current version of every
+watched table the SQL reads. Every watched table has a version counter, which
+is bumped when its rows change, so a write makes exactly the entries reading
+that table unreachable. Stale entries are never served and simply expire,
+as long as all processes share the cache: the counters of a locmem cache
+only see the writes of their own process, so with `DASHBOARD_CACHE_RESULTS`
+on the `dashboard.W001` system check warns about one.
+
+Versions are bumped by the `post_save` and `post_delete` signals of the
+watched models, by the bulk operations of `CollectQuerySet` (`update()`,
+`bulk_create()`) and by `refresh_summaries()`. Inside a transaction the bump
+is deferred until the commit, and until then queries reading the changed
+tables bypass the cache on that connection, so uncommitted rows are neither
+served to nor cached for anyone else. Writes bypassing all of these (raw SQL,
+`COPY`) have to call `tables_changed()` themselves.
+
+A lagging replica (see `dashboard/routers.py`) may return rows older than the
+versions its result is stored under, so results read from a replica are kept
+for at most `DASHBOARD_REPLICA_PIN_SECONDS`, the lag the reads are pinned to
+the primary for after a write.
+"""
+import hashlib
+import random
+
+from django.apps import apps
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, transaction
+
+from . import compiled, split
+
+CACHE_ALIAS = 'dashboard'
+
+WATCHED_MODELS = (
+    'dashboard.Club',
+    'dashboard.Party',
+    'dashboard.VisitorToParty',
+    'dashboard.Invoice',
+    'dashboard.InvoiceRow',
+    'dashboard.ClubSummary',
+    'dashboard.PartySummary',
+    'dashboard.InvoiceSummary',
+)
+
+VERSION_KEY = 'dashboard:version:{}'
+RESULT_KEY = 'dashboard:result:{}'
+
+_missing = object()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def check_shared_cache(app_configs, **kwargs):
+    if not settings.DASHBOARD_CACHE_RESULTS or not isinstance(get_cache(), LocMemCache):
+        return []
+
+    return [checks.Warning(
+        'The {} cache is local to each process, so the cached results of one are not invalidated by the writes of '
+        'the others.'.format(CACHE_ALIAS),
+        hint='Set DASHBOARD_CACHE_URL to a cache shared by all processes, e.g. a Redis or memcached one.',
+        id='dashboard.W001',
+    )]
+
+
+def watched_tables():
+    return [apps.get_model(label)._meta.db_table for label in WATCHED_MODELS]
+
+
+def query_tables(sql, connection):
+    """
+    The watched tables read by `sql`, including those in subqueries and
+    derived tables.
+    """
+    qn = connection.ops.quote_name
+
+    return sorted(table for table in watched_tables() if qn(table) in sql)
+
+
+def new_version():
+    # Versions start at a random value, so a counter which was evicted from
+    # the cache can't restart at a value some stale entry was stored under
+    return random.getrandbits(48)
+
+
+def table_versions(tables):
+    cache = get_cache()
+    keys = [VERSION_KEY.format(table) for table in tables]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def bump_table_versions(tables):
+    cache = get_cache()
+
+    for table in tables:
+        key = VERSION_KEY.format(table)
+
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), timeout=None)
+
+
+def _dirty_tables(connection):
+    """
+    Tables changed in the current transaction of `connection`, whose
+    versions are bumped when it commits.
+    """
+    if not connection.in_atomic_block:
+        # Whatever was left over has been rolled back
+        connection.dashboard_dirty_tables = set()
+
+    return connection.__dict__.setdefault('dashboard_dirty_tables', set())
+
+
+def tables_changed(tables, using='default'):
+    """
+    Invalidates the cached results reading any of `tables`, once the current
+    transaction of `using` commits.
+    """
+    connection = connections[using]
+
+    if not connection.in_atomic_block:
+        bump_table_versions(tables)
+        return
+
+    dirty = _dirty_tables(connection)
+    new_tables = set(tables) - dirty
+
+    if not new_tables:
+        return
+
+    dirty.update(new_tables)
+
+    def on_commit():
+        dirty.difference_update(new_tables)
+        bump_table_versions(new_tables)
+
+    transaction.on_commit(on_commit, using=using)
+
+
+def model_changed(sender, using, **kwargs):
+    tables_changed([sender._meta.db_table], using=using)
+
+
+def fetch_cached(queryset, fetch, timeout):
+    """
+    Returns the cached result of `queryset`, or the result of `fetch()`,
+    which is then cached for `timeout` seconds.
+    """
+    connection = connections[queryset.db]
+
+    try:
+        sql, params = compiled.get_compiler(queryset).as_sql()
+    except EmptyResultSet:
+        return fetch()
+
+    tables = query_tables(sql, connection)
+
+    # The values collected by separate queries (see `dashboard/split.py`) are
+    # part of the result too
+    for field in queryset._split_fields:
+        field_sql, _ = split.field_queryset(queryset, field).query.get_compiler(queryset.db).as_sql()
+        tables = sorted(set(tables).union(query_tables(field_sql, connection)))
+
+    if _dirty_tables(connection).intersection(tables):
+        return fetch()
+
+    key = hashlib.sha1(repr((
+        queryset.db,
+        queryset._iterable_class.__name__,
+        sql,
+        tuple(params),
+        queryset._split_fields,
+        tables,
+        table_versions(tables),
+    )).encode('utf-8')).hexdigest()
+
+    cache = get_cache()
+
+    if queryset.db in settings.DASHBOARD_REPLICAS:
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = cache.default_timeout
+
+        if timeout is None or timeout > settings.DASHBOARD_REPLICA_PIN_SECONDS:
+            timeout = settings.DASHBOARD_REPLICA_PIN_SECONDS
+
+    result = cache.get(RESULT_KEY.format(key), _missing)
+
+    if result is _missing:
+        result = fetch()
+        cache.set(RESULT_KEY.format(key), result, timeout)
+
+    return result
@@ -0,0 +1,215 @@
+"""
+Per-process caches of the collected queries and of their compiled SQL.
+
+Building the `collect()` annotations - fresh `Subquery`/`Coalesce`/`Case`
+trees, resolved against the query - costs more than running the query on
+small pages, and compiling the result costs a good part of that again. Both
+only depend on the shape of the queryset, not on the values it is filtered
+by:
+
+- `collected_query()` builds the annotated query of every (queryset class,
+  collect method, fields) once, and afterwards hands out clones of it;
+- `get_compiler()` compiles every shape - collected fields, joins, filters,
+  ordering, loaded columns and slice - once, and afterwards only compiles the
+  WHERE clause to bind its parameters into the cached SQL, run as a prepared
+  statement on PostgreSQL if enabled (see `dashboard/prepared.py`).
+
+Querysets with anything the shape doesn't cover (`extra()`, `select_related()`,
+grouping, custom annotations, ...) are compiled as usual.
+"""
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db.models.sql.query import Query
+
+from . import prepared
+
+# Upper bound of the cached shapes, e.g. `pk__in` filters make one per length
+MAX_ENTRIES = 1000
+
+templates = {}
+statements = {}
+
+
+class CompiledSQL(object):
+    """
+    The compiled SQL of a shape, with the parameters of its WHERE clause at
+    `where_params[0]:where_params[1]`, and the compiler state the model
+    iterables read.
+    """
+
+    def __init__(self, compiler, sql, params, where_params):
+        self.sql = sql
+        self.params = tuple(params)
+        self.where_params = where_params
+        self.select = compiler.select
+        self.klass_info = compiler.klass_info
+        self.annotation_col_map = compiler.annotation_col_map
+        self.col_count = compiler.col_count
+
+    def bind(self, compiler, where_params):
+        start, end = self.where_params
+        params = self.params[:start] + tuple(where_params) + self.params[end:]
+
+        compiler.select = self.select
+        compiler.klass_info = self.klass_info
+        compiler.annotation_col_map = self.annotation_col_map
+        compiler.col_count = self.col_count
+        compiler.as_sql = lambda *args, **kwargs: (self.sql, params)
+        prepared.use_prepared(compiler, self.sql, params)
+
+        return compiler
+
+
+def is_plain(query):
+    """
+    Whether `query` is a model's query as its default manager returns it.
+    """
+    return type(query) is Query and \
+        not query.where.children and \
+        not query.annotations and \
+        not query.extra and \
+        len(query.alias_map) <= 1 and \
+        not query.order_by and \
+        query.default_ordering and \
+        query.standard_ordering and \
+        query.low_mark == 0 and \
+        query.high_mark is None and \
+        not query.distinct and \
+        query.select_related is False and \
+        query.group_by is None and \
+        not query.values_select and \
+        query.deferred_loading == (frozenset(), True) and \
+        not query.select_for_update
+
+
+def collected_query(queryset, method, fields, build):
+    """
+    A clone of the query `build()` annotates, `queryset` collected by
+    `method` with `fields`, built once per process.
+    """
+    key = (queryset.__class__, queryset.model, method, fields)
+    template = templates.get(key)
+
+    if template is None:
+        template = build().query
+
+        if len(templates) < MAX_ENTRIES:
+            templates[key] = template
+
+    return template.clone()
+
+
+def shape_key(queryset, where_sql):
+    """
+    The key of the SQL of `queryset`, or None if its shape isn't covered.
+    """
+    query = queryset.query
+
+    if queryset._shape is None or \
+            query.extra or \
+            query.select_related is not False or \
+            query.group_by is not None or \
+            query.combinator or \
+            query.where.contains_aggregate or \
+            not all(isinstance(ordering, str) for ordering in query.order_by):
+        return None
+
+    return (
+        queryset.db,
+        queryset.__class__,
+        query.__class__,
+        queryset._shape,
+        where_sql,
+        tuple((alias, join.table_name, join.join_type, join.parent_alias) for alias, join in query.alias_map.items()),
+        tuple(query.order_by),
+        tuple(query.extra_order_by),
+        query.default_ordering,
+        query.standard_ordering,
+        query.low_mark,
+        query.high_mark,
+        query.distinct,
+        tuple(query.distinct_fields),
+        frozenset(query.deferred_loading[0]),
+        query.deferred_loading[1],
+        tuple(query.values_select),
+        None if query.annotation_select_mask is None else frozenset(query.annotation_select_mask),
+        query.select_for_update,
+        query.select_for_update_nowait,
+        query.select_for_update_skip_locked,
+    )
+
+
+def get_compiler(queryset):
+    """
+    The SQL compiler of `queryset`, with the cached SQL of its shape bound to
+    the parameters of its filters if it was compiled before.
+    """
+    compiler = queryset.query.get_compiler(using=queryset.db)
+
+    if not settings.DASHBOARD_COMPILED_SQL:
+        return compiler
+
+    try:
+        where_sql, where_params = compiler.compile(queryset.query.where)
+    except EmptyResultSet:
+        return compiler
+
+    key = shape_key(queryset, where_sql)
+
+    if key is None:
+        return compiler
+
+    statement = statements.get(key)
+
+    if statement is not None:
+        return statement.bind(compiler, where_params)
+
+    sql, params = compiler.as_sql()
+    where_range = locate_where_params(sql, params, where_sql, where_params)
+
+    if where_range is not None and len(statements) < MAX_ENTRIES:
+        statements[key] = CompiledSQL(compiler, sql, params, where_range)
+
+    # Not compiled a second time when it's executed
+    compiler.as_sql = lambda *args, **kwargs: (sql, params)
+
+    return compiler
+
+
+def locate_where_params(sql, params, where_sql, where_params):
+    """
+    The range of `where_params` within `params`, counting the placeholders
+    before the WHERE clause, or None if the clause can't be told apart from
+    the subqueries.
+    """
+    if not where_sql:
+        return 0, 0
+
+    clause = 'WHERE {}'.format(where_sql)
+
+    if sql.count(clause) != 1:
+        return None
+
+    start = sql[:sql.index(clause)].replace('%%', '').count('%s')
+    end = start + len(where_params)
+
+    if tuple(params[start:end]) != tuple(where_params):
+        return None
+
+    return start, end
+
+
+def use_compiler(queryset):
+    """
+    Makes the next `queryset.query.get_compiler()` - the one of the model
+    iterable evaluating `queryset` - return `get_compiler(queryset)`.
+    """
+    query = queryset.query
+    compiler = get_compiler(queryset)
+
+    def get_prepared_compiler(*args, **kwargs):
+        del query.get_compiler
+
+        return compiler
+
+    query.get_compiler = get_prepared_compiler
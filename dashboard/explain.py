@@ -0,0 +1,97 @@
+"""
+EXPLAIN-based check of the indexes behind the `collect()` queries (see
+migrations `0006_collect_indexes` and `0008_invoice_covering_tax_rate`). Run
+it with `python manage.py explain_collect`.
+
+Every table a `collect()` query reads, other than the table of its own
+model, has to be read with index only scans. The plans are made on
+PostgreSQL with sequential scans disabled for the transaction, so the check
+shows what the indexes allow, regardless of the current table sizes. Tables
+which were never vacuumed have no visibility map, so the planner expects
+index only scans to read the heap anyway and prefers bitmap scans; `vacuum`
+runs `VACUUM ANALYZE` on them first.
+"""
+import json
+
+from django.db import transaction
+
+from .models import (
+    Club,
+    Invoice,
+    InvoiceRow,
+    Party,
+    VisitorToParty,
+)
+
+MODELS = (Club, Party, VisitorToParty, Invoice, InvoiceRow)
+COLLECT_METHODS = ('collect', 'collect_joined')
+
+
+def collect_querysets():
+    """
+    Yields `(name, queryset)` for every collect method of every model.
+    """
+    for model in MODELS:
+        queryset = model.objects.order_by()
+
+        for method in COLLECT_METHODS:
+            if hasattr(queryset, method):
+                yield '{}.{}()'.format(model.__name__, method), getattr(queryset, method)()
+
+
+def explain(connection, queryset):
+    sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']
+
+
+def scans(plan):
+    """
+    Yields the plan nodes reading a table, including those of subplans.
+    """
+    if 'Relation Name' in plan:
+        yield plan
+
+    for subplan in plan.get('Plans', ()):
+        yield from scans(subplan)
+
+
+def vacuum_analyze(connection):
+    """
+    Updates the visibility maps and statistics of the tables. Can't run in a
+    transaction.
+    """
+    with connection.cursor() as cursor:
+        for model in MODELS:
+            cursor.execute('VACUUM ANALYZE {}'.format(connection.ops.quote_name(model._meta.db_table)))
+
+
+def check_scans(connection, vacuum=False):
+    """
+    Returns `(query name, table, node type, index name, ok)` for every table
+    scan in the plans of the `collect()` queries, vacuuming the tables first
+    with `vacuum`.
+    """
+    if vacuum:
+        vacuum_analyze(connection)
+
+    results = []
+
+    for name, queryset in collect_querysets():
+        own_table = queryset.model._meta.db_table
+
+        for scan in scans(explain(connection, queryset)):
+            table = scan['Relation Name']
+            ok = table == own_table or scan['Node Type'] == 'Index Only Scan'
+
+            results.append((name, table, scan['Node Type'], scan.get('Index Name'), ok))
+
+    return results
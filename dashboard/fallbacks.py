@@ -0,0 +1,90 @@
+"""
+Instrumentation of the model property fallbacks.
+
+A model property whose `_`-prefixed value was not collected falls back to
+`collect_siblings()` (one query per loaded batch) or to a per-instance path
+(one or more queries per instance, i.e. N+1 queries). With
+`DASHBOARD_PROPERTY_FALLBACKS` set to
+
+- `count`, every fallback is counted by property, kind (`siblings` or
+  `instance`) and call site - the first frame outside of the dashboard models,
+  Django and DRF - and the first hit of each is logged, so the logs of all
+  processes list every code path loading models without `collect()`;
+- `strict`, fallbacks raise `PropertyFallback` instead.
+
+`report()` returns the counts of the current process, served to staff users
+at `/dashboard/fallbacks/`.
+"""
+import logging
+import os
+import sys
+from collections import Counter
+
+import django
+import rest_framework
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+counts = Counter()
+
+DASHBOARD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Frames in these files and directories are not reported as call sites
+SKIPPED_PATHS = (
+    os.path.join(DASHBOARD_DIR, 'models.py'),
+    os.path.join(DASHBOARD_DIR, 'siblings.py'),
+    os.path.join(DASHBOARD_DIR, 'fallbacks.py'),
+    os.path.join(os.path.dirname(os.path.abspath(django.__file__)), ''),
+    os.path.join(os.path.dirname(os.path.abspath(rest_framework.__file__)), ''),
+)
+
+
+class PropertyFallback(Exception):
+    pass
+
+
+def call_site():
+    caller = frame = sys._getframe(2)
+
+    while frame is not None and frame.f_code.co_filename.startswith(SKIPPED_PATHS):
+        frame = frame.f_back
+
+    # Only dashboard, Django and DRF frames: report the property itself
+    frame = frame or caller
+
+    return '{}:{} in {}'.format(os.path.relpath(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+
+def record_fallback(instance, field, kind):
+    """
+    Records that the property `field` of `instance` falls back to the `kind`
+    (`siblings` or `instance`) path, or raises in strict mode.
+    """
+    mode = settings.DASHBOARD_PROPERTY_FALLBACKS
+
+    if mode == 'off':
+        return
+
+    name = '{}.{}'.format(instance.__class__.__name__, field)
+
+    if mode == 'strict':
+        raise PropertyFallback(
+            '{} was not collected and falls back to the {} path. Use collect() or with_tree().'.format(name, kind)
+        )
+
+    key = (name, kind, call_site())
+    counts[key] += 1
+
+    if counts[key] == 1:
+        logger.warning('Property fallback: {} ({}) from {}'.format(*key))
+
+
+def report(limit=None):
+    """
+    The fallback counts of the current process, the most frequent first.
+    """
+    return [
+        {'property': name, 'kind': kind, 'call_site': site, 'count': count}
+        for (name, kind, site), count in counts.most_common(limit)
+    ]
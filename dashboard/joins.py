@@ -0,0 +1,294 @@
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import IntegerField
+from django.db.models.expressions import Expression
+from django.db.models.sql.compiler import SQLCompiler
+from django.db.models.sql.constants import LOUTER
+from django.db.models.sql.query import Query
+
+
+class DerivedTable(object):
+    """
+    Join-compatible entry for Query.alias_map which LEFT JOINs a pre-grouped
+    queryset as a derived table:
+
+        LEFT OUTER JOIN (SELECT ... GROUP BY ...) "alias"
+            ON ("alias"."column" = "parent_alias"."parent_column"
+                AND "alias"."condition_column" = condition_value ...)
+
+    When the same derived table is joined more than once within a query it is
+    rendered as a reference to a `WITH` entry named `name` instead (see
+    `CTECompiler`).
+    """
+
+    def __init__(self, query, table_name, parent_alias, column, parent_column, name=None, conditions=()):
+        self.query = query
+        self.table_name = table_name
+        self.table_alias = table_name
+        self.name = name or table_name
+        self.parent_alias = parent_alias
+        self.column = column
+        self.parent_column = parent_column
+        self.conditions = tuple(conditions)
+        self.join_type = LOUTER
+        self.join_field = None
+        self.nullable = True
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        qn2 = connection.ops.quote_name
+
+        context = getattr(compiler, 'cte_context', None)
+        cte_name = context.names.get(id(self)) if context is not None else None
+
+        if cte_name is not None:
+            table_sql, params = qn2(cte_name), []
+        else:
+            subquery_sql, params = self.compile_query(context, connection)
+            table_sql = '({})'.format(subquery_sql)
+
+        if cte_name != self.table_alias:
+            table_sql = '{} {}'.format(table_sql, qn(self.table_alias))
+
+        join_conditions = ['{alias}.{column} = {parent_alias}.{parent_column}'.format(
+            alias=qn(self.table_alias),
+            column=qn2(self.column),
+            parent_alias=qn(self.parent_alias),
+            parent_column=qn2(self.parent_column),
+        )]
+        params = list(params)
+
+        for condition_column, condition_value in self.conditions:
+            join_conditions.append('{}.{} = %s'.format(qn(self.table_alias), qn2(condition_column)))
+            params.append(condition_value)
+
+        sql = '{} {} ON ({})'.format(self.join_type, table_sql, ' AND '.join(join_conditions))
+
+        return sql, tuple(params)
+
+    def compile_query(self, context, connection):
+        compiler = self.query.get_compiler(connection=connection)
+        compiler.cte_context = context
+
+        sql, params = compiler.as_sql()
+
+        return sql, tuple(params)
+
+    def relabeled_clone(self, change_map):
+        clone = self.__class__(
+            self.query,
+            self.table_name,
+            change_map.get(self.parent_alias, self.parent_alias),
+            self.column,
+            self.parent_column,
+            name=self.name,
+            conditions=self.conditions
+        )
+        clone.table_alias = change_map.get(self.table_alias, self.table_alias)
+
+        return clone
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.table_name == other.table_name and \
+                self.parent_alias == other.parent_alias and \
+                self.conditions == other.conditions
+        return False
+
+
+class CTEContext(object):
+    """
+    Maps derived tables (by `id()`) to the name of the `WITH` entry they
+    should be rendered as while one query is being compiled.
+    """
+
+    def __init__(self):
+        self.names = {}
+
+
+def collect_ctes(query, connection):
+    """
+    Walks all derived tables joined in `query` (and in their own queries) and
+    returns a `CTEContext` together with the `(name, derived_table)` pairs that
+    should be emitted as `WITH` entries: every derived table whose SQL appears
+    more than once in the tree. Dependencies come before their consumers.
+    """
+    inline_context = CTEContext()
+    occurrences = OrderedDict()
+
+    def walk(query):
+        for alias in query.tables:
+            table = query.alias_map.get(alias)
+
+            if not query.alias_refcount.get(alias) or not isinstance(table, DerivedTable):
+                continue
+
+            walk(table.query)
+
+            key = table.compile_query(inline_context, connection)
+            occurrences.setdefault(key, []).append(table)
+
+    walk(query)
+
+    context = CTEContext()
+    ctes = []
+    used_names = set()
+
+    for tables in occurrences.values():
+        if len(tables) < 2:
+            continue
+
+        name = tables[0].name
+        suffix = 1
+        while name in used_names:
+            suffix += 1
+            name = '{}_{}'.format(tables[0].name, suffix)
+        used_names.add(name)
+
+        for table in tables:
+            context.names[id(table)] = name
+
+        ctes.append((name, tables[0]))
+
+    return context, ctes
+
+
+class CTECompiler(SQLCompiler):
+    """
+    Compiler for queries with derived tables. Identical derived tables are
+    emitted once as `WITH` entries which all their consumers reference, so the
+    database plans and runs each rollup a single time per query.
+    """
+    cte_context = None
+
+    def as_sql(self, *args, **kwargs):
+        if self.cte_context is not None:
+            # Nested in a query which already owns the WITH clause
+            return super().as_sql(*args, **kwargs)
+
+        self.cte_context, ctes = collect_ctes(self.query, self.connection)
+
+        try:
+            sql, params = super().as_sql(*args, **kwargs)
+
+            if not ctes:
+                return sql, params
+
+            with_sql = []
+            with_params = []
+
+            for name, table in ctes:
+                cte_sql, cte_params = table.compile_query(self.cte_context, self.connection)
+                with_sql.append('{} AS ({})'.format(self.connection.ops.quote_name(name), cte_sql))
+                with_params.extend(cte_params)
+        finally:
+            self.cte_context = None
+
+        return 'WITH {} {}'.format(', '.join(with_sql), sql), tuple(with_params) + tuple(params)
+
+
+class CTEQuery(Query):
+    def get_compiler(self, using=None, connection=None):
+        if using is None and connection is None:
+            raise ValueError("Need either using or connection")
+        if using:
+            connection = connections[using]
+        return CTECompiler(self, connection, using)
+
+
+class DerivedCol(Expression):
+    """
+    Reference to a column of a derived table added with `left_join()`.
+    """
+
+    def __init__(self, alias, column, output_field=None):
+        super().__init__(output_field=output_field)
+        self.alias = alias
+        self.column = column
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+
+        return '{}.{}'.format(qn(self.alias), connection.ops.quote_name(self.column)), []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            change_map.get(self.alias, self.alias),
+            self.column,
+            output_field=self._output_field
+        )
+
+    def get_group_by_cols(self):
+        return [self]
+
+
+def derived_aliases(expressions):
+    """
+    Returns the aliases of the derived tables referenced by `expressions`.
+    """
+    aliases = set()
+
+    for expression in expressions:
+        if isinstance(expression, DerivedCol):
+            aliases.add(expression.alias)
+
+        aliases |= derived_aliases(expression.get_source_expressions())
+
+    return aliases
+
+
+class RowNumber(Expression):
+    """
+    ROW_NUMBER() OVER (PARTITION BY partition_by ORDER BY order_by)
+    """
+
+    def __init__(self, partition_by, order_by):
+        super().__init__(output_field=IntegerField())
+        self.partition_by = partition_by
+        self.order_by = order_by
+
+    def get_source_expressions(self):
+        return [self.partition_by, self.order_by]
+
+    def set_source_expressions(self, exprs):
+        self.partition_by, self.order_by = exprs
+
+    def as_sql(self, compiler, connection):
+        partition_sql, partition_params = compiler.compile(self.partition_by)
+        order_sql, order_params = compiler.compile(self.order_by)
+
+        sql = 'ROW_NUMBER() OVER (PARTITION BY {} ORDER BY {})'.format(partition_sql, order_sql)
+
+        return sql, list(partition_params) + list(order_params)
+
+
+def left_join(queryset, derived_queryset, alias, column, parent_column='id', parent_alias=None, name=None,
+              conditions=()):
+    """
+    Returns a clone of `queryset` with `derived_queryset` LEFT JOINed as
+    `alias` on `alias.column = parent_alias.parent_column` plus an equality for
+    each `(column, value)` pair in `conditions`. `parent_alias` defaults to the
+    base table of `queryset` and `name` (the `WITH` entry name used if the
+    derived table gets deduplicated) defaults to `alias`.
+    """
+    queryset = queryset.all()
+    queryset.query = queryset.query.clone(klass=CTEQuery)
+    query = queryset.query
+
+    if parent_alias is None:
+        parent_alias = query.get_initial_alias()
+
+    query.join(
+        DerivedTable(
+            query=derived_queryset.query,
+            table_name=alias,
+            parent_alias=parent_alias,
+            column=column,
+            parent_column=parent_column,
+            name=name,
+            conditions=conditions
+        )
+    )
+
+    return queryset
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dashboard.models import InvoiceRow
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the stored amounts of invoice rows which don\'t have them yet, in chunks of rows ordered by id. '
+        'Every chunk is committed on its own, so an interrupted run continues where it stopped when run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows updated per transaction.')
+
+    def handle(self, *args, **options):
+        missing = InvoiceRow.objects.filter(stored_amount__isnull=True)
+        total = missing.count()
+        done = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                pks = list(
+                    missing
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:options['chunk_size']]
+                )
+
+                if not pks:
+                    break
+
+                done += missing.filter(pk__gte=pks[0], pk__lte=pks[-1]).fill_amounts()
+                last_pk = pks[-1]
+
+            self.stdout.write('Filled {}/{} invoice rows'.format(done, total))
@@ -0,0 +1,79 @@
+import json
+import subprocess
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from dashboard.benchmarks import run_benchmarks
+from dashboard.models import Club
+from utilities.setup_db import generate, make_plan
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds the (empty) database at every scale factor and measures the model property fallbacks '
+        'against their collect() counterparts and the list endpoints. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10,100,1000', help='Comma separated numbers of clubs to seed.')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case.')
+        parser.add_argument('--case', action='append', dest='cases', help='Only run cases starting with this.')
+        parser.add_argument('--parties-per-club', type=int, default=10)
+        parser.add_argument('--visitors', type=int, default=11)
+        parser.add_argument('--rows-per-invoice', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated data.')
+        parser.add_argument('--output', help='Path of the JSON report. Printed to stdout if omitted.')
+
+    def handle(self, *args, **options):
+        if Club.objects.exists():
+            raise CommandError('The benchmark seeds its own data and needs an empty database.')
+
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be a comma separated list of integers.')
+
+        results = []
+
+        for scale in scales:
+            with transaction.atomic():
+                generate(make_plan(
+                    clubs=scale,
+                    parties_per_club=options['parties_per_club'],
+                    visitors=options['visitors'],
+                    rows_per_invoice=options['rows_per_invoice'],
+                    seed=options['seed']
+                ))
+                results += run_benchmarks(
+                    scale,
+                    repeat=options['repeat'],
+                    cases=options['cases'],
+                    log=self.stderr.write
+                )
+                transaction.set_rollback(True)
+
+        report = json.dumps({
+            'commit': self.get_commit(),
+            'created_at': datetime.utcnow().isoformat(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'seed': options['seed'],
+            'results': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
+
+    def get_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                stderr=subprocess.DEVNULL
+            ).decode('ascii').strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.snapshots import build_snapshot, snapshot_path, snapshot_views
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders the club and party lists into snapshot files, which the views serve while '
+        'DASHBOARD_SNAPSHOT_DIR is set. Every snapshot is swapped in atomically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Defaults to DASHBOARD_SNAPSHOT_DIR.')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Rebuild the snapshots every INTERVAL seconds until interrupted.'
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or settings.DASHBOARD_SNAPSHOT_DIR
+
+        if not directory:
+            raise CommandError('Set DASHBOARD_SNAPSHOT_DIR or pass --directory.')
+
+        while True:
+            for view_class in snapshot_views():
+                started = time.perf_counter()
+                count = build_snapshot(view_class, directory)
+
+                self.stdout.write('Wrote {} objects to {} in {:.2f}s'.format(
+                    count,
+                    snapshot_path(view_class, directory),
+                    time.perf_counter() - started
+                ))
+
+            if not options['interval']:
+                return
+
+            time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from dashboard.explain import check_scans
+
+
+class Command(BaseCommand):
+    help = (
+        'Checks with EXPLAIN that the collect() queries read every related table with index only '
+        'scans (PostgreSQL only).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument(
+            '--vacuum',
+            action='store_true',
+            help='Run VACUUM ANALYZE on the tables first, e.g. after filling them.'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('The plans are checked on PostgreSQL only.')
+
+        failed = 0
+
+        for name, table, node_type, index_name, ok in check_scans(connection, vacuum=options['vacuum']):
+            failed += not ok
+
+            self.stdout.write('{:<4} {:<30} {:<26} {:<18} {}'.format(
+                'ok' if ok else 'FAIL',
+                name,
+                table,
+                node_type,
+                index_name or ''
+            ))
+
+        if failed:
+            raise CommandError('{} scans are not index only scans.'.format(failed))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dashboard.summaries import refresh_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        'Refreshes the precomputed invoice, party and club summaries (REFRESH MATERIALIZED VIEW CONCURRENTLY '
+        'on PostgreSQL). Missing summaries are created.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--create',
+            action='store_true',
+            help='Recreate all summaries, e.g. after the collect() queries changed.'
+        )
+        parser.add_argument(
+            '--blocking',
+            action='store_false',
+            dest='concurrently',
+            help='Refresh without CONCURRENTLY: faster, but blocks readers.'
+        )
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        refresh_summaries(
+            connections[options['database']],
+            create=options['create'],
+            concurrently=options['concurrently'],
+            log=self.stdout.write
+        )
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from utilities.setup_db import counts, generate, make_plan
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates clubs with parties, visitors and an invoice with rows for every visitor of every party. '
+        'The defaults create the original 33 clubs; raise --clubs for load and benchmark datasets.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clubs', type=int, default=33)
+        parser.add_argument('--parties-per-club', type=int, default=10)
+        parser.add_argument('--visitors', type=int, default=11)
+        parser.add_argument('--rows-per-invoice', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated values.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Parties written per transaction.')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes (PostgreSQL only).')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        plan = make_plan(
+            clubs=options['clubs'],
+            parties_per_club=options['parties_per_club'],
+            visitors=options['visitors'],
+            rows_per_invoice=options['rows_per_invoice'],
+            seed=options['seed'],
+            using=using
+        )
+
+        generate(
+            plan,
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            using=using,
+            log=self.stdout.write
+        )
+
+        for label, count in counts(using=using).items():
+            self.stdout.write('{}: {}'.format(label, count))
@@ -0,0 +1,117 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import routers
+from .queries import QueryBudgetExceeded, check_budget, count_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Counts the queries and database time of every request and checks them
+    against the budget of its URL name in `settings.DASHBOARD_QUERY_BUDGETS`
+    (or its `default`) and against `settings.DASHBOARD_DUPLICATE_QUERY_LIMIT`
+    runs of the same SQL. Violations are logged, or raised as
+    `QueryBudgetExceeded`, as `settings.DASHBOARD_QUERY_BUDGET_ACTION` says.
+    Streamed responses are counted until their end and only logged.
+
+    The totals are reported in a `Server-Timing` response header. With the
+    action `off` the middleware removes itself from the chain.
+    """
+
+    def __init__(self, get_response):
+        if settings.DASHBOARD_QUERY_BUDGET_ACTION == 'off':
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = count_queries()
+        stats = counter.start()
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            counter.stop()
+            raise
+
+        if response.streaming:
+            response.streaming_content = self.count_stream(response.streaming_content, counter, request)
+            return response
+
+        counter.stop()
+
+        response['Server-Timing'] = 'db;dur={:.2f};desc="{} queries"'.format(stats.time * 1000, stats.count)
+        self.check(request, stats, action=settings.DASHBOARD_QUERY_BUDGET_ACTION)
+
+        return response
+
+    def count_stream(self, content, counter, request):
+        try:
+            yield from content
+        finally:
+            self.check(request, counter.stop(), action='log')
+
+    def get_name(self, request):
+        resolver_match = getattr(request, 'resolver_match', None)
+
+        if resolver_match is None:
+            return request.path
+
+        return resolver_match.view_name
+
+    def check(self, request, stats, action):
+        name = self.get_name(request)
+        budgets = settings.DASHBOARD_QUERY_BUDGETS
+
+        violations = check_budget(
+            stats,
+            budget=budgets.get(name, budgets.get('default')),
+            duplicate_limit=settings.DASHBOARD_DUPLICATE_QUERY_LIMIT
+        )
+
+        if not violations:
+            return
+
+        message = '{} {} ({} queries, {:.1f}ms): {}'.format(
+            request.method,
+            name,
+            stats.count,
+            stats.time * 1000,
+            '; '.join(violations)
+        )
+
+        if action == 'raise':
+            raise QueryBudgetExceeded(message)
+
+        logger.warning(message)
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Keeps the reads of a client on the primary for
+    `settings.DASHBOARD_REPLICA_PIN_SECONDS` after a request which wrote, so
+    it reads its writes however far the replicas lag (see
+    `dashboard/routers.py`). Without replicas the middleware removes itself
+    from the chain.
+    """
+    cookie_name = 'dashboard_primary'
+
+    def __init__(self, get_response):
+        if not settings.DASHBOARD_REPLICAS:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request(pinned=self.cookie_name in request.COOKIES)
+
+        response = self.get_response(request)
+
+        if routers.wrote():
+            response.set_cookie(self.cookie_name, '1', max_age=settings.DASHBOARD_REPLICA_PIN_SECONDS, httponly=True)
+
+        return response
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 08:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def fill_total_amounts(apps, schema_editor):
+    Invoice = apps.get_model('dashboard', 'Invoice')
+    InvoiceRow = apps.get_model('dashboard', 'InvoiceRow')
+
+    tax = Case(
+        When(tax_rate__gt=0, then=F('tax_rate')),
+        default=F('invoice__default_tax_rate'),
+        output_field=models.DecimalField()
+    )
+    amount = ExpressionWrapper(F('quantity') * F('unit_price') * (1 + tax), output_field=models.DecimalField())
+
+    rows_total = InvoiceRow.objects \
+        .filter(invoice=OuterRef('pk')) \
+        .values('invoice') \
+        .values_list(Sum(amount))[:1]
+
+    Invoice.objects.update(
+        stored_total_amount=Coalesce(Subquery(rows_total, output_field=models.DecimalField()), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_party_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='stored_total_amount',
+            field=models.DecimalField(
+                db_column='total_amount',
+                decimal_places=4,
+                default=0,
+                editable=False,
+                max_digits=20
+            ),
+        ),
+        migrations.RunPython(fill_total_amounts, migrations.RunPython.noop),
+    ]
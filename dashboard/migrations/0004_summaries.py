@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 09:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_invoice_total_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClubSummary',
+            fields=[
+                ('club', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='dashboard.Club')),
+                ('first_party_name', models.CharField(max_length=255, null=True)),
+                ('first_party_income', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+                ('last_party_name', models.CharField(max_length=255, null=True)),
+                ('last_party_income', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+                ('average_income_per_party', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+                ('parties_count', models.IntegerField(null=True)),
+                ('total_incomes', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+            ],
+            options={
+                'db_table': 'dashboard_club_summary',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='InvoiceSummary',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='dashboard.Invoice')),
+                ('details', models.CharField(max_length=255, null=True)),
+                ('total_amount', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+            ],
+            options={
+                'db_table': 'dashboard_invoice_summary',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PartySummary',
+            fields=[
+                ('party', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='summary', serialize=False, to='dashboard.Party')),
+                ('invoices_count', models.IntegerField(null=True)),
+                ('total_party_income', models.DecimalField(decimal_places=4, max_digits=20, null=True)),
+            ],
+            options={
+                'db_table': 'dashboard_party_summary',
+                'managed': False,
+            },
+        ),
+    ]
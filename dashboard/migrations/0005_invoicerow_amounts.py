@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.1 on 2026-10-18 09:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoicerow',
+            name='stored_amount',
+            field=models.DecimalField(db_column='amount', decimal_places=4, editable=False, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoicerow',
+            name='stored_amount_without_tax',
+            field=models.DecimalField(db_column='amount_without_tax', decimal_places=4, editable=False, max_digits=20, null=True),
+        ),
+    ]
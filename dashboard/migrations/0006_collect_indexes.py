@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# (name, table, key columns, covered columns, partial index condition)
+INDEXES = (
+    # First row description and the sum of the row amounts of an invoice
+    ('dashboard_invoicerow_invoice_covering', 'dashboard_invoicerow', ['invoice_id'], ['amount', 'description'], None),
+    # Invoices count and income of a party; only connections with an invoice are aggregated
+    (
+        'dashboard_visitortoparty_party_invoice',
+        'dashboard_visitortoparty',
+        ['party_id', 'invoice_id'],
+        [],
+        'invoice_id IS NOT NULL'
+    ),
+    # Totals of the invoices joined to the connections
+    ('dashboard_invoice_id_total_amount', 'dashboard_invoice', ['id'], ['total_amount'], None),
+    # First/last party of a club and the club totals
+    ('dashboard_party_club_id_covering', 'dashboard_party', ['club_id', 'id'], ['name'], None),
+)
+
+# Foreign key indexes made redundant by the indexes above (model, field)
+REDUNDANT_INDEXES = (
+    ('InvoiceRow', 'invoice'),
+    ('Party', 'club'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    postgresql = connection.vendor == 'postgresql'
+    # INCLUDE needs PostgreSQL 11, elsewhere the covered columns become trailing key columns
+    include = postgresql and connection.pg_version >= 110000
+
+    for name, table, columns, covered, condition in INDEXES:
+        if not include:
+            columns, covered = columns + covered, []
+
+        schema_editor.execute('CREATE {unique}INDEX {concurrently}{name} ON {table} ({columns}){include}{where}'.format(
+            unique='UNIQUE ' if columns[0] == 'id' else '',
+            concurrently='CONCURRENTLY ' if postgresql else '',
+            name=qn(name),
+            table=qn(table),
+            columns=', '.join(qn(column) for column in columns),
+            include=' INCLUDE ({})'.format(', '.join(qn(column) for column in covered)) if covered else '',
+            where=' WHERE {}'.format(condition) if condition else ''
+        ))
+
+
+def drop_indexes(apps, schema_editor):
+    for name, *_ in INDEXES:
+        schema_editor.execute('DROP INDEX {}'.format(schema_editor.connection.ops.quote_name(name)))
+
+
+def drop_redundant_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+
+    for model_name, field_name in REDUNDANT_INDEXES:
+        model = apps.get_model('dashboard', model_name)
+        column = model._meta.get_field(field_name).column
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+
+        for name, constraint in constraints.items():
+            if constraint['index'] and not constraint['unique'] and constraint['columns'] == [column]:
+                schema_editor.execute('DROP INDEX {}{}'.format(
+                    'CONCURRENTLY ' if connection.vendor == 'postgresql' else '',
+                    connection.ops.quote_name(name)
+                ))
+
+
+def create_redundant_indexes(apps, schema_editor):
+    for model_name, field_name in REDUNDANT_INDEXES:
+        model = apps.get_model('dashboard', model_name)
+        schema_editor.execute(schema_editor._create_index_sql(model, [model._meta.get_field(field_name)]))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0005_invoicerow_amounts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+        # Dropped without rebuilding the tables, which would lose the indexes above on SQLite
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(drop_redundant_indexes, create_redundant_indexes),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='invoicerow',
+                    name='invoice',
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='rows',
+                        to='dashboard.Invoice'
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name='party',
+                    name='club',
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='parties',
+                        to='dashboard.Club'
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models, transaction
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Subquery, When
+
+# Rows updated per transaction, as by the `backfill_row_amounts` command
+CHUNK_SIZE = 10000
+
+
+def fill_row_amounts(apps, schema_editor):
+    Invoice = apps.get_model('dashboard', 'Invoice')
+    InvoiceRow = apps.get_model('dashboard', 'InvoiceRow')
+
+    default_tax_rate = Invoice.objects.filter(pk=OuterRef('invoice_id')).values('default_tax_rate')[:1]
+    tax = Case(
+        When(tax_rate__gt=0, then=F('tax_rate')),
+        default=Subquery(default_tax_rate, output_field=models.DecimalField()),
+        output_field=models.DecimalField()
+    )
+    amount_without_tax = ExpressionWrapper(F('quantity') * F('unit_price'), output_field=models.DecimalField())
+    amount = ExpressionWrapper(F('quantity') * F('unit_price') * (1 + tax), output_field=models.DecimalField())
+
+    missing = InvoiceRow.objects.using(schema_editor.connection.alias).filter(stored_amount__isnull=True)
+    last_pk = 0
+
+    while True:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            pks = list(missing.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+
+            if not pks:
+                break
+
+            missing \
+                .filter(pk__gte=pks[0], pk__lte=pks[-1]) \
+                .update(stored_amount_without_tax=amount_without_tax, stored_amount=amount)
+            last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+    # Every chunk is committed on its own, as by the `backfill_row_amounts`
+    # command, instead of locking the whole table until the end
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0006_collect_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_row_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# (name, covered columns) of the invoice index read by the `collect()` queries
+OLD_INDEX = ('dashboard_invoice_id_total_amount', ['total_amount'])
+# Also covers the default tax rate of the invoice row amounts not filled yet
+NEW_INDEX = ('dashboard_invoice_id_covering', ['total_amount', 'default_tax_rate'])
+
+
+def replace_index(old, new):
+    def replace(apps, schema_editor):
+        connection = schema_editor.connection
+        qn = connection.ops.quote_name
+        postgresql = connection.vendor == 'postgresql'
+        # INCLUDE needs PostgreSQL 11, elsewhere the covered columns become trailing key columns
+        include = postgresql and connection.pg_version >= 110000
+        name, covered = new
+        columns = ['id'] if include else ['id'] + covered
+
+        schema_editor.execute('CREATE UNIQUE INDEX {concurrently}{name} ON {table} ({columns}){include}'.format(
+            concurrently='CONCURRENTLY ' if postgresql else '',
+            name=qn(name),
+            table=qn('dashboard_invoice'),
+            columns=', '.join(qn(column) for column in columns),
+            include=' INCLUDE ({})'.format(', '.join(qn(column) for column in covered)) if include else ''
+        ))
+        schema_editor.execute('DROP INDEX {}{}'.format('CONCURRENTLY ' if postgresql else '', qn(old[0])))
+
+    return replace
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0007_backfill_invoicerow_amounts'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_index(OLD_INDEX, NEW_INDEX), replace_index(NEW_INDEX, OLD_INDEX)),
+    ]
@@ -1,7 +1,14 @@
 from decimal import Decimal
 
-from django.db import models
-
+from django.db import models, transaction
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import cache
+from .fallbacks import record_fallback
+from .siblings import collect_siblings
 from .query import (
     InvoiceRowQuerySet,
     InvoiceQuerySet,
@@ -18,6 +25,9 @@ class Club(models.Model):
 
     @property
     def first_party(self):
+        if hasattr(self, '_prefetched_parties'):
+            return self._prefetched_parties[0] if self._prefetched_parties else None
+
         return self.parties.first()
 
     @property
@@ -25,6 +35,12 @@ class Club(models.Model):
         if hasattr(self, '_first_party_income'):
             return self._first_party_income
 
+        if not hasattr(self, '_prefetched_parties') and collect_siblings(self, 'first_party_income'):
+            return self._first_party_income
+
+        if not hasattr(self, '_prefetched_parties'):
+            record_fallback(self, 'first_party_income', 'instance')
+
         return self.first_party.total_party_income
 
     @property
@@ -32,10 +48,19 @@ class Club(models.Model):
         if hasattr(self, '_first_party_name'):
             return self._first_party_name
 
+        if not hasattr(self, '_prefetched_parties') and collect_siblings(self, 'first_party_name'):
+            return self._first_party_name
+
+        if not hasattr(self, '_prefetched_parties'):
+            record_fallback(self, 'first_party_name', 'instance')
+
         return self.first_party.name
 
     @property
     def last_party(self):
+        if hasattr(self, '_prefetched_parties'):
+            return self._prefetched_parties[-1] if self._prefetched_parties else None
+
         return self.parties.last()
 
     @property
@@ -43,6 +68,12 @@ class Club(models.Model):
         if hasattr(self, '_last_party_name'):
             return self._last_party_name
 
+        if not hasattr(self, '_prefetched_parties') and collect_siblings(self, 'last_party_name'):
+            return self._last_party_name
+
+        if not hasattr(self, '_prefetched_parties'):
+            record_fallback(self, 'last_party_name', 'instance')
+
         return self.last_party.name
 
     @property
@@ -50,6 +81,12 @@ class Club(models.Model):
         if hasattr(self, '_last_party_income'):
             return self._last_party_income
 
+        if not hasattr(self, '_prefetched_parties') and collect_siblings(self, 'last_party_income'):
+            return self._last_party_income
+
+        if not hasattr(self, '_prefetched_parties'):
+            record_fallback(self, 'last_party_income', 'instance')
+
         return self.last_party.total_party_income
 
     @property
@@ -64,6 +101,14 @@ class Club(models.Model):
         if hasattr(self, '_parties_count'):
             return self._parties_count
 
+        if hasattr(self, '_prefetched_parties'):
+            return len(self._prefetched_parties)
+
+        if collect_siblings(self, 'parties_count'):
+            return self._parties_count
+
+        record_fallback(self, 'parties_count', 'instance')
+
         return self.parties.count()
 
     @property
@@ -71,9 +116,18 @@ class Club(models.Model):
         if hasattr(self, '_total_incomes'):
             return self._total_incomes
 
+        parties = getattr(self, '_prefetched_parties', None)
+
+        if parties is None:
+            if collect_siblings(self, 'total_incomes'):
+                return self._total_incomes
+
+            record_fallback(self, 'total_incomes', 'instance')
+            parties = self.parties.all()
+
         income = Decimal(0.0)
 
-        for party in self.parties.all():
+        for party in parties:
             income += party.total_party_income
 
         return round(income, 2)
@@ -88,7 +142,8 @@ class Party(models.Model):
     objects = PartyQuerySet.as_manager()
 
     name = models.CharField(max_length=255)
-    club = models.ForeignKey(Club, related_name='parties')
+    # Indexed by dashboard_party_club_id_covering (see migration 0006)
+    club = models.ForeignKey(Club, related_name='parties', db_index=False)
     visitors = models.ManyToManyField(Visitor, related_name='parties', through='VisitorToParty')
 
     def __str__(self):
@@ -99,9 +154,18 @@ class Party(models.Model):
         if hasattr(self, '_invoices_count'):
             return self._invoices_count
 
+        visitortoparty_set = getattr(self, '_prefetched_visitortoparty_set', None)
+
+        if visitortoparty_set is None:
+            if collect_siblings(self, 'invoices_count'):
+                return self._invoices_count
+
+            record_fallback(self, 'invoices_count', 'instance')
+            visitortoparty_set = self.visitortoparty_set.all()
+
         count = 0
 
-        for visitortoparty_item in self.visitortoparty_set.all():
+        for visitortoparty_item in visitortoparty_set:
             if visitortoparty_item.invoice is not None:
                 count += 1
 
@@ -112,7 +176,15 @@ class Party(models.Model):
         if hasattr(self, '_total_party_income'):
             return self._total_party_income
 
-        visitortoparty_set = self.visitortoparty_set.all()
+        visitortoparty_set = getattr(self, '_prefetched_visitortoparty_set', None)
+
+        if visitortoparty_set is None:
+            if collect_siblings(self, 'total_party_income', default=Decimal(0)):
+                return self._total_party_income
+
+            record_fallback(self, 'total_party_income', 'instance')
+            visitortoparty_set = self.visitortoparty_set.all()
+
         income = Decimal(0.0)
 
         for visitortoparty_item in visitortoparty_set:
@@ -139,15 +211,92 @@ class VisitorToParty(models.Model):
         if hasattr(self, '_invoice_amount'):
             return self._invoice_amount
 
+        if self.invoice_id is None:
+            return Decimal(0)
+
+        if not VisitorToParty.invoice.is_cached(self) and \
+                collect_siblings(self, 'invoice_amount', default=Decimal(0)):
+            return self._invoice_amount
+
+        if not VisitorToParty.invoice.is_cached(self):
+            record_fallback(self, 'invoice_amount', 'instance')
+
         return Decimal(self.invoice.total_amount)
 
 
 class Invoice(models.Model):
+    """
+    Changing `default_tax_rate`, by `save()` or by `QuerySet.update()`,
+    refills the stored amounts of the rows without own tax rate and the
+    stored total in the same transaction. Raw SQL bypasses this, so it has to
+    be followed by `fill_amounts()` and `refresh_total_amounts()`.
+    """
     objects = InvoiceQuerySet.as_manager()
 
     description = models.CharField(max_length=255, null=True, blank=True)
     default_tax_rate = models.DecimalField(default=0.2, decimal_places=2, max_digits=4)
 
+    # Sum of the amounts of all rows, kept up to date by `InvoiceRow.save()`
+    # and `delete()` and by changes of `default_tax_rate`
+    stored_total_amount = models.DecimalField(
+        default=0,
+        decimal_places=4,
+        max_digits=20,
+        editable=False,
+        db_column='total_amount'
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        if 'default_tax_rate' in field_names:
+            instance._loaded_default_tax_rate = values[field_names.index('default_tax_rate')]
+
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The stored total is only ever changed in the database, never
+            # overwritten with the (possibly stale) value of this instance
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.get_deferred_fields() | {'stored_total_amount'}
+            ]
+
+        to_decimal = self._meta.get_field('default_tax_rate').to_python
+
+        def default_tax_rate_changed(previous):
+            return previous is not None and to_decimal(previous) != to_decimal(self.default_tax_rate)
+
+        loaded_default_tax_rate = getattr(self, '_loaded_default_tax_rate', None)
+        saves_default_tax_rate = not self._state.adding and 'default_tax_rate' in kwargs['update_fields']
+
+        if not saves_default_tax_rate or (
+                loaded_default_tax_rate is not None and not default_tax_rate_changed(loaded_default_tax_rate)):
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                if loaded_default_tax_rate is None:
+                    # Deferred when loaded, read under lock until the rows are refilled
+                    loaded_default_tax_rate = Invoice.objects \
+                        .select_for_update() \
+                        .filter(pk=self.pk) \
+                        .values_list('default_tax_rate', flat=True) \
+                        .first()
+
+                super().save(*args, **kwargs)
+                changed = default_tax_rate_changed(loaded_default_tax_rate)
+
+                if changed:
+                    InvoiceRow.objects.filter(invoice=self.pk).fill_amounts()
+                    Invoice.objects.filter(pk=self.pk).refresh_total_amounts()
+
+            if changed:
+                self.refresh_from_db(fields=['stored_total_amount'])
+
+        self._loaded_default_tax_rate = self.default_tax_rate
+
     @property
     def details(self):
         if hasattr(self, '_description'):
@@ -156,6 +305,11 @@ class Invoice(models.Model):
         if self.description:
             return self.description
 
+        if collect_siblings(self, 'details'):
+            return self._description
+
+        record_fallback(self, 'details', 'instance')
+
         return self.rows.first().description
 
     @property
@@ -163,19 +317,28 @@ class Invoice(models.Model):
         if hasattr(self, '_total_amount'):
             return self._total_amount
 
-        rows = self.rows.all()
-        amount = Decimal(0.0)
+        if 'stored_total_amount' in self.get_deferred_fields() and \
+                collect_siblings(self, 'total_amount', default=Decimal(0)):
+            return self._total_amount
 
-        for row in rows:
-            amount += row.amount
+        if 'stored_total_amount' in self.get_deferred_fields():
+            record_fallback(self, 'total_amount', 'instance')
 
-        return Decimal(amount)
+        return self.stored_total_amount
 
 
 class InvoiceRow(models.Model):
+    """
+    Saving a row stores its amounts, and saving or deleting it updates the
+    stored total of its invoice in the same transaction. Bulk writes
+    (`bulk_create()`, `QuerySet.update()`) bypass this, so they have to be
+    followed by `InvoiceRow.objects.filter(...).fill_amounts()` and
+    `Invoice.objects.filter(...).refresh_total_amounts()`.
+    """
     objects = InvoiceRowQuerySet.as_manager()
 
-    invoice = models.ForeignKey(Invoice, related_name='rows')
+    # Indexed by dashboard_invoicerow_invoice_covering (see migration 0006)
+    invoice = models.ForeignKey(Invoice, related_name='rows', db_index=False)
 
     description = models.CharField(max_length=255)
 
@@ -187,11 +350,35 @@ class InvoiceRow(models.Model):
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(decimal_places=2, max_digits=4)
 
+    # Amounts at the time of the last save, kept up to date with the default
+    # tax rate of the invoice. Rows saved before they were added are filled by
+    # migration 0007, rows written around `save()` since by
+    # `python manage.py backfill_row_amounts`; until then `collect()` computes
+    # their amounts.
+    stored_amount_without_tax = models.DecimalField(
+        null=True,
+        decimal_places=4,
+        max_digits=20,
+        editable=False,
+        db_column='amount_without_tax'
+    )
+    stored_amount = models.DecimalField(
+        null=True,
+        decimal_places=4,
+        max_digits=20,
+        editable=False,
+        db_column='amount'
+    )
+
     @property
     def amount_without_tax(self):
         if hasattr(self, '_amount_without_tax'):
             return self._amount_without_tax
 
+        if 'stored_amount_without_tax' not in self.get_deferred_fields() and \
+                self.stored_amount_without_tax is not None:
+            return self.stored_amount_without_tax
+
         return Decimal(self.quantity * self.unit_price)
 
     @property
@@ -199,11 +386,140 @@ class InvoiceRow(models.Model):
         if hasattr(self, '_amount'):
             return self._amount
 
+        if 'stored_amount' not in self.get_deferred_fields() and self.stored_amount is not None:
+            return self.stored_amount
+
         without_tax = self.amount_without_tax
 
         if self.tax_rate != 0:
             tax = Decimal(self.tax_rate)
+        elif not InvoiceRow.invoice.is_cached(self) and collect_siblings(self, 'amount'):
+            return self._amount
         else:
+            if not InvoiceRow.invoice.is_cached(self):
+                record_fallback(self, 'amount', 'instance')
+
             tax = Decimal(self.invoice.default_tax_rate)
 
         return Decimal(without_tax * (1 + tax))
+
+    def fill_stored_amounts(self):
+        """
+        Computes the stored amounts from the current values. Rows without own
+        tax rate lock their invoice, so its default tax rate can't change
+        until the transaction ends.
+        """
+        def value(name):
+            return self._meta.get_field(name).to_python(getattr(self, name))
+
+        tax_rate = value('tax_rate')
+
+        if not tax_rate:
+            tax_rate = Invoice.objects \
+                .select_for_update() \
+                .filter(pk=self.invoice_id) \
+                .values_list('default_tax_rate', flat=True) \
+                .get()
+
+        self.stored_amount_without_tax = value('quantity') * value('unit_price')
+        self.stored_amount = self.stored_amount_without_tax * (1 + tax_rate)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+
+            if self.pk is not None:
+                previous = InvoiceRow.objects \
+                    .select_for_update() \
+                    .filter(pk=self.pk) \
+                    .values('invoice', amount=Coalesce('stored_amount', InvoiceRowQuerySet._computed_amount())) \
+                    .first()
+
+            self.fill_stored_amounts()
+
+            super().save(*args, **kwargs)
+
+            if previous is not None:
+                if previous['invoice'] == self.invoice_id and previous['amount'] == self.stored_amount:
+                    return
+
+                Invoice.objects.filter(pk=previous['invoice']).add_to_total_amount(-previous['amount'])
+
+            Invoice.objects.filter(pk=self.invoice_id).add_to_total_amount(self.stored_amount)
+
+
+@receiver(pre_delete, sender=InvoiceRow)
+def subtract_deleted_row_amount(sender, instance, **kwargs):
+    # The amount is read from the database, as the instance may be stale
+    amount = InvoiceRow.objects \
+        .filter(pk=instance.pk) \
+        .values_list(Coalesce('stored_amount', InvoiceRowQuerySet._computed_amount()))[:1]
+
+    Invoice.objects \
+        .filter(rows=instance.pk) \
+        .add_to_total_amount(-1 * Subquery(queryset=amount, output_field=models.DecimalField()))
+
+
+# Changes invalidate the cached results reading the table (see `dashboard/cache.py`)
+for cached_model in (Club, Party, VisitorToParty, Invoice, InvoiceRow):
+    post_save.connect(cache.model_changed, sender=cached_model)
+    post_delete.connect(cache.model_changed, sender=cached_model)
+
+
+class InvoiceSummary(models.Model):
+    """
+    Precomputed `collect()` values of an invoice (see `dashboard/summaries.py`).
+    """
+    invoice = models.OneToOneField(
+        Invoice,
+        primary_key=True,
+        related_name='summary',
+        on_delete=models.DO_NOTHING
+    )
+    details = models.CharField(max_length=255, null=True)
+    total_amount = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'dashboard_invoice_summary'
+
+
+class PartySummary(models.Model):
+    """
+    Precomputed `collect()` values of a party (see `dashboard/summaries.py`).
+    """
+    party = models.OneToOneField(
+        Party,
+        primary_key=True,
+        related_name='summary',
+        on_delete=models.DO_NOTHING
+    )
+    invoices_count = models.IntegerField(null=True)
+    total_party_income = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'dashboard_party_summary'
+
+
+class ClubSummary(models.Model):
+    """
+    Precomputed `collect()` values of a club (see `dashboard/summaries.py`).
+    """
+    club = models.OneToOneField(
+        Club,
+        primary_key=True,
+        related_name='summary',
+        on_delete=models.DO_NOTHING
+    )
+    first_party_name = models.CharField(max_length=255, null=True)
+    first_party_income = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+    last_party_name = models.CharField(max_length=255, null=True)
+    last_party_income = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+    average_income_per_party = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+    parties_count = models.IntegerField(null=True)
+    total_incomes = models.DecimalField(decimal_places=4, max_digits=20, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'dashboard_club_summary'
@@ -0,0 +1,149 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over `(sort key, pk)`.
+
+    Every page is fetched with `WHERE (key, pk) > (last key, last pk)` and a
+    `LIMIT`, so deep pages cost the same as the first one and no `COUNT(*)`
+    runs over the annotated queryset. The sort key comes from the view's
+    `get_ordering()` and has to be non-null. Only a `next` link is provided.
+
+    `paginate_snapshot()` pages a `Snapshot` (see `dashboard/snapshots.py`)
+    the same way, with interchangeable cursors.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def setup(self, request, view):
+        self.request = request
+        self.page_size = view.page_size
+        self.ordering = view.get_ordering()
+        self.descending = self.ordering.startswith('-')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.setup(request, view)
+        self.key = view.get_ordering_key(self.ordering)
+
+        position = self.decode_cursor(request)
+
+        if position is not None:
+            value, pk = self.to_python(queryset, position)
+            operator = 'lt' if self.descending else 'gt'
+            keyset = Q(**{'pk__{}'.format(operator): pk})
+
+            if self.key != 'pk':
+                keyset = Q(**{'{}__{}'.format(self.key, operator): value}) | (Q(**{self.key: value}) & keyset)
+
+            queryset = queryset.filter(keyset)
+
+        prefix = '-' if self.descending else ''
+
+        if self.key == 'pk':
+            queryset = queryset.order_by(prefix + 'pk')
+        else:
+            queryset = queryset.order_by(prefix + self.key, prefix + 'pk')
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.has_next:
+            last = results[-1]
+            self.next_position = (getattr(last, self.key), last.pk)
+
+        return results
+
+    def to_python(self, queryset, position):
+        """
+        Converts the cursor position to the types of the sort key and pk.
+        """
+        value, pk = position
+
+        try:
+            pk = queryset.model._meta.pk.to_python(pk)
+
+            if self.key != 'pk':
+                annotation = queryset.query.annotations.get(self.key)
+                field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(self.key)
+                value = field.to_python(value)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, pk
+
+    def paginate_snapshot(self, snapshot, request, view=None):
+        self.setup(request, view)
+        self.key = self.ordering.lstrip('-')
+
+        position = self.decode_cursor(request)
+
+        if position is not None:
+            value, pk = position
+            keys = snapshot.ordered(self.key)[0]
+
+            # Cursor values are strings, snapshot values are JSON types
+            try:
+                if keys and isinstance(keys[0][0], (int, float)):
+                    value = float(value)
+
+                position = (value, int(pk))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = snapshot.page(self.key, self.descending, after=position, size=self.page_size + 1)
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.has_next:
+            last = results[-1]
+            self.next_position = (last[self.key], last['id'])
+
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        value, pk = position
+        payload = json.dumps([self.ordering, str(value), pk])
+
+        return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if encoded is None:
+            return None
+
+        try:
+            ordering, value, pk = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor is only valid for the ordering it was created with
+        if ordering != self.ordering:
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, pk
@@ -0,0 +1,233 @@
+"""
+Server-side prepared statements for the collected queries on PostgreSQL.
+
+Planning the nested SQL of `collect()` can take longer than running it on
+small clubs. With `DASHBOARD_PREPARED_STATEMENTS` on, the SQL of every shape
+compiled more than once (see `dashboard/compiled.py`) is `PREPARE`d once per
+database session and run as `EXECUTE name (params)` afterwards, so PostgreSQL
+can reuse its plans: after five custom plans it switches to the generic plan
+of a statement, unless that is estimated to be worse.
+
+The statements are tracked per database session, i.e. psycopg2 connection,
+so a reconnect (e.g. after `CONN_MAX_AGE`) starts over and a pooled
+connection keeps its statements. At most `DASHBOARD_PREPARED_STATEMENTS_MAX` live
+in a session, the least recently used one is `DEALLOCATE`d to make room, and
+after a failed `EXECUTE` (e.g. when a migration changed a table) all of them
+are deallocated before the next `PREPARE`. Queries read through a server-side
+cursor (`.iterator()`) run unprepared, as `DECLARE` takes no `EXECUTE`.
+
+The planning time of every statement is measured once per process with
+`EXPLAIN (SUMMARY)`. `report()` multiplies it by the `EXECUTE`s since - an
+upper bound of the planning time saved, as custom plans still plan - served to
+staff users at `/dashboard/prepared-statements/`.
+"""
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import re
+import weakref
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, ProgrammingError, transaction
+from django.db.models.sql.constants import MULTI
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL types of the parameters by Python type, the first match wins
+PARAMETER_TYPES = (
+    (bool, 'boolean'),
+    (int, 'bigint'),
+    (Decimal, 'numeric'),
+    (float, 'double precision'),
+    (str, 'text'),
+    (datetime.datetime, 'timestamp with time zone'),
+    (datetime.date, 'date'),
+)
+
+PLACEHOLDER = re.compile(r'%(%|s)')
+
+# {name: {'sql', 'planning_time', 'executions'}} of the current process
+stats = {}
+# (sql, types) which failed to prepare, run unprepared from then on
+unpreparable = set()
+# {psycopg2 connection: SessionStatements}
+sessions = weakref.WeakKeyDictionary()
+
+
+class SessionStatements(object):
+    """
+    The statements prepared in one database session, least recently used
+    first.
+    """
+
+    def __init__(self):
+        self.names = OrderedDict()
+        self.invalid = False
+
+
+def session_statements(connection):
+    statements = sessions.get(connection.connection)
+
+    if statements is None:
+        statements = sessions[connection.connection] = SessionStatements()
+
+    return statements
+
+
+def positional(sql):
+    """
+    `sql` with `$1`, `$2`, ... instead of the `%s` placeholders, as it's
+    passed to the server as it is.
+    """
+    numbers = itertools.count(1)
+
+    return PLACEHOLDER.sub(lambda match: '%' if match.group(1) == '%' else '${}'.format(next(numbers)), sql)
+
+
+def parameter_types(params):
+    """
+    The PostgreSQL types of `params`, or None if one of them has no known type.
+    """
+    types = []
+
+    for param in params:
+        for python_type, db_type in PARAMETER_TYPES:
+            if isinstance(param, python_type):
+                types.append(db_type)
+                break
+        else:
+            return None
+
+    return tuple(types)
+
+
+def statement_name(sql, types):
+    return 'dashboard_{}'.format(hashlib.md5(repr((sql, types)).encode('utf-8')).hexdigest()[:16])
+
+
+def planning_time(cursor, sql, params):
+    """
+    The planning time of `sql` in milliseconds (PostgreSQL 10+).
+    """
+    if cursor.db.pg_version < 100000:
+        return None
+
+    cursor.execute('EXPLAIN (SUMMARY, FORMAT JSON) {}'.format(sql), params)
+    plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Planning Time']
+
+
+def prepare(connection, sql, params):
+    """
+    Returns the `EXECUTE` statement running `sql` with `params`, prepared on
+    `connection` if it wasn't yet, or None if it can't be.
+    """
+    types = parameter_types(params)
+
+    if types is None or (sql, types) in unpreparable:
+        return None
+
+    connection.ensure_connection()
+    statements = session_statements(connection)
+    name = statement_name(sql, types)
+
+    if name in statements.names:
+        statements.names.move_to_end(name)
+    else:
+        try:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                if statements.invalid:
+                    cursor.execute('DEALLOCATE ALL')
+                    statements.names.clear()
+                    statements.invalid = False
+
+                while len(statements.names) >= settings.DASHBOARD_PREPARED_STATEMENTS_MAX:
+                    cursor.execute('DEALLOCATE {}'.format(statements.names.popitem(last=False)[0]))
+
+                if name not in stats:
+                    stats[name] = {'sql': sql, 'planning_time': planning_time(cursor, sql, params), 'executions': 0}
+
+                cursor.execute('PREPARE {} ({}) AS {}'.format(name, ', '.join(types), positional(sql)))
+        except DatabaseError as error:
+            logger.warning('Running unprepared, PREPARE failed for: {}'.format(sql), exc_info=True)
+
+            # Not for connection errors, these may be gone with the next session
+            if isinstance(error, (DataError, ProgrammingError)):
+                unpreparable.add((sql, types))
+
+            return None
+
+        statements.names[name] = True
+
+    stats[name]['executions'] += 1
+
+    return 'EXECUTE {}{}'.format(name, ' ({})'.format(', '.join(['%s'] * len(params))) if params else '')
+
+
+def use_prepared(compiler, sql, params):
+    """
+    Makes `compiler` execute `sql` with `params` as a prepared statement, if
+    enabled on PostgreSQL. `compiler.as_sql()` keeps returning `sql`.
+    """
+    connection = compiler.connection
+
+    if not settings.DASHBOARD_PREPARED_STATEMENTS or connection.vendor != 'postgresql':
+        return
+
+    as_sql = compiler.as_sql
+    execute_sql = compiler.execute_sql
+
+    def execute_prepared_sql(result_type=MULTI, chunked_fetch=False):
+        # A named cursor runs `DECLARE ... CURSOR FOR <sql>`, which can't
+        # take an `EXECUTE`
+        if chunked_fetch:
+            return execute_sql(result_type, chunked_fetch)
+
+        statement = prepare(connection, sql, params)
+
+        if statement is None:
+            return execute_sql(result_type, chunked_fetch)
+
+        compiler.as_sql = lambda *args, **kwargs: (statement, params)
+
+        try:
+            return execute_sql(result_type, chunked_fetch)
+        except DatabaseError:
+            session_statements(connection).invalid = True
+            raise
+        finally:
+            compiler.as_sql = as_sql
+
+    compiler.execute_sql = execute_prepared_sql
+
+
+def report():
+    """
+    The prepared statements of the current process with their planning time
+    and the planning time saved since, the most saving first. Times are in
+    milliseconds.
+    """
+    rows = []
+
+    for name, entry in list(stats.items()):
+        planning = entry['planning_time']
+
+        rows.append(OrderedDict([
+            ('statement', name),
+            ('sql', entry['sql']),
+            ('executions', entry['executions']),
+            ('planning_time', planning),
+            ('saved_time', planning * entry['executions'] if planning is not None else None),
+        ]))
+
+    rows.sort(key=lambda row: -(row['saved_time'] or 0))
+
+    return rows
@@ -0,0 +1,130 @@
+"""
+Query counting and query budgets, cheap enough for production.
+
+`count_queries()` counts the queries, their database time and the runs of
+every SQL statement on all connections of the current thread:
+
+    with count_queries() as stats:
+        ...
+
+    stats.count, stats.time, stats.duplicates()
+
+The same SQL run over and over with different params is how the per-instance
+fallbacks of the model properties (N+1 queries) show up, so
+`check_budget()` reports those as well as too many queries.
+`QueryBudgetMiddleware` checks every request against its budget.
+"""
+import time
+from collections import Counter
+
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+_missing = object()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats(object):
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.time += duration
+        self.statements[sql] += 1
+
+    def duplicates(self, limit=1):
+        """
+        Returns the SQL statements run more than `limit` times, with their
+        number of runs.
+        """
+        return {sql: count for sql, count in self.statements.items() if count > limit}
+
+
+class CountingCursorWrapper(CursorWrapper):
+    def __init__(self, cursor, db, stats):
+        super().__init__(cursor, db)
+        self.stats = stats
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.stats.add(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.stats.add(sql, time.perf_counter() - started)
+
+
+class count_queries(object):
+    """
+    Counts the queries run through the cursors opened on the connections of
+    the current thread (only on `using`, if given) while active. Usable as a
+    context manager or with `start()` and `stop()`, and nestable.
+    """
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using is not None else list(connections)
+        self.stats = QueryStats()
+        self.replaced = []
+
+    def start(self):
+        for alias in self.aliases:
+            connection = connections[alias]
+            # The wrapper of an outer counter, if any
+            previous = connection.__dict__.get('_prepare_cursor', _missing)
+            prepare_cursor = connection._prepare_cursor
+
+            def counting_prepare_cursor(cursor, prepare_cursor=prepare_cursor, connection=connection):
+                return CountingCursorWrapper(prepare_cursor(cursor), connection, self.stats)
+
+            connection._prepare_cursor = counting_prepare_cursor
+            self.replaced.append((connection, previous))
+
+        return self.stats
+
+    def stop(self):
+        while self.replaced:
+            connection, previous = self.replaced.pop()
+
+            if previous is _missing:
+                del connection._prepare_cursor
+            else:
+                connection._prepare_cursor = previous
+
+        return self.stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def check_budget(stats, budget=None, duplicate_limit=None):
+    """
+    Returns messages describing how `stats` exceed the number of queries
+    `budget` and the runs of the same SQL `duplicate_limit`.
+    """
+    violations = []
+
+    if budget is not None and stats.count > budget:
+        violations.append('{} queries exceed the budget of {}'.format(stats.count, budget))
+
+    if duplicate_limit is not None:
+        for sql, count in sorted(stats.duplicates(duplicate_limit).items(), key=lambda item: -item[1]):
+            violations.append('{} runs of: {}'.format(count, sql))
+
+    return violations
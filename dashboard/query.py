@@ -1,9 +1,15 @@
+from collections import OrderedDict
 from decimal import Decimal
+from functools import wraps
 
-from django.db import models
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import FieldError
+from django.db import models, transaction
 from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.db.models import (
+    Prefetch,
     When,
     Case,
     Count,
@@ -16,32 +22,301 @@ from django.db.models import (
     Value,
 )
 
+from . import cache, compiled, routers
+from .joins import left_join, derived_aliases, DerivedCol, RowNumber
+from .rows import RowIterable
+from .siblings import SiblingsModelIterable
+from .split import SplitCollectIterable
+
+
+def collect_method(method):
+    """
+    Decorates the `collect*(*fields)` methods: the querysets they return
+    remember the collected shape, and collected from a plain queryset they
+    get a clone of the annotated query built once per process (see
+    `dashboard/compiled.py`). They are read from a replica, if any (see
+    `dashboard/routers.py`).
+    """
+
+    @wraps(method)
+    def collect(self, *fields):
+        shape = None if self._shape is None else self._shape + ((method.__name__, fields), )
+
+        if settings.DASHBOARD_COMPILED_SQL and compiled.is_plain(self.query):
+            queryset = self._clone()
+            queryset.query = compiled.collected_query(self, method.__name__, fields, lambda: method(self, *fields))
+        else:
+            queryset = method(self, *fields)
+
+        queryset._shape = shape
+
+        return queryset.on_replica()
+
+    return collect
+
+
+class CollectQuerySet(QuerySet):
+    """
+    `collect(*fields)` annotates the private (`_`-prefixed) values behind the
+    model properties named in `fields`, or all of them when no fields are
+    given, so the properties don't fall back to per-instance queries.
+
+    Instances loaded without `collect()` remember their siblings, so a
+    property fallback can collect its value for all of them at once (see
+    `collect_siblings()`).
+
+    `cached()` serves the results from the result cache (see
+    `dashboard/cache.py`). `update()` and `bulk_create()` invalidate it.
+
+    The SQL of querysets which are only collected, filtered, ordered, sliced
+    and narrowed with `only()` or `defer()` is compiled once per shape (see
+    `dashboard/compiled.py`).
+
+    `on_replica()` reads the queryset from a replica (see
+    `dashboard/routers.py`), as the collected querysets are.
+
+    `collect_split(*fields)` collects every field by its own query, run
+    concurrently (see `dashboard/split.py`).
+
+    `rows(*names)` loads compact records instead of model instances (see
+    `dashboard/rows.py`).
+    """
+    # Model properties whose private value is not named `_<property>`
+    private_names = {}
+    # Values of the properties for objects without summary (see `collect_summary()`)
+    summary_defaults = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterable_class = SiblingsModelIterable
+        self._cached = False
+        self._cache_timeout = DEFAULT_TIMEOUT
+        # The collect*() calls which made the annotations, None after others
+        self._shape = ()
+        # The fields collected by separate queries (see `collect_split()`)
+        self._split_fields = ()
+
+    def _clone(self, **kwargs):
+        kwargs.setdefault('_cached', self._cached)
+        kwargs.setdefault('_cache_timeout', self._cache_timeout)
+        kwargs.setdefault('_shape', self._shape)
+        kwargs.setdefault('_split_fields', self._split_fields)
+
+        return super()._clone(**kwargs)
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._cached:
+            self._result_cache = cache.fetch_cached(
+                queryset=self,
+                fetch=lambda: list(self._iterable_class(self)),
+                timeout=self._cache_timeout
+            )
+
+        super()._fetch_all()
+
+    def cached(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Evaluates the queryset through the result cache, keeping results for
+        `timeout` seconds (the cache's default timeout if omitted). Only the
+        main query is cached: `iterator()`, `count()`, `aggregate()` and
+        prefetches still hit the database.
+        """
+        return self._clone(_cached=True, _cache_timeout=timeout)
+
+    def on_replica(self):
+        """
+        Reads the queryset from the replica of the current request, or the
+        next one, unless reads are pinned to the primary.
+        """
+        replica = routers.choose_replica()
+
+        if replica is None or self._hints.get('replica') == replica:
+            return self
+
+        queryset = self._clone()
+        # Shared between clones
+        queryset._hints = dict(self._hints, replica=replica)
 
-class InvoiceRowQuerySet(QuerySet):
-    __tax = Case(
-        When(tax_rate__gt=0.0, then=F('tax_rate')),
-        default=F('invoice__default_tax_rate'),
-        output_field=models.DecimalField(default=Decimal(0.0))
-    )
-    _amount_without_tax = ExpressionWrapper(
-        expression=F('quantity') * F('unit_price'),
-        output_field=models.DecimalField()
-    )
-    _amount = ExpressionWrapper(
-        expression=_amount_without_tax * (1 + __tax),
-        output_field=models.DecimalField(default=Decimal(0.0))
-    )
-
-    def collect(self):
-        private_fields = {
-            '_amount_without_tax': self.__class__._amount_without_tax,
-            '_amount': self.__class__._amount
-        }
+        return queryset
+
+    def rows(self, *names):
+        """
+        Loads `names` - `pk`, fields or collected private names - as records
+        readable by attribute (see `dashboard/rows.py`) instead of model
+        instances, without any property fallback.
+        """
+        queryset = self.values_list(*names)
+        queryset._iterable_class = RowIterable
+
+        return queryset
+
+    def annotate(self, *args, **kwargs):
+        queryset = super().annotate(*args, **kwargs)
+        queryset._shape = None
+
+        return queryset
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        cache.tables_changed([self.model._meta.db_table], using=self.db)
+
+        return rows
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = super().bulk_create(objs, batch_size=batch_size)
+        cache.tables_changed([self.model._meta.db_table], using=self.db)
+
+        return objs
+
+    def private_fields(self):
+        return ()
+
+    @classmethod
+    def private_name(cls, field):
+        return cls.private_names.get(field, '_{}'.format(field))
+
+    def collectable_fields(self):
+        public_names = {private: public for public, private in self.private_names.items()}
+
+        return [public_names.get(name, name[1:]) for name in self.private_fields()]
+
+    def select_private_fields(self, private_fields, fields):
+        private_fields = OrderedDict(private_fields)
+
+        if not fields:
+            return private_fields
+
+        selected = OrderedDict()
+
+        for field in fields:
+            name = self.private_name(field)
+
+            if name not in private_fields:
+                raise FieldError(
+                    "Cannot collect '{}' for {}. Choices are: {}".format(
+                        field,
+                        self.model.__name__,
+                        ', '.join(self.collectable_fields())
+                    )
+                )
+
+            selected[name] = private_fields[name]
+
+        return selected
+
+    @collect_method
+    def collect(self, *fields):
+        private_fields = self.select_private_fields(self.private_fields(), fields)
 
         return self.annotate(**private_fields)
 
+    def collect_split(self, *fields):
+        """
+        Same as `collect()`, but the values are collected for the loaded
+        instances by one query per field, run concurrently over separate
+        connections (see `dashboard/split.py`). The queryset can't be
+        filtered or ordered by them.
+        """
+        private_fields = self.select_private_fields(self.private_fields(), fields)
+        public_names = {self.private_name(field): field for field in self.collectable_fields()}
+
+        queryset = self._clone(_split_fields=tuple(public_names[name] for name in private_fields))
+        queryset._iterable_class = SplitCollectIterable
+
+        return queryset.on_replica()
+
+    @collect_method
+    def collect_summary(self, *fields):
+        """
+        Same as `collect()`, but the values are read from the model's
+        precomputed summary (see `dashboard/summaries.py`), so they are as
+        fresh as its last refresh. Objects created since then get NULLs, or
+        the `summary_defaults` which `collect()` would give them.
+        """
+        summary_fields = OrderedDict()
+
+        for field in self.collectable_fields():
+            value = F('summary__{}'.format(field))
+
+            if field in self.summary_defaults:
+                value = Coalesce(value, Value(self.summary_defaults[field]))
+
+            summary_fields[self.private_name(field)] = value
+
+        private_fields = self.select_private_fields(summary_fields, fields)
+
+        return self.annotate(**private_fields)
+
+
+class InvoiceRowQuerySet(CollectQuerySet):
+    @classmethod
+    def _amount_without_tax(self):
+        return Coalesce('stored_amount_without_tax', self._computed_amount_without_tax())
+
+    @classmethod
+    def _amount(self):
+        """
+        The stored amount, or for rows written in bulk and not filled yet the
+        computed one. Its subquery only runs for those rows, and reads the
+        invoices' covering index (see migration 0008).
+        """
+        return Coalesce('stored_amount', self._computed_amount(self._invoice_default_tax_rate()))
+
+    @classmethod
+    def _invoice_default_tax_rate(self):
+        from .models import Invoice
+
+        return Subquery(
+            queryset=Invoice.objects.filter(pk=OuterRef('invoice_id')).values('default_tax_rate')[:1],
+            output_field=models.DecimalField()
+        )
+
+    @classmethod
+    def _computed_amount_without_tax(self):
+        return ExpressionWrapper(
+            expression=F('quantity') * F('unit_price'),
+            output_field=models.DecimalField()
+        )
+
+    @classmethod
+    def _computed_amount(self, default_tax_rate=F('invoice__default_tax_rate')):
+        """
+        The amount computed from the row's columns. `default_tax_rate` is the
+        expression used for rows without own tax rate.
+        """
+        tax = Case(
+            When(tax_rate__gt=0.0, then=F('tax_rate')),
+            default=default_tax_rate,
+            output_field=models.DecimalField(default=Decimal(0.0))
+        )
+
+        return ExpressionWrapper(
+            expression=self._computed_amount_without_tax() * (1 + tax),
+            output_field=models.DecimalField(default=Decimal(0.0))
+        )
+
+    def fill_amounts(self):
+        """
+        (Re)computes the stored amounts of the rows in the queryset with a
+        single UPDATE.
+        """
+        return self.update(
+            stored_amount_without_tax=self._computed_amount_without_tax(),
+            stored_amount=self._computed_amount(self._invoice_default_tax_rate())
+        )
+
+    def private_fields(self):
+        return {
+            '_amount_without_tax': self._amount_without_tax(),
+            '_amount': self._amount()
+        }
+
+
+class InvoiceQuerySet(CollectQuerySet):
+    private_names = {
+        'details': '_description'
+    }
 
-class InvoiceQuerySet(QuerySet):
     @classmethod
     def _first_row_description_qs(self):
         from .models import InvoiceRow
@@ -57,8 +332,15 @@ class InvoiceQuerySet(QuerySet):
 
     @classmethod
     def _description(self):
+        # An empty description falls back to the first row's, as in `Invoice.details`
+        description = Case(
+            When(description='', then=Value(None)),
+            default=F('description'),
+            output_field=models.CharField()
+        )
+
         return Coalesce(
-            'description',
+            description,
             self._first_row_description_qs(),
             default='',
             output_field=models.CharField()
@@ -66,51 +348,89 @@ class InvoiceQuerySet(QuerySet):
 
     @classmethod
     def _total_amount(self):
+        return F('stored_total_amount')
+
+    @classmethod
+    def _rows_total_amount(self):
         from .models import InvoiceRow
 
         queryset = InvoiceRow.objects \
             .filter(invoice__id=OuterRef('id')) \
             .values('invoice__id') \
-            .values_list(Sum(InvoiceRowQuerySet._amount))[:1]
+            .annotate(total_amount=Sum(InvoiceRowQuerySet._amount())) \
+            .values_list('total_amount')[:1]
 
-        return Subquery(
-            queryset=queryset,
-            output_field=models.IntegerField()
+        return Coalesce(
+            Subquery(
+                queryset=queryset,
+                output_field=models.DecimalField()
+            ),
+            Value(0)
         )
 
-    def collect(self):
-        private_fields = {
+    def add_to_total_amount(self, amount):
+        """
+        Adds `amount` (a value or an expression, negative to subtract) to the
+        stored totals with a single `UPDATE ... SET total_amount =
+        total_amount + ...`, so concurrent writers can't lose each other's
+        changes.
+        """
+        if not hasattr(amount, 'resolve_expression'):
+            amount = Value(amount, output_field=models.DecimalField())
+
+        return self.update(stored_total_amount=F('stored_total_amount') + amount)
+
+    def refresh_total_amounts(self):
+        """
+        Recomputes the stored totals from the stored amounts of the rows, e.g.
+        after rows were written with `bulk_create()` or `update()`, which
+        bypass `InvoiceRow.save()`.
+        """
+        return self.update(stored_total_amount=self._rows_total_amount())
+
+    def update(self, **kwargs):
+        """
+        Refills the stored amounts of the rows and the totals of the invoices
+        when their `default_tax_rate` is changed, in the same transaction.
+        """
+        if 'default_tax_rate' not in kwargs:
+            return super().update(**kwargs)
+
+        from .models import InvoiceRow
+
+        with transaction.atomic(using=self.db):
+            # Taken before the update, which may change what the filters match
+            pks = list(self.select_for_update().values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+
+            InvoiceRow.objects.using(self.db).filter(invoice__in=pks).fill_amounts()
+            self.model.objects.using(self.db).filter(pk__in=pks).refresh_total_amounts()
+
+        return updated
+
+    def private_fields(self):
+        return {
             '_description': self._description(),
             '_total_amount': self._total_amount()
         }
 
-        return self.annotate(**private_fields)
-
 
-class VisitorToPartyQuerySet(QuerySet):
+class VisitorToPartyQuerySet(CollectQuerySet):
     @classmethod
     def _invoice_amount(self):
-        from .models import InvoiceRow
-
-        queryset = InvoiceRow.objects \
-            .filter(invoice__id=OuterRef('invoice__id')) \
-            .values('invoice__id') \
-            .values_list(Sum(InvoiceRowQuerySet._amount))[:1]
+        return F('invoice__stored_total_amount')
 
-        return Subquery(
-            queryset=queryset,
-            output_field=models.IntegerField()
-        )
-
-    def collect(self):
-        private_fields = {
+    def private_fields(self):
+        return {
             '_invoice_amount': self._invoice_amount(),
         }
 
-        return self.annotate(**private_fields)
 
+class PartyQuerySet(CollectQuerySet):
+    summary_defaults = {
+        'invoices_count': 0
+    }
 
-class PartyQuerySet(QuerySet):
     @classmethod
     def _invoices_count(self):
         from .models import VisitorToParty
@@ -118,7 +438,8 @@ class PartyQuerySet(QuerySet):
         queryset = VisitorToParty.objects \
             .filter(invoice__id__isnull=False, party__id=OuterRef('id')) \
             .values('party__id') \
-            .values_list(Count('id'))[:1]
+            .annotate(invoices_count=Count('invoice')) \
+            .values_list('invoices_count')[:1]
 
         return Coalesce(
             Subquery(
@@ -133,25 +454,84 @@ class PartyQuerySet(QuerySet):
         from .models import VisitorToParty
 
         queryset = VisitorToParty.objects \
-            .filter(party__id=OuterRef('id')) \
+            .filter(invoice__id__isnull=False, party__id=OuterRef('id')) \
             .values('party__id') \
-            .values_list(Sum(VisitorToPartyQuerySet._invoice_amount()))[:1]
+            .annotate(total_party_income=Sum(VisitorToPartyQuerySet._invoice_amount())) \
+            .values_list('total_party_income')[:1]
 
         return Subquery(
             queryset=queryset,
             output_field=models.DecimalField()
         )
 
-    def collect(self):
-        private_fields = {
+    @classmethod
+    def _party_totals_table(self):
+        from .models import VisitorToParty
+
+        # Connections without invoice add nothing, and filtering them out
+        # lets the partial dashboard_visitortoparty_party_invoice index cover it
+        return VisitorToParty.objects \
+            .filter(invoice__isnull=False) \
+            .order_by() \
+            .values('party') \
+            .annotate(
+                total_party_income=Sum(VisitorToPartyQuerySet._invoice_amount()),
+                invoices_count=Count('invoice')
+            )
+
+    def private_fields(self):
+        return {
             '_invoices_count': self._invoices_count(),
             '_total_party_income': self._total_party_income()
         }
 
-        return self.annotate(**private_fields)
+    @collect_method
+    def collect_joined(self, *fields):
+        """
+        Same as `collect()`, but the per-party totals are computed once as a
+        grouped derived table and LEFT JOINed to the parties instead of being
+        re-run as correlated subqueries per row.
+        """
+        private_fields = self.select_private_fields({
+            '_invoices_count': Coalesce(
+                DerivedCol('party_totals', 'invoices_count', models.IntegerField()),
+                Value(0)
+            ),
+            '_total_party_income': DerivedCol('party_totals', 'total_party_income', models.DecimalField())
+        }, fields)
+
+        queryset = left_join(
+            queryset=self,
+            derived_queryset=self._party_totals_table(),
+            alias='party_totals',
+            column='party_id'
+        )
+
+        return queryset.annotate(**private_fields)
+
+    def with_tree(self):
+        """
+        Prefetches visitortoparty_set -> invoice with only the columns the
+        Python fallbacks read, so `total_party_income` and `invoices_count`
+        are computed from the prefetched objects without further queries.
+        """
+        from .models import VisitorToParty
+
+        visitortoparty_set = VisitorToParty.objects \
+            .select_related('invoice') \
+            .only('party', 'invoice', 'invoice__stored_total_amount')
+
+        return self.prefetch_related(
+            Prefetch('visitortoparty_set', queryset=visitortoparty_set, to_attr='_prefetched_visitortoparty_set')
+        )
 
 
-class ClubQueryset(QuerySet):
+class ClubQueryset(CollectQuerySet):
+    summary_defaults = {
+        'parties_count': 0,
+        'total_incomes': 0
+    }
+
     @classmethod
     def _first_party_name(self):
         from .models import Party
@@ -174,7 +554,8 @@ class ClubQueryset(QuerySet):
             .filter(club__id=OuterRef('id')) \
             .order_by('id') \
             .values('club__id') \
-            .values_list(PartyQuerySet._total_party_income())[:1]
+            .annotate(first_party_income=PartyQuerySet._total_party_income()) \
+            .values_list('first_party_income')[:1]
 
         return Subquery(
             queryset=queryset,
@@ -200,7 +581,8 @@ class ClubQueryset(QuerySet):
             .filter(club__id=OuterRef('id')) \
             .order_by('-id') \
             .values('club__id') \
-            .values_list(PartyQuerySet._total_party_income())[:1]
+            .annotate(last_party_income=PartyQuerySet._total_party_income()) \
+            .values_list('last_party_income')[:1]
 
         return Subquery(
             queryset=queryset,
@@ -214,7 +596,8 @@ class ClubQueryset(QuerySet):
         queryset = Party.objects \
             .filter(club__id=OuterRef('id')) \
             .values('club__id') \
-            .values_list(Avg(PartyQuerySet._total_party_income()))[:1]
+            .annotate(average_income_per_party=Avg(PartyQuerySet._total_party_income())) \
+            .values_list('average_income_per_party')[:1]
 
         return Subquery(
             queryset=queryset,
@@ -228,7 +611,8 @@ class ClubQueryset(QuerySet):
         queryset = Party.objects \
             .filter(club__id=OuterRef('id')) \
             .values('club__id') \
-            .values_list(Count('id'))
+            .annotate(parties_count=Count('id')) \
+            .values_list('parties_count')
 
         return Coalesce(
             Subquery(
@@ -244,7 +628,8 @@ class ClubQueryset(QuerySet):
         queryset = Party.objects \
             .filter(club__id=OuterRef('id')) \
             .values('club__id') \
-            .values_list(Sum(PartyQuerySet._total_party_income()))[:1]
+            .annotate(total_incomes=Sum(PartyQuerySet._total_party_income())) \
+            .values_list('total_incomes')[:1]
 
         return Coalesce(
             Subquery(
@@ -253,8 +638,46 @@ class ClubQueryset(QuerySet):
             Value(0)
         )
 
-    def collect(self):
-        private_fields = {
+    @classmethod
+    def _ranked_parties_table(self):
+        """
+        Parties with their income, ranked per club in both directions, so the
+        first and the last party of every club come from a single scan.
+        """
+        from .models import Party
+
+        return Party.objects \
+            .order_by() \
+            .collect_joined('total_party_income') \
+            .annotate(
+                first_rank=RowNumber(F('club'), F('id').asc()),
+                last_rank=RowNumber(F('club'), F('id').desc())
+            ) \
+            .values('club', 'name', '_total_party_income', 'first_rank', 'last_rank')
+
+    @classmethod
+    def _club_totals_table(self):
+        from .models import Party
+
+        income = DerivedCol('party_totals', 'total_party_income', models.DecimalField())
+
+        queryset = left_join(
+            queryset=Party.objects.order_by(),
+            derived_queryset=PartyQuerySet._party_totals_table(),
+            alias='party_totals',
+            column='party_id'
+        )
+
+        return queryset \
+            .values('club') \
+            .annotate(
+                parties_count=Count('id'),
+                total_incomes=Sum(income),
+                average_income_per_party=Avg(income)
+            )
+
+    def private_fields(self):
+        return {
             '_first_party_name': self._first_party_name(),
             '_first_party_income': self._first_party_income(),
             '_last_party_name': self._last_party_name(),
@@ -264,4 +687,77 @@ class ClubQueryset(QuerySet):
             '_total_incomes': self._total_incomes()
         }
 
-        return self.annotate(**private_fields)
+    @collect_method
+    def collect_joined(self, *fields):
+        """
+        Same as `collect()`, but the per-party and per-club totals are
+        computed once each as grouped derived tables and LEFT
+        JOINed to `dashboard_club` instead of being re-run as correlated
+        subqueries for every club row. Only the derived tables needed for
+        `fields` are joined.
+        """
+        private_fields = self.select_private_fields({
+            '_first_party_name': DerivedCol('first_party', 'name', models.CharField()),
+            '_first_party_income': DerivedCol('first_party', '_total_party_income', models.DecimalField()),
+            '_last_party_name': DerivedCol('last_party', 'name', models.CharField()),
+            '_last_party_income': DerivedCol('last_party', '_total_party_income', models.DecimalField()),
+            '_average_income_per_party': DerivedCol('club_totals', 'average_income_per_party', models.DecimalField()),
+            '_parties_count': Coalesce(
+                DerivedCol('club_totals', 'parties_count', models.IntegerField()),
+                Value(0)
+            ),
+            '_total_incomes': Coalesce(
+                DerivedCol('club_totals', 'total_incomes', models.DecimalField()),
+                Value(0)
+            )
+        }, fields)
+
+        aliases = derived_aliases(private_fields.values())
+        queryset = self
+
+        if 'club_totals' in aliases:
+            queryset = left_join(
+                queryset=queryset,
+                derived_queryset=self._club_totals_table(),
+                alias='club_totals',
+                column='club_id'
+            )
+
+        if 'first_party' in aliases:
+            queryset = left_join(
+                queryset=queryset,
+                derived_queryset=self._ranked_parties_table(),
+                alias='first_party',
+                column='club_id',
+                name='ranked_parties',
+                conditions=[('first_rank', 1)]
+            )
+
+        if 'last_party' in aliases:
+            queryset = left_join(
+                queryset=queryset,
+                derived_queryset=self._ranked_parties_table(),
+                alias='last_party',
+                column='club_id',
+                name='ranked_parties',
+                conditions=[('last_rank', 1)]
+            )
+
+        return queryset.annotate(**private_fields)
+
+    def with_tree(self):
+        """
+        Prefetches parties -> visitortoparty_set -> invoice (see
+        `PartyQuerySet.with_tree()`), so all aggregate properties are
+        computed in Python from a fixed number of queries.
+        """
+        from .models import Party
+
+        parties = Party.objects \
+            .order_by('id') \
+            .only('club', 'name') \
+            .with_tree()
+
+        return self.prefetch_related(
+            Prefetch('parties', queryset=parties, to_attr='_prefetched_parties')
+        )
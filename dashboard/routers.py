@@ -0,0 +1,181 @@
+"""
+Routing of the dashboard reads to read replicas.
+
+The aliases in `DASHBOARD_REPLICAS` (the `replica_<n>` databases built from
+`DATABASE_REPLICA_URLS`) serve the collected querysets and the querysets of
+the list endpoints, which `CollectQuerySet.on_replica()` marks with a
+`replica` hint for `ReplicaRouter`. Everything else, and every write, goes to
+the primary.
+
+The replica is chosen per request (see `replica_reads()`), or per queryset
+outside of one, by `DASHBOARD_REPLICA_POLICY`: `round_robin`, or
+`least_in_flight` for the replica with the fewest requests reading from it in
+this process.
+
+A write pins the reads of the thread to the primary for
+`DASHBOARD_REPLICA_PIN_SECONDS`, or until its transaction commits and the
+seconds after that, so a writer reads its writes despite replication lag.
+`ReplicaPinningMiddleware` carries the pin over to the next requests of the
+client with a cookie. Other clients may read stale rows meanwhile, which the
+result cache (see `dashboard/cache.py`) keeps no longer than that.
+"""
+import itertools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# The routing state of the current thread: the replica of its request and
+# until when its reads are pinned to the primary
+state = threading.local()
+
+
+class ReplicaSelector(object):
+    """
+    Picks replicas in turn, or the one with the fewest reads in flight
+    (taking turns between equals).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = itertools.count()
+        self.in_flight = Counter()
+
+    def choose(self, replicas, policy):
+        with self.lock:
+            turn = next(self.turns) % len(replicas)
+            replicas = replicas[turn:] + replicas[:turn]
+
+            if policy == 'least_in_flight':
+                return min(replicas, key=lambda alias: self.in_flight[alias])
+
+            return replicas[0]
+
+    def started(self, alias):
+        with self.lock:
+            self.in_flight[alias] += 1
+
+    def finished(self, alias):
+        with self.lock:
+            self.in_flight[alias] -= 1
+
+
+selector = ReplicaSelector()
+
+
+def pin_primary():
+    """
+    Pins the reads of the current thread to the primary for
+    `DASHBOARD_REPLICA_PIN_SECONDS`.
+    """
+    state.pinned_until = time.monotonic() + settings.DASHBOARD_REPLICA_PIN_SECONDS
+    state.wrote = True
+
+
+def is_pinned():
+    if getattr(state, 'pinned_in_transaction', False):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return True
+
+        # Rolled back, or committed and pinned from then on
+        state.pinned_in_transaction = False
+
+    return time.monotonic() < getattr(state, 'pinned_until', 0)
+
+
+def start_request(pinned=False):
+    """
+    Resets the routing state of the current thread for a new request, pinned
+    to the primary if the client wrote recently.
+    """
+    state.replica = None
+    state.wrote = False
+    state.pinned_in_transaction = False
+    state.pinned_until = 0
+
+    if pinned:
+        pin_primary()
+        state.wrote = False
+
+
+def wrote():
+    """
+    Whether the current thread wrote since `start_request()`.
+    """
+    return getattr(state, 'wrote', False)
+
+
+def choose_replica():
+    """
+    The replica to read from, or None for the primary.
+    """
+    if not settings.DASHBOARD_REPLICAS or is_pinned():
+        return None
+
+    return getattr(state, 'replica', None) or selector.choose(
+        settings.DASHBOARD_REPLICAS,
+        settings.DASHBOARD_REPLICA_POLICY
+    )
+
+
+@contextmanager
+def replica_reads(alias=None):
+    """
+    Routes the replica reads of the block to `alias`, or to the replica chosen
+    by `DASHBOARD_REPLICA_POLICY`, which counts as in flight meanwhile.
+    Yields the replica, or None for the primary.
+    """
+    if alias is None:
+        alias = choose_replica()
+
+    if alias not in settings.DASHBOARD_REPLICAS:
+        yield None
+        return
+
+    previous = getattr(state, 'replica', None)
+    state.replica = alias
+    selector.started(alias)
+
+    try:
+        yield alias
+    finally:
+        selector.finished(alias)
+        state.replica = previous
+
+
+class ReplicaRouter(object):
+    """
+    Sends the reads hinted with a `replica` (see
+    `CollectQuerySet.on_replica()`) to that replica unless pinned to the
+    primary, and all writes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = hints.get('replica')
+
+        if replica is None or is_pinned():
+            return None
+
+        return replica
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block and not getattr(state, 'pinned_in_transaction', False):
+            state.pinned_in_transaction = True
+            transaction.on_commit(pin_primary)
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DASHBOARD_REPLICAS:
+            return False
+
+        return None
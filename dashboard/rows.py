@@ -0,0 +1,62 @@
+"""
+Compact records of the columns and collected values of a queryset.
+
+`CollectQuerySet.rows(*names)` loads `names` - `pk`, model fields and the
+`_`-prefixed collected values - as tuples whose items are readable as
+attributes by name, like namedtuples but allowing the `_`-prefixed names.
+Building one costs a tuple instead of a model instance with its state, and
+the SQL is the compiled SQL of the queryset's shape (see
+`dashboard/compiled.py`).
+"""
+from operator import itemgetter
+
+from django.db.models.query import BaseIterable
+
+from . import compiled
+
+# Record classes by names, as few as there are list shapes
+row_classes = {}
+
+
+class Row(tuple):
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (make_row, (self._names, tuple(self)))
+
+
+def row_class(names):
+    """
+    The record class with the attributes `names`, built once per process.
+    """
+    cls = row_classes.get(names)
+
+    if cls is None:
+        attributes = {name: property(itemgetter(idx)) for idx, name in enumerate(names)}
+        attributes.update(__slots__=(), _names=names)
+        cls = row_classes[names] = type('Row', (Row, ), attributes)
+
+    return cls
+
+
+def make_row(names, values):
+    return row_class(names)(values)
+
+
+class RowIterable(BaseIterable):
+    """
+    Yields the records of `queryset.values_list(*names)`. The columns stay in
+    their SQL order, extra selects, fields and then annotations, so they need
+    no reordering.
+    """
+
+    def __iter__(self):
+        query = self.queryset.query
+        names = tuple(query.extra_select) + tuple(query.values_select) + tuple(query.annotation_select)
+        cls = row_class(names)
+
+        compiler = compiled.get_compiler(self.queryset)
+        results = compiler.execute_sql(chunked_fetch=self.chunked_fetch)
+
+        for row in compiler.results_iter(results):
+            yield cls(row)
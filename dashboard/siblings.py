@@ -0,0 +1,90 @@
+import weakref
+
+from django.db.models.query import ModelIterable
+
+from . import compiled
+from .fallbacks import record_fallback
+
+
+class Siblings(list):
+    """
+    Weak references to the model instances loaded by one queryset evaluation.
+    Pickles (and deep-copies) as an empty list, so the instances stay
+    picklable and a copy never batches for the original result.
+    """
+
+    def __reduce__(self):
+        return (self.__class__, ())
+
+
+class SiblingsModelIterable(ModelIterable):
+    """
+    Yields model instances which remember the other instances loaded by the
+    same queryset evaluation in `_siblings`. Instances streamed with
+    `.iterator()` are yielded as they are, so memory stays flat.
+
+    The SQL comes from the compiled SQL cache (see `dashboard/compiled.py`).
+    """
+
+    def __iter__(self):
+        compiled.use_compiler(self.queryset)
+
+        if self.chunked_fetch:
+            yield from super().__iter__()
+            return
+
+        siblings = Siblings()
+
+        for obj in super().__iter__():
+            siblings.append(weakref.ref(obj))
+            obj._siblings = siblings
+
+            yield obj
+
+
+def collect_siblings(instance, field, default=None):
+    """
+    Sets the private value behind the property `field` on `instance` and on
+    all of its siblings which don't have it yet, using a single `collect()`
+    query. `default` replaces NULL results.
+
+    Returns False for instances which were not loaded from a queryset, so the
+    caller can use its per-instance fallback instead.
+    """
+    siblings = getattr(instance, '_siblings', None)
+
+    if not siblings or instance.pk is None:
+        return False
+
+    record_fallback(instance, field, 'siblings')
+
+    queryset = instance.__class__._default_manager.using(instance._state.db)
+    private_name = queryset.private_name(field)
+
+    instances = {instance.pk: [instance]}
+
+    for sibling_ref in siblings:
+        sibling = sibling_ref()
+
+        if sibling is None or sibling is instance or sibling.pk is None or hasattr(sibling, private_name):
+            continue
+
+        instances.setdefault(sibling.pk, []).append(sibling)
+
+    values = dict(
+        queryset
+        .filter(pk__in=list(instances))
+        .collect(field)
+        .values_list('pk', private_name)
+    )
+
+    for pk, objs in instances.items():
+        value = values.get(pk)
+
+        if value is None:
+            value = default
+
+        for obj in objs:
+            setattr(obj, private_name, value)
+
+    return True
@@ -0,0 +1,223 @@
+"""
+Snapshots of the read-heavy list APIs, served from local files.
+
+`build_snapshot()` renders every object of a list API (the views with a
+`snapshot_name`) with all of its serializer fields into
+`<DASHBOARD_SNAPSHOT_DIR>/<snapshot_name>.json`. The file is written next to
+the old one and swapped in with an atomic rename, so readers only ever see
+complete snapshots. `python manage.py build_snapshots` builds them, once or
+every `--interval` seconds.
+
+With `DASHBOARD_SNAPSHOT_DIR` set, these views serve their pages from the
+snapshot without touching the database. A snapshot older than
+`DASHBOARD_SNAPSHOT_MAX_AGE` seconds is still served while a background
+thread rebuilds it (stale-while-revalidate). A failed rebuild, e.g. during
+database maintenance, keeps the old snapshot in service and is retried after
+another `DASHBOARD_SNAPSHOT_MAX_AGE` seconds. Views without a snapshot file
+fall back to the database.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# Loaded snapshots by path, replaced when the file changes
+_snapshots = {}
+# Names of the snapshots being rebuilt and the times of their last rebuilds
+_rebuilding = set()
+_rebuilt_at = {}
+
+
+def snapshot_views():
+    from .views import ClubListApi, PartyListApi
+
+    return (ClubListApi, PartyListApi)
+
+
+def snapshot_path(view_class, directory=None):
+    directory = directory or settings.DASHBOARD_SNAPSHOT_DIR
+
+    return os.path.join(directory, '{}.json'.format(view_class.snapshot_name))
+
+
+class Snapshot(object):
+    """
+    The objects of a snapshot (dicts with the `id` and all serializer fields)
+    ordered by id, with the orderings by other fields sorted on first use.
+    """
+
+    def __init__(self, items, built_at):
+        self.items = items
+        self.built_at = built_at
+        self._orderings = {'id': ([(item['id'], item['id']) for item in items], items)}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as snapshot_file:
+            built_at = os.fstat(snapshot_file.fileno()).st_mtime
+            items = json.loads(snapshot_file.read().decode('utf-8'))
+
+        return cls(items, built_at)
+
+    def age(self):
+        return max(time.time() - self.built_at, 0)
+
+    def ordered(self, field):
+        """
+        Returns the `(field, id)` sort keys in ascending order and the items
+        in the same order.
+        """
+        if field not in self._orderings:
+            keys = sorted((item[field], item['id'], idx) for idx, item in enumerate(self.items))
+
+            self._orderings[field] = (
+                [key[:2] for key in keys],
+                [self.items[key[2]] for key in keys]
+            )
+
+        return self._orderings[field]
+
+    def page(self, field, descending=False, after=None, size=None):
+        """
+        Returns up to `size` items ordered by `(field, id)`, following the
+        sort key `after` when given.
+        """
+        keys, items = self.ordered(field)
+
+        if not descending:
+            start = 0 if after is None else bisect_right(keys, after)
+
+            return items[start:start + size]
+
+        stop = len(keys) if after is None else bisect_left(keys, after)
+
+        return items[max(stop - size, 0):stop][::-1]
+
+
+def get_snapshot(view_class):
+    """
+    Returns the current snapshot of `view_class`, or None without one. A
+    stale snapshot starts its rebuild in the background.
+    """
+    path = snapshot_path(view_class)
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    loaded = _snapshots.get(path)
+
+    if loaded is None or loaded[0] != mtime:
+        loaded = (mtime, Snapshot.load(path))
+        _snapshots[path] = loaded
+
+    snapshot = loaded[1]
+
+    if snapshot.age() > settings.DASHBOARD_SNAPSHOT_MAX_AGE:
+        revalidate(view_class)
+
+    return snapshot
+
+
+def revalidate(view_class):
+    """
+    Rebuilds the snapshot of `view_class` in a background thread, unless it
+    is already being rebuilt or was rebuilt in the last
+    `DASHBOARD_SNAPSHOT_MAX_AGE` seconds. Returns the started thread.
+    """
+    name = view_class.snapshot_name
+
+    with _lock:
+        if name in _rebuilding or time.time() - _rebuilt_at.get(name, 0) < settings.DASHBOARD_SNAPSHOT_MAX_AGE:
+            return None
+
+        _rebuilding.add(name)
+        _rebuilt_at[name] = time.time()
+
+    thread = threading.Thread(target=_rebuild, args=(view_class, ), name='snapshot-{}'.format(name), daemon=True)
+    thread.start()
+
+    return thread
+
+
+def _rebuild(view_class):
+    try:
+        build_snapshot(view_class)
+    except Exception:
+        logger.exception('Rebuilding the {} snapshot failed'.format(view_class.snapshot_name))
+    finally:
+        # The thread's own connections
+        connections.close_all()
+
+        with _lock:
+            _rebuilding.discard(view_class.snapshot_name)
+
+
+def render_snapshot(view_class, output):
+    """
+    Writes all objects of `view_class` as a JSON array to the binary file
+    `output`. Returns the number of objects.
+    """
+    view = view_class()
+    serializer_class = view.get_serializer_class()
+
+    queryset = view_class.queryset.all()
+    collected = [field for field in serializer_class.Meta.fields if field in queryset.collectable_fields()]
+    queryset = getattr(queryset, view.get_collect_method())(*collected).order_by('pk')
+
+    renderer = JSONRenderer()
+    count = 0
+
+    output.write(b'[')
+
+    for count, instance in enumerate(queryset.iterator(), 1):
+        if count > 1:
+            output.write(b',')
+
+        item = OrderedDict([('id', instance.pk)])
+        item.update(serializer_class(instance).data)
+        output.write(renderer.render(item))
+
+    output.write(b']')
+
+    return count
+
+
+def build_snapshot(view_class, directory=None):
+    """
+    Renders the snapshot of `view_class` and atomically replaces the current
+    one with it. Returns the number of objects.
+    """
+    path = snapshot_path(view_class, directory)
+    directory = os.path.dirname(path)
+
+    os.makedirs(directory, exist_ok=True)
+
+    output = tempfile.NamedTemporaryFile(dir=directory, prefix='.{}.'.format(view_class.snapshot_name), delete=False)
+
+    try:
+        with output:
+            count = render_snapshot(view_class, output)
+            output.flush()
+            os.fsync(output.fileno())
+
+        # Temporary files are only readable by their owner
+        os.chmod(output.name, 0o644)
+        os.replace(output.name, path)
+    except BaseException:
+        os.unlink(output.name)
+        raise
+
+    return count
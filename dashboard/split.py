@@ -0,0 +1,128 @@
+"""
+Split execution of `collect()`.
+
+The private values behind the model properties don't depend on each other,
+yet `collect()` computes all of them in one statement, i.e. on one backend
+process. `collect_split()` loads the instances without them and then
+collects every field with its own query of `(pk, value)` for the loaded
+`pk`s, like `collect_siblings()` does, and sets the values on the instances
+under the same `_`-prefixed names.
+
+The field queries of up to `CHUNK_SIZE` instances at a time run concurrently
+on a thread pool of `DASHBOARD_SPLIT_WORKERS` threads per process. Every
+thread has its own database connection, a pooled one on PostgreSQL (see
+`dashboard/backends/pooled_postgresql`), handed back after each query as at
+the end of a request. They run one after the other in the calling thread
+inside a transaction, whose uncommitted rows other connections can't see,
+and with fewer than two workers.
+
+The queries of the worker threads aren't counted by `count_queries()` (see
+`dashboard/queries.py`), which counts the current thread only. Cached
+querysets (see `dashboard/cache.py`) are keyed by the split fields and the
+tables their queries read too.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .siblings import SiblingsModelIterable
+
+# Instances collected at a time, bounding the `pk IN (...)` lists
+CHUNK_SIZE = 1000
+
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The thread pool of the current process.
+    """
+    global executor, executor_pid
+
+    with executor_lock:
+        if executor is None or executor_pid != os.getpid():
+            # The threads of a forked parent's pool don't exist here
+            executor = ThreadPoolExecutor(
+                max_workers=settings.DASHBOARD_SPLIT_WORKERS,
+                thread_name_prefix='dashboard-split'
+            )
+            executor_pid = os.getpid()
+
+        return executor
+
+
+def field_queryset(queryset, field):
+    """
+    `(pk, value)` of the property `field` for all instances, narrowed to the
+    loaded ones by `collect_values()`.
+    """
+    return queryset.model._default_manager \
+        .using(queryset.db) \
+        .collect(field) \
+        .order_by() \
+        .values_list('pk', queryset.private_name(field))
+
+
+def collect_values(queryset, field, pks):
+    """
+    The private value behind the property `field` by `pk`, for `pks`.
+    """
+    return dict(field_queryset(queryset, field).filter(pk__in=pks))
+
+
+def collect_values_in_thread(queryset, field, pks):
+    try:
+        return collect_values(queryset, field, pks)
+    finally:
+        # Hands a pooled connection back, as at the end of a request
+        connections[queryset.db].close_if_unusable_or_obsolete()
+
+
+def collect_split(queryset, instances):
+    """
+    Sets the private values of `queryset._split_fields` on `instances`.
+    """
+    pks = list({instance.pk for instance in instances})
+
+    if not pks:
+        return
+
+    fields = queryset._split_fields
+
+    if len(fields) < 2 or settings.DASHBOARD_SPLIT_WORKERS < 2 or connections[queryset.db].in_atomic_block:
+        results = [collect_values(queryset, field, pks) for field in fields]
+    else:
+        futures = [get_executor().submit(collect_values_in_thread, queryset, field, pks) for field in fields]
+        results = [future.result() for future in futures]
+
+    for field, values in zip(fields, results):
+        private_name = queryset.private_name(field)
+
+        for instance in instances:
+            setattr(instance, private_name, values.get(instance.pk))
+
+
+class SplitCollectIterable(SiblingsModelIterable):
+    """
+    Yields the model instances with the values of `queryset._split_fields`
+    collected by separate concurrent queries (see `collect_split()`).
+    """
+
+    def __iter__(self):
+        chunk = []
+
+        for obj in super().__iter__():
+            chunk.append(obj)
+
+            if len(chunk) >= CHUNK_SIZE:
+                collect_split(self.queryset, chunk)
+                yield from chunk
+                chunk = []
+
+        collect_split(self.queryset, chunk)
+        yield from chunk
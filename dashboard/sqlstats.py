@@ -0,0 +1,272 @@
+"""
+Per-process statistics of the SQL run, by fingerprint.
+
+With `DASHBOARD_SQL_STATS` on, every database connection of the process is
+instrumented when it is created (see `install()`): each query is normalized
+into a fingerprint - literals, placeholder lists and generated aliases
+replaced, so all runs of e.g. a `collect()` subquery shape share one - and
+counted into a histogram of its durations. Updates take no locks; under the
+GIL a concurrent update may at worst be lost.
+
+Every process writes its histograms to `<DASHBOARD_SQL_STATS_DIR>/<pid>.json`
+at most every `FLUSH_INTERVAL` seconds, and `load_stats()` merges the files of
+all processes (e.g. WSGI workers), so the `dashboard:sql-stats` endpoint
+shows the load of the whole server. The files of processes which exited are
+deleted, and files not written for `STALE_AFTER` seconds - e.g. of a pid
+reused by a process which doesn't count its SQL - are skipped.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+
+from .queries import CountingCursorWrapper
+
+FLUSH_INTERVAL = 10
+# Files not written for longer are left out of `load_stats()`
+STALE_AFTER = 3600
+# Durations are counted in buckets growing by 2 ** (1 / BUCKETS_PER_DOUBLING),
+# from 1 microsecond, so percentiles are accurate to ~19%
+BUCKETS_PER_DOUBLING = 4
+MAX_BUCKET = 32 * BUCKETS_PER_DOUBLING
+
+NORMALIZATIONS = (
+    # String literals
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    # Numbers which are not part of identifiers
+    (re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b'), '?'),
+    # Column aliases Django generates from ids
+    (re.compile(r'AS "\d+"'), 'AS "?"'),
+    # Lists of placeholders or literals, e.g. IN (...) and bulk VALUES
+    (re.compile(r'\((?:%s|\?)(?:, (?:%s|\?))*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:, \(\.\.\.\))+'), '(...)'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize(sql):
+    for pattern, replacement in NORMALIZATIONS:
+        sql = pattern.sub(replacement, sql)
+
+    return sql.strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.md5(normalized_sql.encode('utf-8')).hexdigest()[:16]
+
+
+def bucket(duration):
+    microseconds = duration * 1e6
+
+    if microseconds <= 1:
+        return 0
+
+    return min(int(math.ceil(math.log2(microseconds) * BUCKETS_PER_DOUBLING)), MAX_BUCKET)
+
+
+def bucket_duration(index):
+    """
+    The upper bound of the bucket `index`, in seconds.
+    """
+    return 2 ** (index / BUCKETS_PER_DOUBLING) / 1e6
+
+
+class SQLStats(object):
+    """
+    `{fingerprint: {'sql', 'count', 'time', 'buckets'}}` of the current
+    process.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.entries = {}
+        # Normalized SQL of every raw SQL seen, so each is normalized once
+        self.normalized = {}
+        self.flushed_at = time.monotonic()
+
+    def add(self, sql, duration):
+        if self.pid != os.getpid():
+            # Forked worker, the counts belong to the parent
+            self.reset()
+
+        normalized = self.normalized.get(sql)
+
+        if normalized is None:
+            normalized = normalize(sql)
+
+            if len(self.normalized) < 10000:
+                self.normalized[sql] = normalized
+
+        key = fingerprint(normalized)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            entry = self.entries.setdefault(key, {'sql': normalized, 'count': 0, 'time': 0.0, 'buckets': {}})
+
+        entry['count'] += 1
+        entry['time'] += duration
+        index = bucket(duration)
+        entry['buckets'][index] = entry['buckets'].get(index, 0) + 1
+
+        if settings.DASHBOARD_SQL_STATS_DIR and time.monotonic() - self.flushed_at > FLUSH_INTERVAL:
+            try:
+                self.flush(settings.DASHBOARD_SQL_STATS_DIR)
+            except OSError:
+                # Statistics must never fail a query, the next flush retries
+                pass
+
+    def as_dict(self):
+        return {
+            key: dict(entry, buckets=dict(entry['buckets']))
+            for key, entry in list(self.entries.items())
+        }
+
+    def flush(self, directory):
+        self.flushed_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.', delete=False) as output:
+            json.dump(self.as_dict(), output)
+
+        os.replace(output.name, os.path.join(directory, '{}.json'.format(self.pid)))
+
+
+stats = SQLStats()
+
+
+def install(sender=None, connection=None, **kwargs):
+    """
+    Counts the queries of `connection` into `stats`. Connected to
+    `connection_created`, so every connection is instrumented once. The
+    cursor factories are wrapped, which `count_queries()` leaves alone.
+    """
+    if not settings.DASHBOARD_SQL_STATS or getattr(connection, 'sql_stats_installed', False):
+        return
+
+    def counting(make_cursor):
+        def make_counting_cursor(cursor):
+            return CountingCursorWrapper(make_cursor(cursor), connection, stats)
+
+        return make_counting_cursor
+
+    connection.make_cursor = counting(connection.make_cursor)
+    connection.make_debug_cursor = counting(connection.make_debug_cursor)
+    connection.sql_stats_installed = True
+
+
+def merge(target, entries):
+    for key, entry in entries.items():
+        merged = target.setdefault(key, {'sql': entry['sql'], 'count': 0, 'time': 0.0, 'buckets': {}})
+        merged['count'] += entry['count']
+        merged['time'] += entry['time']
+
+        for index, count in entry['buckets'].items():
+            merged['buckets'][int(index)] = merged['buckets'].get(int(index), 0) + count
+
+
+def running(pid):
+    if os.name != 'posix':
+        # `os.kill()` terminates the process elsewhere
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        pass
+
+    return True
+
+
+def load_stats(directory=None):
+    """
+    Returns the number of processes and the merged entries of all of them:
+    the files in `directory` and the current process.
+    """
+    entries = {}
+    pids = {stats.pid}
+    merge(entries, stats.as_dict())
+
+    if directory:
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            pid, extension = os.path.splitext(name)
+
+            if extension != '.json' or not pid.isdigit() or int(pid) in pids:
+                continue
+
+            path = os.path.join(directory, name)
+
+            try:
+                if not running(int(pid)):
+                    os.remove(path)
+                    continue
+
+                if time.time() - os.path.getmtime(path) > STALE_AFTER:
+                    continue
+
+                with open(path) as stats_file:
+                    merge(entries, json.load(stats_file))
+            except (OSError, ValueError):
+                continue
+
+            pids.add(int(pid))
+
+    return len(pids), entries
+
+
+def percentile(buckets, fraction):
+    """
+    The upper bound of the bucket holding the `fraction` percentile, in
+    milliseconds. Ranked within the bucket counts, which may trail `count` by
+    a lost update or a copy taken in between.
+    """
+    rank = fraction * sum(buckets.values())
+    seen = 0
+
+    for index in sorted(buckets):
+        seen += buckets[index]
+
+        if seen >= rank:
+            return bucket_duration(index) * 1000
+
+    return None
+
+
+def summarize(entries, limit=None):
+    """
+    The entries ordered by total time, with their durations in milliseconds.
+    """
+    rows = []
+
+    for key, entry in entries.items():
+        count = entry['count']
+        rows.append({
+            'fingerprint': key,
+            'sql': entry['sql'],
+            'count': count,
+            'total_time': entry['time'] * 1000,
+            'mean': entry['time'] * 1000 / count,
+            'p50': percentile(entry['buckets'], 0.5),
+            'p95': percentile(entry['buckets'], 0.95),
+            'p99': percentile(entry['buckets'], 0.99),
+        })
+
+    rows.sort(key=lambda row: -row['total_time'])
+
+    return rows[:limit]
@@ -0,0 +1,118 @@
+"""
+Precomputed per-invoice, per-party and per-club aggregates.
+
+Every summary holds the values of all collectable properties of its model, as
+computed by the model's `collect()` (or `collect_joined()`) queryset, keyed by
+the model's id. On PostgreSQL the summaries are materialized views which
+`python manage.py refresh_summaries` refreshes concurrently, so readers are
+never blocked. Other databases get snapshot tables rebuilt on refresh.
+
+Querysets read the summaries with `collect_summary()`; the list APIs switch
+to it with the `DASHBOARD_USE_SUMMARIES` setting.
+"""
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import F
+
+from .cache import tables_changed
+from .models import (
+    Club,
+    ClubSummary,
+    Invoice,
+    InvoiceSummary,
+    Party,
+    PartySummary,
+)
+
+# (summary model, model, name of the collect method)
+SUMMARIES = (
+    (InvoiceSummary, Invoice, 'collect'),
+    (PartySummary, Party, 'collect_joined'),
+    (ClubSummary, Club, 'collect_joined'),
+)
+
+
+def summary_queryset(summary_model, model, collect_method):
+    """
+    The query of a summary: the key column followed by one column for each
+    collectable property of `model`.
+    """
+    queryset = getattr(model.objects.order_by(), collect_method)()
+
+    columns = OrderedDict([(summary_model._meta.pk.column, F('pk'))])
+    for field in queryset.collectable_fields():
+        columns[field] = F(queryset.private_name(field))
+
+    return queryset.values(**columns)
+
+
+def summary_exists(connection, summary_model):
+    table = summary_model._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [table])
+            return cursor.fetchone()[0]
+
+        return table in connection.introspection.table_names(cursor)
+
+
+def create_summary(connection, summary_model, model, collect_method):
+    """
+    (Re)creates the summary with the current definition of its query and a
+    unique index on the key (required by `REFRESH ... CONCURRENTLY`).
+    """
+    qn = connection.ops.quote_name
+    table = summary_model._meta.db_table
+    sql, params = summary_queryset(summary_model, model, collect_method).query.sql_with_params()
+    kind = 'MATERIALIZED VIEW' if connection.vendor == 'postgresql' else 'TABLE'
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('DROP {} IF EXISTS {}'.format(kind, qn(table)))
+        cursor.execute('CREATE {} {} AS {}'.format(kind, qn(table), sql), params)
+        cursor.execute('CREATE UNIQUE INDEX {} ON {} ({})'.format(
+            qn('{}_key'.format(table)),
+            qn(table),
+            qn(summary_model._meta.pk.column)
+        ))
+
+
+def refresh_summary(connection, summary_model, model, collect_method, concurrently=True):
+    qn = connection.ops.quote_name
+    table = summary_model._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('REFRESH MATERIALIZED VIEW {}{}'.format(
+                'CONCURRENTLY ' if concurrently else '',
+                qn(table)
+            ))
+        return
+
+    sql, params = summary_queryset(summary_model, model, collect_method).query.sql_with_params()
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(qn(table)))
+        cursor.execute('INSERT INTO {} {}'.format(qn(table), sql), params)
+
+
+def refresh_summaries(connection, create=False, concurrently=True, log=None):
+    """
+    Refreshes all summaries, creating the missing ones (or all of them with
+    `create=True`, e.g. after the collect() queries changed).
+    """
+    for summary in SUMMARIES:
+        summary_model = summary[0]
+
+        if create or not summary_exists(connection, summary_model):
+            create_summary(connection, *summary)
+            action = 'Created'
+        else:
+            refresh_summary(connection, *summary, concurrently=concurrently)
+            action = 'Refreshed'
+
+        tables_changed([summary_model._meta.db_table], using=connection.alias)
+
+        if log is not None:
+            log('{} {}'.format(action, summary_model._meta.db_table))
@@ -2,6 +2,10 @@ from django.conf.urls import url
 from .views import (
     ClubListApi,
     PartyListApi,
+    SQLStatsApi,
+    FallbacksApi,
+    PreparedStatementsApi,
+    DatabasePoolsApi,
     InvoiceListApi,
     InvoiceRowListApi,
     VisitorToPartyListApi,
@@ -33,4 +37,24 @@ urlpatters = [
         view=VisitorToPartyListApi.as_view(),
         name='visitor-to-party-list'
     ),
+    url(
+        regex=r'^sql-stats/$',
+        view=SQLStatsApi.as_view(),
+        name='sql-stats'
+    ),
+    url(
+        regex=r'^fallbacks/$',
+        view=FallbacksApi.as_view(),
+        name='fallbacks'
+    ),
+    url(
+        regex=r'^prepared-statements/$',
+        view=PreparedStatementsApi.as_view(),
+        name='prepared-statements'
+    ),
+    url(
+        regex=r'^db-pools/$',
+        view=DatabasePoolsApi.as_view(),
+        name='db-pools'
+    ),
 ]
@@ -1,6 +1,19 @@
+from collections import OrderedDict
+from operator import attrgetter
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import serializers
 
+from . import fallbacks, prepared, routers, snapshots, sqlstats
+from .backends.pooled_postgresql.pool import pool_stats
+from .pagination import KeysetPagination
 from .models import (
     Club,
     Party,
@@ -10,10 +23,275 @@ from .models import (
 )
 
 
-class ClubListApi(ListAPIView):
-    queryset = Club.objects.collect()[:10]
+class FieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer which takes an optional `fields` argument limiting the
+    rendered fields to a subset of `Meta.fields`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class RowSerializer(object):
+    """
+    Renders the records of `CollectQuerySet.rows()` as a serializer renders
+    model instances. The serializer fields are looked up once per request by
+    `get_fields()`, so rendering a record only converts its values; the
+    read-only fields of the model properties pass them as they are.
+    """
+
+    def __init__(self, fields, instance, many=False):
+        self.fields = fields
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def get_fields(cls, serializer, attributes):
+        """
+        `(name, getter, representation)` of the fields of `serializer`, read
+        from the record attributes named by `attributes` (or by the field).
+        """
+        return [
+            (
+                name,
+                attrgetter(attributes.get(name, name)),
+                None if isinstance(field, serializers.ReadOnlyField) else field.to_representation
+            )
+            for name, field in serializer.fields.items()
+        ]
+
+    def to_representation(self, row):
+        item = OrderedDict()
+
+        for name, getter, representation in self.fields:
+            value = getter(row)
+            item[name] = value if value is None or representation is None else representation(value)
+
+        return item
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+
+        return self.to_representation(self.instance)
+
+
+class CollectListApi(ListAPIView):
+    """
+    Lists `queryset` collected with only the annotations, and loaded with only
+    the columns, needed for the serializer `Meta.fields`. Clients can narrow
+    the fields further with `?fields=name,total_incomes`; unknown names are
+    answered with 400.
+
+    Pages of `page_size` items are served with keyset pagination ordered by
+    `?ordering=` (one of `ordering_fields`, optionally prefixed with `-`).
+    With `?stream=1` the whole queryset is streamed instead (see `stream()`).
+
+    Views with `has_summary` read the collected fields from the precomputed
+    summaries instead when `settings.DASHBOARD_USE_SUMMARIES` is on. Pages are
+    served from the result cache when `settings.DASHBOARD_CACHE_RESULTS` is on.
+    With `settings.DASHBOARD_SPLIT_COLLECT` on, lists not ordered by a
+    collected field collect every field by its own concurrent query instead
+    (see `dashboard/split.py`).
+
+    With `settings.DASHBOARD_VALUES_ROWS` on, the rows are loaded as compact
+    records instead of model instances (see `dashboard/rows.py`) and rendered
+    by `RowSerializer`.
+
+    Views with a `snapshot_name` serve their pages from the snapshot file when
+    `settings.DASHBOARD_SNAPSHOT_DIR` is set (see `dashboard/snapshots.py`).
+
+    Lists and streams are read from a replica when `settings.DASHBOARD_REPLICAS`
+    has any (see `dashboard/routers.py`).
+    """
+    queryset = None
+    collect_method = 'collect'
+    has_summary = False
+    snapshot_name = None
+    pagination_class = KeysetPagination
+    page_size = None
+    ordering_query_param = 'ordering'
+    stream_query_param = 'stream'
+    # Non-null model fields or collected properties usable as keyset sort keys
+    ordering_fields = ('id', )
+    # Record attributes by collected field and the fields of `RowSerializer`,
+    # when listing records (see `get_queryset()`)
+    row_attributes = None
+    row_fields = None
+
+    def get_fields(self):
+        fields = self.get_serializer_class().Meta.fields
+        requested = self.request.query_params.get('fields')
+
+        if requested:
+            requested = requested.split(',')
+            unknown = [field for field in requested if field not in fields]
+
+            if unknown:
+                raise ValidationError({
+                    'fields': ['Unknown fields: {}. Choices are: {}'.format(', '.join(unknown), ', '.join(fields))]
+                })
+
+            fields = [field for field in fields if field in requested]
+
+        return fields
+
+    def get_collect_method(self):
+        if self.has_summary and settings.DASHBOARD_USE_SUMMARIES:
+            return 'collect_summary'
+
+        if settings.DASHBOARD_SPLIT_COLLECT:
+            return 'collect_split'
+
+        return self.collect_method
+
+    def get_ordering(self):
+        ordering = self.request.query_params.get(self.ordering_query_param, '')
+
+        if ordering.lstrip('-') in self.ordering_fields:
+            return ordering
+
+        return self.ordering_fields[0]
+
+    def get_ordering_key(self, ordering):
+        """
+        Returns the queryset lookup to sort by for `ordering`.
+        """
+        field = ordering.lstrip('-')
+
+        if field == 'id':
+            return 'pk'
+
+        if field in self.queryset.collectable_fields():
+            return self.queryset.private_name(field)
+
+        return field
+
+    def get_queryset(self):
+        fields = list(self.get_fields())
+        queryset = super().get_queryset()
+
+        ordering_field = self.get_ordering().lstrip('-')
+        if ordering_field != 'id' and ordering_field not in fields:
+            fields.append(ordering_field)
+
+        collectable_fields = queryset.collectable_fields()
+        collected = [field for field in fields if field in collectable_fields]
+        columns = [field for field in fields if field not in collectable_fields]
+
+        if collected:
+            collect_method = self.get_collect_method()
+
+            # The split values can't be sorted by
+            if collect_method == 'collect_split' and ordering_field in collected:
+                collect_method = self.collect_method
+
+            queryset = getattr(queryset, collect_method)(*collected)
+
+        if settings.DASHBOARD_CACHE_RESULTS:
+            queryset = queryset.cached()
 
-    class Serializer(serializers.ModelSerializer):
+        queryset = queryset.on_replica()
+
+        if settings.DASHBOARD_VALUES_ROWS and not queryset._split_fields:
+            self.row_attributes = OrderedDict((field, queryset.private_name(field)) for field in collected)
+
+            return queryset.rows('pk', *columns, *self.row_attributes.values())
+
+        return queryset.only('pk', *columns)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'] = self.get_fields()
+
+        if self.row_attributes is not None:
+            if self.row_fields is None:
+                self.row_fields = RowSerializer.get_fields(
+                    serializer=super().get_serializer(fields=kwargs['fields']),
+                    attributes=self.row_attributes
+                )
+
+            return RowSerializer(self.row_fields, *args, many=kwargs.get('many', False))
+
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param):
+            return self.stream()
+
+        snapshot = self.get_snapshot()
+
+        if snapshot is not None:
+            return self.list_snapshot(snapshot)
+
+        with routers.replica_reads():
+            return super().list(request, *args, **kwargs)
+
+    def get_snapshot(self):
+        if self.snapshot_name is None or not settings.DASHBOARD_SNAPSHOT_DIR:
+            return None
+
+        return snapshots.get_snapshot(self.__class__)
+
+    def list_snapshot(self, snapshot):
+        fields = self.get_fields()
+        items = self.paginator.paginate_snapshot(snapshot, self.request, view=self)
+
+        response = self.paginator.get_paginated_response([
+            OrderedDict((field, item[field]) for field in fields)
+            for item in items
+        ])
+        response['Age'] = int(snapshot.age())
+
+        return response
+
+    def stream(self):
+        """
+        Streams the whole queryset as a JSON array, without pagination. Rows
+        are read through `.iterator()` (a server-side cursor on PostgreSQL)
+        and every element is rendered and written as soon as it is read, so
+        memory stays flat however many rows are exported.
+        """
+        ordering = self.get_ordering()
+        key = self.get_ordering_key(ordering)
+        prefix = '-' if ordering.startswith('-') else ''
+
+        order_by = [prefix + key] if key == 'pk' else [prefix + key, prefix + 'pk']
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*order_by)
+
+        renderer = JSONRenderer()
+
+        def render():
+            with routers.replica_reads(queryset._hints.get('replica')):
+                yield b'['
+
+                for idx, instance in enumerate(queryset.iterator()):
+                    if idx:
+                        yield b','
+
+                    yield renderer.render(self.get_serializer(instance).data)
+
+                yield b']'
+
+        return StreamingHttpResponse(render(), content_type=renderer.media_type)
+
+
+class ClubListApi(CollectListApi):
+    queryset = Club.objects.all()
+    collect_method = 'collect_joined'
+    has_summary = True
+    snapshot_name = 'clubs'
+    page_size = 10
+    ordering_fields = ('id', 'name', 'total_incomes', 'parties_count')
+
+    class Serializer(FieldsModelSerializer):
         class Meta:
             model = Club
             fields = (
@@ -31,10 +309,12 @@ class ClubListApi(ListAPIView):
         return ClubListApi.Serializer
 
 
-class InvoiceRowListApi(ListAPIView):
-    queryset = InvoiceRow.objects.collect()[:50]
+class InvoiceRowListApi(CollectListApi):
+    queryset = InvoiceRow.objects.all()
+    page_size = 50
+    ordering_fields = ('id', 'amount')
 
-    class Serializer(serializers.ModelSerializer):
+    class Serializer(FieldsModelSerializer):
         class Meta:
             model = InvoiceRow
             fields = (
@@ -50,10 +330,12 @@ class InvoiceRowListApi(ListAPIView):
         return InvoiceRowListApi.Serializer
 
 
-class InvoiceListApi(ListAPIView):
-    queryset = Invoice.objects.collect()[:30]
+class InvoiceListApi(CollectListApi):
+    queryset = Invoice.objects.all()
+    page_size = 30
+    ordering_fields = ('id', 'default_tax_rate')
 
-    class Serializer(serializers.ModelSerializer):
+    class Serializer(FieldsModelSerializer):
         class Meta:
             model = Invoice
             fields = (
@@ -66,10 +348,11 @@ class InvoiceListApi(ListAPIView):
         return InvoiceListApi.Serializer
 
 
-class VisitorToPartyListApi(ListAPIView):
-    queryset = VisitorToParty.objects.collect()[:30]
+class VisitorToPartyListApi(CollectListApi):
+    queryset = VisitorToParty.objects.all()
+    page_size = 30
 
-    class Serializer(serializers.ModelSerializer):
+    class Serializer(FieldsModelSerializer):
         class Meta:
             model = VisitorToParty
             fields = (
@@ -80,10 +363,14 @@ class VisitorToPartyListApi(ListAPIView):
         return VisitorToPartyListApi.Serializer
 
 
-class PartyListApi(ListAPIView):
-    queryset = Party.objects.collect()[:30]
+class PartyListApi(CollectListApi):
+    queryset = Party.objects.all()
+    has_summary = True
+    snapshot_name = 'parties'
+    page_size = 30
+    ordering_fields = ('id', 'name', 'invoices_count')
 
-    class Serializer(serializers.ModelSerializer):
+    class Serializer(FieldsModelSerializer):
         class Meta:
             model = Party
             fields = (
@@ -94,3 +381,76 @@ class PartyListApi(ListAPIView):
 
     def get_serializer_class(self):
         return PartyListApi.Serializer
+
+
+class SQLStatsApi(APIView):
+    """
+    The SQL fingerprints of all server processes ordered by their total time
+    (see `dashboard/sqlstats.py`), the top `?limit=` (default 50) of them.
+    Durations are in milliseconds.
+    """
+    permission_classes = (IsAdminUser, )
+    default_limit = 50
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+
+        processes, entries = sqlstats.load_stats(settings.DASHBOARD_SQL_STATS_DIR)
+
+        return Response(OrderedDict([
+            ('enabled', settings.DASHBOARD_SQL_STATS),
+            ('processes', processes),
+            ('queries', sqlstats.summarize(entries, limit)),
+        ]))
+
+
+class FallbacksApi(APIView):
+    """
+    The model property fallbacks of the current process by call site, the
+    most frequent first (see `dashboard/fallbacks.py`), the top `?limit=`
+    (default 50) of them.
+    """
+    permission_classes = (IsAdminUser, )
+    default_limit = 50
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+
+        return Response(OrderedDict([
+            ('mode', settings.DASHBOARD_PROPERTY_FALLBACKS),
+            ('fallbacks', fallbacks.report(limit)),
+        ]))
+
+
+class PreparedStatementsApi(APIView):
+    """
+    The prepared statements of the current process and the planning time they
+    saved (see `dashboard/prepared.py`), in milliseconds.
+    """
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        statements = prepared.report()
+
+        return Response(OrderedDict([
+            ('enabled', settings.DASHBOARD_PREPARED_STATEMENTS),
+            ('saved_time', sum(row['saved_time'] or 0 for row in statements)),
+            ('statements', statements),
+        ]))
+
+
+class DatabasePoolsApi(APIView):
+    """
+    The connection pools of the current process with their metrics (see
+    `dashboard/backends/pooled_postgresql/pool.py`), times in seconds.
+    """
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        return Response(pool_stats())
@@ -25,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'dashboard.middleware.QueryBudgetMiddleware',
+    'dashboard.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +62,45 @@ DATABASES = {
     'default': env.db('DATABASE_URL', default='postgres:///django_db_unplugged'),
 }
 
+# Read replicas of the default database, e.g.
+# 'postgres://replica-1/django_db_unplugged,postgres://replica-2/django_db_unplugged',
+# serving the dashboard lists as replica_1, replica_2, ... (see
+# DASHBOARD_REPLICAS); the default database URL itself makes a local stand-in
+for replica_idx, replica_url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    DATABASES['replica_{}'.format(replica_idx)] = dict(env.db_url_config(replica_url), TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['dashboard.routers.ReplicaRouter']
+
+# Pooled PostgreSQL connections, which requests take and hand back instead of
+# connecting (see dashboard/backends/pooled_postgresql); the pools of every
+# process are served to staff users at /dashboard/db-pools/
+for database in DATABASES.values():
+    if not env.bool('DATABASE_POOL', default=True) or database['ENGINE'] not in (
+        'django.db.backends.postgresql',
+        'django.db.backends.postgresql_psycopg2',
+    ):
+        continue
+
+    database['ENGINE'] = 'dashboard.backends.pooled_postgresql'
+    database['POOL'] = {
+        'MIN_SIZE': env.int('DATABASE_POOL_MIN_SIZE', default=1),
+        'MAX_SIZE': env.int('DATABASE_POOL_MAX_SIZE', default=10),
+        # Seconds to wait for a connection with MAX_SIZE in use
+        'TIMEOUT': env.float('DATABASE_POOL_TIMEOUT', default=10.0),
+        # Seconds after which idle connections above MIN_SIZE are closed
+        'IDLE_TIMEOUT': env.float('DATABASE_POOL_IDLE_TIMEOUT', default=300.0),
+        # Seconds of idleness after which a connection is checked before use
+        'HEALTH_CHECK_INTERVAL': env.float('DATABASE_POOL_HEALTH_CHECK_INTERVAL', default=30.0),
+    }
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    # Result cache of the dashboard querysets (see dashboard/cache.py), e.g.
+    # filecache:///var/tmp/dashboard or rediscache://127.0.0.1:6379/1; has to be
+    # shared by all processes, the locmem default only suits a single one
+    'dashboard': env.cache('DASHBOARD_CACHE_URL', default='locmemcache://dashboard'),
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -86,6 +127,65 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# dashboard
+# ------------------------------------------------------------------------------
+# Serve the club and party lists from the precomputed summaries, refreshed with
+# `python manage.py refresh_summaries` (see dashboard/summaries.py)
+DASHBOARD_USE_SUMMARIES = env.bool('DASHBOARD_USE_SUMMARIES', default=False)
+# Serve the list pages from the result cache, invalidated by writes to the
+# tables they read (see dashboard/cache.py)
+DASHBOARD_CACHE_RESULTS = env.bool('DASHBOARD_CACHE_RESULTS', default=False)
+# Build the collect() annotations and compile the SQL of every queryset shape
+# once per process, afterwards only binding the filter values (see
+# dashboard/compiled.py)
+DASHBOARD_COMPILED_SQL = env.bool('DASHBOARD_COMPILED_SQL', default=True)
+# Run the compiled SQL of repeated shapes as server-side prepared statements on
+# PostgreSQL, at most DASHBOARD_PREPARED_STATEMENTS_MAX per database session;
+# the planning time saved is served to staff users at
+# /dashboard/prepared-statements/ (see dashboard/prepared.py)
+DASHBOARD_PREPARED_STATEMENTS = env.bool('DASHBOARD_PREPARED_STATEMENTS', default=False)
+DASHBOARD_PREPARED_STATEMENTS_MAX = env.int('DASHBOARD_PREPARED_STATEMENTS_MAX', default=100)
+# Collect the fields of the lists not ordered by one of them with one query per
+# field, run concurrently on DASHBOARD_SPLIT_WORKERS threads with their own
+# (pooled) connections (see dashboard/split.py)
+DASHBOARD_SPLIT_COLLECT = env.bool('DASHBOARD_SPLIT_COLLECT', default=False)
+DASHBOARD_SPLIT_WORKERS = env.int('DASHBOARD_SPLIT_WORKERS', default=4)
+# Load the list rows as compact records of their columns and collected values
+# instead of model instances, rendered without per-object serializers (see
+# dashboard/rows.py)
+DASHBOARD_VALUES_ROWS = env.bool('DASHBOARD_VALUES_ROWS', default=True)
+# Serve the club and party lists from snapshot files in this directory, built
+# with `python manage.py build_snapshots` and rebuilt in the background once
+# older than DASHBOARD_SNAPSHOT_MAX_AGE seconds (see dashboard/snapshots.py)
+DASHBOARD_SNAPSHOT_DIR = env.str('DASHBOARD_SNAPSHOT_DIR', default=None)
+DASHBOARD_SNAPSHOT_MAX_AGE = env.int('DASHBOARD_SNAPSHOT_MAX_AGE', default=60)
+# What to do with requests exceeding their query budget: 'off' (not counted at
+# all), 'log' or 'raise' (see dashboard/middleware.py)
+DASHBOARD_QUERY_BUDGET_ACTION = env.str('DASHBOARD_QUERY_BUDGET_ACTION', default='off')
+# Maximum queries per request by URL name, e.g. 'dashboard:club-list=2;default=10'
+DASHBOARD_QUERY_BUDGETS = env.dict('DASHBOARD_QUERY_BUDGETS', cast={'value': int}, default={'default': 10})
+# Maximum runs of the same SQL per request, more are reported as N+1 queries
+DASHBOARD_DUPLICATE_QUERY_LIMIT = env.int('DASHBOARD_DUPLICATE_QUERY_LIMIT', default=3)
+# Collect per-process statistics of the SQL run by fingerprint, shared by all
+# processes through files in DASHBOARD_SQL_STATS_DIR and served to staff users
+# at /dashboard/sql-stats/ (see dashboard/sqlstats.py)
+DASHBOARD_SQL_STATS = env.bool('DASHBOARD_SQL_STATS', default=False)
+DASHBOARD_SQL_STATS_DIR = env.str('DASHBOARD_SQL_STATS_DIR', default=None)
+
+# Model properties falling back to collect_siblings() or per-instance queries
+# instead of collect(): 'off', 'count' (counted by call site, logged on the
+# first hit and served to staff users at /dashboard/fallbacks/) or 'strict'
+# (raise PropertyFallback, e.g. in tests; see dashboard/fallbacks.py)
+DASHBOARD_PROPERTY_FALLBACKS = env.str('DASHBOARD_PROPERTY_FALLBACKS', default='off')
+
+# Databases serving the collected querysets and the list endpoints (see
+# dashboard/routers.py), picked by 'round_robin' or 'least_in_flight'
+# requests; a write pins the reads of the client to the primary for
+# DASHBOARD_REPLICA_PIN_SECONDS
+DASHBOARD_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DASHBOARD_REPLICA_POLICY = env.str('DASHBOARD_REPLICA_POLICY', default='round_robin')
+DASHBOARD_REPLICA_PIN_SECONDS = env.int('DASHBOARD_REPLICA_PIN_SECONDS', default=5)
+
 # django-debug-toolbar
 # ------------------------------------------------------------------------------
 INTERNAL_IPS = ('127.0.0.1', '10.0.2.2',)
@@ -0,0 +1,45 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+from dashboard.models import Club
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_writes_report_and_rolls_back(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as output:
+            call_command(
+                'benchmark',
+                scales='1,2',
+                repeat=1,
+                cases=['invoice.total_amount', '/dashboard/list/invoice/'],
+                output=output.name,
+                stderr=StringIO()
+            )
+            report = json.load(output)
+
+        self.assertEqual(report['database'], connection.vendor)
+        self.assertEqual(
+            [(result['scale'], result['case'], result['path']) for result in report['results']],
+            [
+                (1, 'invoice.total_amount', 'property'),
+                (1, 'invoice.total_amount', 'collect'),
+                (1, '/dashboard/list/invoice/', 'endpoint'),
+                (2, 'invoice.total_amount', 'property'),
+                (2, 'invoice.total_amount', 'collect'),
+                (2, '/dashboard/list/invoice/', 'endpoint'),
+            ]
+        )
+        self.assertEqual(report['results'][1]['queries'], 1)
+        self.assertFalse(Club.objects.exists())
+
+    def test_needs_empty_database(self):
+        Club.objects.create(name='Versai')
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark', scales='1')
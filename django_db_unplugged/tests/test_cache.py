@@ -0,0 +1,134 @@
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from dashboard.cache import check_shared_cache, get_cache
+from dashboard.models import (
+    Club,
+    Party,
+    Invoice,
+    Visitor,
+    InvoiceRow,
+    VisitorToParty,
+)
+
+
+# Transactions have to commit, as the cache is only invalidated on commit
+class ResultCacheTests(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+
+        club = Club.objects.create(name='Versai')
+        party = Party.objects.create(name='Boro', club=club)
+        self.invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+        self.row = InvoiceRow.objects.create(
+            description='Vodka',
+            invoice=self.invoice,
+            tax_rate=0.0,
+            quantity=2,
+            unit_price=5
+        )
+        VisitorToParty.objects.create(
+            visitor=Visitor.objects.create(full_name='Ivo', age=20),
+            invoice=self.invoice,
+            party=party
+        )
+
+    def test_cached_results(self):
+        with self.assertNumQueries(1):
+            club = Club.objects.collect().cached().get()
+
+        with self.assertNumQueries(0):
+            cached_club = Club.objects.collect().cached().get()
+
+        self.assertEqual(club.total_incomes, cached_club.total_incomes)
+        self.assertEqual(club.first_party_name, cached_club.first_party_name)
+
+        with self.assertNumQueries(1):
+            Club.objects.collect().cached().filter(name='Boro').first()
+
+    def test_writes_invalidate_dependent_results(self):
+        list(Invoice.objects.collect().cached())
+        list(Visitor.objects.all())
+        list(Club.objects.cached())
+
+        self.row.quantity = 4
+        self.row.save()
+
+        with self.assertNumQueries(1):
+            invoice = Invoice.objects.collect().cached().get()
+
+        self.assertEqual(30, invoice.total_amount)
+
+        # dashboard_club is not read by the invoice query, nor written since
+        with self.assertNumQueries(0):
+            list(Club.objects.cached())
+
+    def test_bulk_operations_invalidate_results(self):
+        self.assertEqual(15, Invoice.objects.collect().cached().get().total_amount)
+
+        Invoice.objects.add_to_total_amount(5)
+        self.assertEqual(20, Invoice.objects.collect().cached().get().total_amount)
+
+        Club.objects.bulk_create([Club(name='Yalta')])
+        self.assertEqual(2, len(Club.objects.cached()))
+
+    def test_uncommitted_changes_are_not_cached(self):
+        self.assertEqual(1, Club.objects.cached().count())
+
+        with transaction.atomic():
+            Club.objects.create(name='Yalta')
+
+            with self.assertNumQueries(1):
+                self.assertEqual(2, len(Club.objects.cached()))
+
+            transaction.set_rollback(True)
+
+        self.assertEqual(['Versai'], [club.name for club in Club.objects.cached()])
+
+        with transaction.atomic():
+            Club.objects.create(name='Yalta')
+
+        self.assertEqual(2, len(Club.objects.cached()))
+
+    def test_process_local_cache_warning(self):
+        self.assertEqual([], check_shared_cache(None))
+
+        with override_settings(DASHBOARD_CACHE_RESULTS=True):
+            self.assertEqual(['dashboard.W001'], [warning.id for warning in check_shared_cache(None)])
+
+    @override_settings(DASHBOARD_CACHE_RESULTS=True)
+    def test_list_apis_use_cache(self):
+        self.assertEqual(15, self.client.get('/dashboard/list/club/').data['results'][0]['total_incomes'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/dashboard/list/club/')
+
+        self.assertEqual(15, response.data['results'][0]['total_incomes'])
+
+        InvoiceRow.objects.create(
+            description='Tonic',
+            invoice=self.invoice,
+            tax_rate=0.0,
+            quantity=1,
+            unit_price=2
+        )
+
+        self.assertEqual(18, self.client.get('/dashboard/list/club/').data['results'][0]['total_incomes'])
+
+    @override_settings(DASHBOARD_CACHE_RESULTS=True, DASHBOARD_SPLIT_COLLECT=True)
+    def test_split_collect(self):
+        def get(fields):
+            return self.client.get('/dashboard/list/club/', {'fields': fields}).data['results'][0]
+
+        self.assertEqual(1, get('name,parties_count')['parties_count'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(1, get('name,parties_count')['parties_count'])
+
+        # Same main query, other split fields
+        self.assertEqual('Boro', get('name,first_party_name')['first_party_name'])
+
+        # Read by the split queries only
+        Party.objects.create(name='Yalta', club=Club.objects.get())
+
+        self.assertEqual(2, get('name,parties_count')['parties_count'])
@@ -0,0 +1,63 @@
+from django.db.models import Count, Q
+from django.test import TestCase, override_settings
+
+from dashboard import compiled
+from dashboard.models import Club, Party
+
+
+class CompiledSQLTests(TestCase):
+    def setUp(self):
+        compiled.templates.clear()
+        compiled.statements.clear()
+        self.addCleanup(compiled.templates.clear)
+        self.addCleanup(compiled.statements.clear)
+
+        self.clubs = []
+
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+            self.clubs.append(club)
+
+            for party_idx in range(club_idx + 1):
+                Party.objects.create(club=club, name='Party {}'.format(party_idx))
+
+    def page(self, method, parties_count, pk):
+        queryset = getattr(Club.objects.all(), method)('parties_count', 'first_party_name') \
+            .filter(Q(_parties_count__gt=parties_count) | Q(_parties_count=parties_count, pk__gt=pk)) \
+            .order_by('_parties_count', 'pk') \
+            .only('pk', 'name')[:2]
+
+        return [(club.name, club.parties_count, club.first_party_name) for club in queryset]
+
+    def test_collected_query_is_built_once(self):
+        first = Club.objects.all().collect('parties_count')
+        second = Club.objects.all().collect('parties_count')
+
+        self.assertEqual(1, len(compiled.templates))
+        self.assertIsNot(first.query, second.query)
+        self.assertEqual(str(first.query), str(second.query))
+        self.assertEqual((('collect', ('parties_count', )), ), second._shape)
+
+    def test_binds_filter_values(self):
+        for method in ('collect', 'collect_joined'):
+            with self.assertNumQueries(1):
+                self.assertEqual([('Club 0', 1, 'Party 0'), ('Club 1', 2, 'Party 0')], self.page(method, 0, 0))
+
+            self.assertEqual([('Club 2', 3, 'Party 0')], self.page(method, 2, self.clubs[1].pk))
+            self.assertEqual([], self.page(method, 3, self.clubs[2].pk))
+
+        # One shape per collect method
+        self.assertEqual(2, len(compiled.statements))
+
+    def test_uncovered_shapes(self):
+        queryset = Club.objects.collect('parties_count').annotate(party_total=Count('parties'))
+
+        self.assertIsNone(queryset._shape)
+        self.assertEqual([1, 2, 3], [club.party_total for club in queryset.order_by('pk')])
+        self.assertEqual({}, compiled.statements)
+
+    @override_settings(DASHBOARD_COMPILED_SQL=False)
+    def test_disabled(self):
+        self.assertEqual([('Club 2', 3, 'Party 0')], self.page('collect', 2, self.clubs[1].pk))
+        self.assertEqual({}, compiled.templates)
+        self.assertEqual({}, compiled.statements)
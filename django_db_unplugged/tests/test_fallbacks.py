@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from dashboard import fallbacks
+from dashboard.fallbacks import PropertyFallback
+from dashboard.models import Club, Party
+
+
+class FallbackTests(TestCase):
+    def setUp(self):
+        fallbacks.counts.clear()
+        self.addCleanup(fallbacks.counts.clear)
+
+        for club_idx in range(2):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+
+            for party_idx in range(2):
+                Party.objects.create(club=club, name='Party {}'.format(party_idx))
+
+    @override_settings(DASHBOARD_PROPERTY_FALLBACKS='count')
+    def test_counts_by_call_site(self):
+        for club in Club.objects.all():
+            self.assertEqual(2, club.parties_count)
+
+        club = Club.objects.get(name='Club 0')
+        club._siblings = None
+        self.assertEqual(2, club.parties_count)
+
+        report = {(row['property'], row['kind']): row for row in fallbacks.report()}
+
+        # One siblings query for both clubs and one per-instance query
+        self.assertEqual(1, report['Club.parties_count', 'siblings']['count'])
+        self.assertEqual(1, report['Club.parties_count', 'instance']['count'])
+        self.assertIn('test_fallbacks.py', report['Club.parties_count', 'siblings']['call_site'])
+        self.assertIn('test_counts_by_call_site', report['Club.parties_count', 'instance']['call_site'])
+
+    @override_settings(DASHBOARD_PROPERTY_FALLBACKS='count')
+    def test_collect_records_nothing(self):
+        for club in Club.objects.collect():
+            self.assertEqual(2, club.parties_count)
+            self.assertEqual('Party 0', club.first_party_name)
+
+        self.assertEqual([], fallbacks.report())
+
+    @override_settings(DASHBOARD_PROPERTY_FALLBACKS='strict')
+    def test_strict(self):
+        club = Club.objects.first()
+
+        with self.assertRaises(PropertyFallback):
+            club.parties_count
+
+        self.assertEqual(2, Club.objects.collect().first().parties_count)
+
+    def test_off(self):
+        for club in Club.objects.all():
+            club.parties_count
+
+        self.assertEqual([], fallbacks.report())
+
+    @override_settings(DASHBOARD_PROPERTY_FALLBACKS='count')
+    def test_endpoint(self):
+        Club.objects.first().parties_count
+
+        self.assertEqual(403, self.client.get('/dashboard/fallbacks/').status_code)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/dashboard/fallbacks/', {'limit': 1})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('count', response.data['mode'])
+        self.assertEqual(['Club.parties_count'], [row['property'] for row in response.data['fallbacks']])
@@ -0,0 +1,58 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from dashboard.explain import check_scans
+from dashboard.models import Club, Invoice, InvoiceRow, Party, Visitor, VisitorToParty
+
+
+class CollectIndexTests(TestCase):
+    def get_indexes(self, table):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+
+        return {
+            name: constraint['columns']
+            for name, constraint in constraints.items()
+            if constraint['index'] and not constraint['primary_key']
+        }
+
+    def test_indexes(self):
+        indexes = self.get_indexes('dashboard_invoicerow')
+        self.assertIn('dashboard_invoicerow_invoice_covering', indexes)
+        # The single column foreign key index is covered by the new one
+        self.assertNotIn(['invoice_id'], indexes.values())
+
+        indexes = self.get_indexes('dashboard_party')
+        self.assertIn('dashboard_party_club_id_covering', indexes)
+        self.assertNotIn(['club_id'], indexes.values())
+
+        self.assertIn('dashboard_visitortoparty_party_invoice', self.get_indexes('dashboard_visitortoparty'))
+
+        indexes = self.get_indexes('dashboard_invoice')
+        self.assertIn('dashboard_invoice_id_covering', indexes)
+        self.assertNotIn('dashboard_invoice_id_total_amount', indexes)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Plans are checked on PostgreSQL only')
+class CollectPlanTests(TransactionTestCase):
+    """
+    Committed rows, as VACUUM can't run in a transaction.
+    """
+
+    def setUp(self):
+        club = Club.objects.create(name='Club')
+
+        for party_idx in range(2):
+            party = Party.objects.create(club=club, name='Party {}'.format(party_idx))
+            invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+            InvoiceRow.objects.create(description='Row', invoice=invoice, tax_rate=0, quantity=2, unit_price=5)
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Visitor', age=20),
+                invoice=invoice,
+                party=party
+            )
+
+    def test_collect_queries_use_index_only_scans(self):
+        self.assertEqual([], [scan for scan in check_scans(connection, vacuum=True) if not scan[-1]])
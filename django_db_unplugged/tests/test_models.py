@@ -1,3 +1,10 @@
+from importlib import import_module
+from io import StringIO
+
+from django.apps import apps
+from django.core.exceptions import FieldError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
 from dashboard.models import (
@@ -8,6 +15,7 @@ from dashboard.models import (
     InvoiceRow,
     VisitorToParty,
 )
+from dashboard.query import CollectQuerySet
 
 
 class InvoiceRowTests(TestCase):
@@ -62,6 +70,90 @@ class InvoiceRowTests(TestCase):
         )
         self.assertEqual(18.0, invoice_row.amount)
 
+    def test_stored_amounts_follow_invoices_tax(self):
+        invoice = Invoice.objects.create(description='asdf', default_tax_rate=0.8)
+        InvoiceRow.objects.create(description='Vodka', invoice=invoice, tax_rate=0.0, quantity=2, unit_price=5)
+        InvoiceRow.objects.create(description='Beer', invoice=invoice, tax_rate=0.5, quantity=2, unit_price=5)
+
+        invoice.default_tax_rate = 0.1
+        invoice.save()
+
+        self.assertEqual(
+            [(10, 11), (10, 15)],
+            list(invoice.rows.order_by('id').values_list('stored_amount_without_tax', 'stored_amount'))
+        )
+
+    def test_stored_amounts_follow_deferred_and_bulk_tax_changes(self):
+        invoice = Invoice.objects.create(description='asdf', default_tax_rate=0.8)
+        InvoiceRow.objects.create(description='Vodka', invoice=invoice, tax_rate=0.0, quantity=2, unit_price=5)
+
+        invoice = Invoice.objects.only('description').get(pk=invoice.pk)
+        invoice.default_tax_rate = 0.1
+        invoice.save()
+
+        self.assertEqual([11], list(invoice.rows.values_list('stored_amount', flat=True)))
+        self.assertEqual(11, invoice.total_amount)
+
+        Invoice.objects.filter(default_tax_rate=0.1).update(default_tax_rate=0.5)
+
+        self.assertEqual([15], list(invoice.rows.values_list('stored_amount', flat=True)))
+        self.assertEqual(15, Invoice.objects.get(pk=invoice.pk).total_amount)
+
+    def test_unfilled_amounts_are_computed(self):
+        invoice = Invoice.objects.create(description='asdf', default_tax_rate=0.8)
+        InvoiceRow.objects.create(description='Vodka', invoice=invoice, tax_rate=0.0, quantity=2, unit_price=5)
+        InvoiceRow.objects.create(description='Beer', invoice=invoice, tax_rate=0.5, quantity=2, unit_price=5)
+        # Written in bulk, not filled yet
+        InvoiceRow.objects.update(stored_amount_without_tax=None, stored_amount=None)
+
+        rows = InvoiceRow.objects.collect().order_by('id')
+
+        self.assertEqual([(10, 18), (10, 15)], [(row.amount_without_tax, row.amount) for row in rows])
+        self.assertEqual([18, 15], [row._amount for row in rows.rows('_amount')])
+        self.assertEqual(
+            [15, 18],
+            [row['amount'] for row in self.client.get('/dashboard/list/invoice-row/?ordering=amount').data['results']]
+        )
+
+        Invoice.objects.refresh_total_amounts()
+        self.assertEqual(33, Invoice.objects.get(pk=invoice.pk).total_amount)
+
+    def test_backfill_row_amounts(self):
+        invoice = Invoice.objects.create(description='asdf', default_tax_rate=0.8)
+
+        for quantity in range(1, 6):
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=invoice,
+                tax_rate=0.0,
+                quantity=quantity,
+                unit_price=5
+            )
+
+        InvoiceRow.objects.update(stored_amount_without_tax=None, stored_amount=None)
+        call_command('backfill_row_amounts', chunk_size=2, stdout=StringIO())
+
+        self.assertEqual(
+            [(5, 9), (10, 18), (15, 27), (20, 36), (25, 45)],
+            list(InvoiceRow.objects.order_by('id').values_list('stored_amount_without_tax', 'stored_amount'))
+        )
+
+    def test_migration_fills_row_amounts(self):
+        migration = import_module('dashboard.migrations.0007_backfill_invoicerow_amounts')
+        invoice = Invoice.objects.create(description='asdf', default_tax_rate=0.8)
+        InvoiceRow.objects.create(description='Vodka', invoice=invoice, tax_rate=0.0, quantity=2, unit_price=5)
+        InvoiceRow.objects.create(description='Beer', invoice=invoice, tax_rate=0.5, quantity=2, unit_price=5)
+        InvoiceRow.objects.update(stored_amount_without_tax=None, stored_amount=None)
+
+        with connection.schema_editor() as schema_editor:
+            migration.fill_row_amounts(apps, schema_editor)
+
+        self.assertEqual(
+            [(10, 18), (10, 15)],
+            list(InvoiceRow.objects.order_by('id').values_list('stored_amount_without_tax', 'stored_amount'))
+        )
+        self.assertEqual([18, 15], [row.amount for row in InvoiceRow.objects.collect().order_by('id')])
+
 
 class InvoiceTests(TestCase):
     def test_details_from_description(self):
@@ -89,6 +181,20 @@ class InvoiceTests(TestCase):
         invoice = Invoice.objects.collect().get(id=created_invoice.id)
         self.assertEqual('Vodka', invoice.details)
 
+    def test_details_from_item_for_empty_description(self):
+        for description in ('', None):
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=Invoice.objects.create(description=description),
+                tax_rate=0.0,
+                quantity=2,
+                unit_price=5
+            )
+
+        # Collected for the siblings, and by collect()
+        self.assertEqual(['Vodka', 'Vodka'], [invoice.details for invoice in Invoice.objects.order_by('id')])
+        self.assertEqual(['Vodka', 'Vodka'], [invoice.details for invoice in Invoice.objects.collect().order_by('id')])
+
     def test_amount(self):
         created_invoice = Invoice.objects.create(description=None)
 
@@ -128,6 +234,53 @@ class InvoiceTests(TestCase):
         invoice = Invoice.objects.collect().get(id=created_invoice.id)
         self.assertEqual(75, invoice.total_amount)
 
+    def test_stored_total_amount_follows_row_writes(self):
+        def stored_totals():
+            return list(Invoice.objects.order_by('id').values_list('stored_total_amount', flat=True))
+
+        invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+        other_invoice = Invoice.objects.create(description=None, default_tax_rate=0.2)
+
+        row = InvoiceRow.objects.create(
+            description='Vodka',
+            invoice=invoice,
+            tax_rate=0.0,
+            quantity=2,
+            unit_price=5
+        )
+        InvoiceRow.objects.create(
+            description='Beer',
+            invoice=invoice,
+            tax_rate=0.2,
+            quantity=1,
+            unit_price=5
+        )
+        self.assertEqual([21, 0], stored_totals())
+
+        row.quantity = 4
+        row.save()
+        self.assertEqual([36, 0], stored_totals())
+
+        row.invoice = other_invoice
+        row.save()
+        self.assertEqual([6, 24], stored_totals())
+
+        # Saving an invoice doesn't overwrite the stored total with a stale value
+        invoice.description = 'Birthday'
+        invoice.save()
+        self.assertEqual([6, 24], stored_totals())
+
+        other_invoice.default_tax_rate = 0.5
+        other_invoice.save()
+        self.assertEqual([6, 30], stored_totals())
+        self.assertEqual(30, other_invoice.total_amount)
+
+        row.delete()
+        self.assertEqual([6, 0], stored_totals())
+
+        InvoiceRow.objects.all().delete()
+        self.assertEqual([0, 0], stored_totals())
+
 
 class VisitorToPartyTests(TestCase):
     def test_amount(self):
@@ -201,6 +354,9 @@ class PartyTests(TestCase):
         party = Party.objects.collect().get(id=created_party.id)
         self.assertEqual(0, party.invoices_count)
 
+        party = Party.objects.collect_joined().get(id=created_party.id)
+        self.assertEqual(0, party.invoices_count)
+
     def test_invoices_count(self):
         club = Club.objects.create(name='Versai')
         created_party = Party.objects.create(
@@ -232,6 +388,9 @@ class PartyTests(TestCase):
         party = Party.objects.collect().get(id=created_party.id)
         self.assertEqual(2, party.invoices_count)
 
+        party = Party.objects.collect_joined().get(id=created_party.id)
+        self.assertEqual(2, party.invoices_count)
+
     def test_total_party_income(self):
         club = Club.objects.create(name='Versai')
         created_party = Party.objects.create(
@@ -278,6 +437,42 @@ class PartyTests(TestCase):
         party = Party.objects.collect().get(id=created_party.id)
         self.assertEqual(30, party.total_party_income)
 
+        party = Party.objects.collect_joined().get(id=created_party.id)
+        self.assertEqual(30, party.total_party_income)
+
+    def test_fallbacks_are_batched_for_siblings(self):
+        club = Club.objects.create(name='Versai')
+
+        for idx in range(5):
+            party = Party.objects.create(name='Party {}'.format(idx), club=club)
+            invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=invoice,
+                tax_rate=0.0,
+                quantity=2,
+                unit_price=5
+            )
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                invoice=invoice,
+                party=party
+            )
+
+        with self.assertNumQueries(3):
+            parties = list(Party.objects.all())
+
+            for party in parties:
+                self.assertEqual(15, party.total_party_income)
+                self.assertEqual(1, party.invoices_count)
+
+    def test_fallback_without_siblings(self):
+        club = Club.objects.create(name='Versai')
+        party = Party.objects.create(name='Boro', club=club)
+
+        self.assertEqual(0, party.total_party_income)
+        self.assertEqual(0, party.invoices_count)
+
 
 class ClubTests(TestCase):
     def test_first_and_last_party_names_and_incomes(self):
@@ -357,6 +552,12 @@ class ClubTests(TestCase):
         self.assertEqual(30, club.first_party_income)
         self.assertEqual(7.5, club.last_party_income)
 
+        club = Club.objects.collect_joined().get(id=created_club.id)
+        self.assertEqual('Boro', club.first_party_name)
+        self.assertEqual('Boro i Madmatik', club.last_party_name)
+        self.assertEqual(30, club.first_party_income)
+        self.assertEqual(7.5, club.last_party_income)
+
     def test_parties_count_if_no_parties_exists(self):
         created_club = Club.objects.create(name='Versai')
 
@@ -366,6 +567,9 @@ class ClubTests(TestCase):
         club = Club.objects.collect().get(id=created_club.id)
         self.assertEqual(0, club.parties_count)
 
+        club = Club.objects.collect_joined().get(id=created_club.id)
+        self.assertEqual(0, club.parties_count)
+
     def test_parties_count(self):
         created_club = Club.objects.create(name='Versai')
         Party.objects.create(
@@ -379,6 +583,9 @@ class ClubTests(TestCase):
         club = Club.objects.collect().get(id=created_club.id)
         self.assertEqual(1, club.parties_count)
 
+        club = Club.objects.collect_joined().get(id=created_club.id)
+        self.assertEqual(1, club.parties_count)
+
     def test_average_income_per_party(self):
         created_club = Club.objects.create(name='Versai')
         party1 = Party.objects.create(
@@ -451,6 +658,9 @@ class ClubTests(TestCase):
         club = Club.objects.collect().get(id=created_club.id)
         self.assertEqual(expected_value, club.average_income_per_party)
 
+        club = Club.objects.collect_joined().get(id=created_club.id)
+        self.assertEqual(expected_value, club.average_income_per_party)
+
     def test_total_incomes(self):
         created_club = Club.objects.create(name='Versai')
         party1 = Party.objects.create(
@@ -522,3 +732,109 @@ class ClubTests(TestCase):
 
         club = Club.objects.collect().get(id=created_club.id)
         self.assertEqual(expected_value, club.total_incomes)
+
+        club = Club.objects.collect_joined().get(id=created_club.id)
+        self.assertEqual(expected_value, club.total_incomes)
+
+    def test_collect_joined_matches_collect_for_many_clubs(self):
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+
+            for party_idx in range(club_idx):
+                party = Party.objects.create(name='Party {}'.format(party_idx), club=club)
+                invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+                InvoiceRow.objects.create(
+                    description='Vodka',
+                    invoice=invoice,
+                    tax_rate=0.0,
+                    quantity=party_idx + 1,
+                    unit_price=5
+                )
+                VisitorToParty.objects.create(
+                    visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                    invoice=invoice,
+                    party=party
+                )
+
+        fields = (
+            'name',
+            'total_incomes',
+            'parties_count',
+            'average_income_per_party',
+            'first_party_name',
+            'first_party_income',
+            'last_party_name',
+            'last_party_income',
+        )
+
+        def rows(queryset):
+            return [
+                tuple(getattr(club, field) for field in fields)
+                for club in queryset.order_by('id')
+            ]
+
+        self.assertEqual(rows(Club.objects.collect()), rows(Club.objects.collect_joined()))
+
+    def test_collect_joined_runs_each_rollup_once(self):
+        sql = str(Club.objects.collect_joined().query)
+
+        self.assertTrue(sql.startswith('WITH '))
+        # Invoice totals are read from the stored column
+        self.assertNotIn('dashboard_invoicerow', sql)
+        self.assertEqual(1, sql.count('FROM "dashboard_visitortoparty"'))
+        # One scan for the club totals, one ranked scan for the first and last parties
+        self.assertEqual(2, sql.count('FROM "dashboard_party"'))
+        self.assertNotIn('LIMIT', sql)
+
+    def test_collect_only_requested_fields(self):
+        created_club = Club.objects.create(name='Versai')
+
+        for queryset in (Club.objects.collect('parties_count'), Club.objects.collect_joined('parties_count')):
+            club = queryset.get(id=created_club.id)
+            self.assertEqual(0, club.parties_count)
+            self.assertFalse(hasattr(club, '_total_incomes'))
+
+        with self.assertRaises(FieldError):
+            Club.objects.collect('name')
+
+    def test_nothing_to_collect_by_default(self):
+        Visitor.objects.create(full_name='Ivo', age=20)
+        queryset = CollectQuerySet(model=Visitor)
+
+        self.assertEqual([], queryset.collectable_fields())
+        self.assertEqual(['Ivo'], [visitor.full_name for visitor in queryset.collect()])
+
+        with self.assertRaises(FieldError):
+            queryset.collect('full_name')
+
+    def test_with_tree(self):
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+
+            for party_idx in range(club_idx + 1):
+                party = Party.objects.create(name='Party {}'.format(party_idx), club=club)
+                invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+                InvoiceRow.objects.create(
+                    description='Vodka',
+                    invoice=invoice,
+                    tax_rate=0.0,
+                    quantity=party_idx + 1,
+                    unit_price=5
+                )
+                VisitorToParty.objects.create(
+                    visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                    invoice=invoice,
+                    party=party
+                )
+
+        expected = {
+            club.id: (club.total_incomes, club.parties_count, club.last_party_name, club.last_party_income)
+            for club in Club.objects.collect()
+        }
+
+        with self.assertNumQueries(3):
+            for club in Club.objects.with_tree():
+                self.assertEqual(
+                    expected[club.id],
+                    (club.total_incomes, club.parties_count, club.last_party_name, club.last_party_income)
+                )
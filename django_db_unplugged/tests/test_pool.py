@@ -0,0 +1,124 @@
+from unittest import mock
+
+import psycopg2
+from django.contrib.auth.models import User
+from django.test import TestCase
+from psycopg2 import extensions
+
+from dashboard.backends.pooled_postgresql import pool
+
+
+class Connection(object):
+    """
+    Stand-in for a psycopg2 connection.
+    """
+
+    def __init__(self):
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.broken = False
+        self.rollbacks = 0
+
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        return mock.MagicMock()
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(TestCase):
+    def make_pool(self, **kwargs):
+        return pool.ConnectionPool(connect=Connection, **kwargs)
+
+    def test_reuses_released_connections(self):
+        connection_pool = self.make_pool()
+        first = connection_pool.acquire()
+        second = connection_pool.acquire()
+
+        connection_pool.release(first)
+        connection_pool.release(second)
+
+        self.assertIs(second, connection_pool.acquire())
+
+        stats = connection_pool.stats()
+        self.assertEqual(2, stats['created'])
+        self.assertEqual(3, stats['checkouts'])
+        self.assertEqual((2, 1, 1), (stats['size'], stats['in_use'], stats['idle']))
+
+    def test_rolls_back_on_release(self):
+        connection_pool = self.make_pool()
+        connection = connection_pool.acquire()
+        connection.status = extensions.TRANSACTION_STATUS_INTRANS
+
+        connection_pool.release(connection)
+
+        self.assertEqual(1, connection.rollbacks)
+        self.assertIs(connection, connection_pool.acquire())
+
+    def test_timeout(self):
+        connection_pool = self.make_pool(max_size=1, timeout=0.01)
+        connection_pool.acquire()
+
+        with self.assertRaises(pool.PoolTimeout):
+            connection_pool.acquire()
+
+        self.assertEqual(1, connection_pool.stats()['timeouts'])
+
+    def test_idle_eviction(self):
+        connection_pool = self.make_pool(min_size=1, idle_timeout=0)
+        connections = [connection_pool.acquire() for _ in range(3)]
+
+        for connection in connections:
+            connection_pool.release(connection)
+
+        # Down to MIN_SIZE, the most recently released one
+        self.assertEqual([1, 1, 0], [connection.closed for connection in connections])
+        self.assertEqual(2, connection_pool.stats()['evictions'])
+
+    def test_health_checks(self):
+        connection_pool = self.make_pool(health_check_interval=0)
+        broken = connection_pool.acquire()
+        connection_pool.release(broken)
+        broken.broken = True
+
+        connection = connection_pool.acquire()
+
+        self.assertIsNot(broken, connection)
+        self.assertTrue(broken.closed)
+        self.assertEqual(1, connection_pool.stats()['health_check_failures'])
+
+    # Fresh registries, the pool of the test database stays registered to be
+    # closed before the test database is destroyed
+    @mock.patch.object(pool, 'inherited_pools', [])
+    @mock.patch.object(pool, 'pools', {})
+    def test_pools_by_process(self):
+        first = pool.get_pool('default', {'database': 'dashboard'}, {'MAX_SIZE': 2})
+        self.assertIs(first, pool.get_pool('default', {'database': 'dashboard'}, {}))
+        self.assertEqual(2, first.max_size)
+
+        # Forked
+        with mock.patch.object(pool, 'pools_pid', -1):
+            self.assertIsNot(first, pool.get_pool('default', {'database': 'dashboard'}, {}))
+
+        self.assertEqual([first], pool.inherited_pools)
+
+        pool.close_pools(database='dashboard')
+        self.assertEqual({}, pool.pools)
+
+    def test_endpoint(self):
+        self.assertEqual(403, self.client.get('/dashboard/db-pools/').status_code)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/dashboard/db-pools/')
+
+        self.assertEqual(200, response.status_code)
@@ -0,0 +1,125 @@
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from dashboard import compiled, prepared
+from dashboard.models import Club, Party
+
+
+class Session(object):
+    pass
+
+
+class PreparedStatementTests(TestCase):
+    def setUp(self):
+        compiled.statements.clear()
+        prepared.stats.clear()
+        self.addCleanup(compiled.statements.clear)
+        self.addCleanup(prepared.stats.clear)
+
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+            Party.objects.create(club=club, name='Party {}'.format(club_idx))
+
+    def clubs(self, name):
+        return [
+            (club.name, club.parties_count)
+            for club in Club.objects.collect('parties_count').filter(name__gt=name).order_by('pk')
+        ]
+
+    def test_positional(self):
+        self.assertEqual(
+            'SELECT "a" FROM "t" WHERE "b" = $1 AND "c" LIKE \'x%\' AND "d" IN ($2, $3)',
+            prepared.positional('SELECT "a" FROM "t" WHERE "b" = %s AND "c" LIKE \'x%%\' AND "d" IN (%s, %s)')
+        )
+
+    def test_parameter_types(self):
+        self.assertEqual(('boolean', 'bigint', 'numeric', 'text'), prepared.parameter_types((True, 1, Decimal(1), 'a')))
+        self.assertIsNone(prepared.parameter_types((1, None)))
+
+    def test_sessions(self):
+        # Stand-ins for the Django and psycopg2 connections
+        database = SimpleNamespace(connection=Session())
+        statements = prepared.session_statements(database)
+        statements.names['dashboard_1'] = True
+
+        self.assertIs(statements, prepared.session_statements(database))
+
+        # Reconnected
+        database.connection = Session()
+        self.assertEqual({}, prepared.session_statements(database).names)
+
+    @override_settings(DASHBOARD_PREPARED_STATEMENTS=True)
+    @skipUnless(connection.vendor != 'postgresql', 'Checks the databases without prepared statements')
+    def test_other_databases_run_unprepared(self):
+        for _ in range(2):
+            self.assertEqual([('Club 1', 1), ('Club 2', 1)], self.clubs('Club 0'))
+
+        self.assertEqual([], prepared.report())
+
+    @override_settings(DASHBOARD_PREPARED_STATEMENTS=True, DASHBOARD_PREPARED_STATEMENTS_MAX=1)
+    @skipUnless(connection.vendor == 'postgresql', 'Prepared statements only run on PostgreSQL')
+    def test_prepares_repeated_shapes(self):
+        # Compiled, then prepared and executed twice
+        self.assertEqual([('Club 1', 1), ('Club 2', 1)], self.clubs('Club 0'))
+        self.assertEqual([('Club 2', 1)], self.clubs('Club 1'))
+        self.assertEqual([], self.clubs('Club 2'))
+
+        (row, ) = prepared.report()
+        self.assertEqual(2, row['executions'])
+        self.assertIn(row['statement'], prepared.session_statements(connection).names)
+
+        # Another shape takes the place of the first one
+        self.assertEqual(['Club 2'], [club.name for club in Club.objects.collect().filter(name__gt='Club 1')])
+        self.assertEqual(['Club 2'], [club.name for club in Club.objects.collect().filter(name__gt='Club 1')])
+        self.assertNotIn(row['statement'], prepared.session_statements(connection).names)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name FROM pg_prepared_statements')
+            self.assertEqual(list(prepared.session_statements(connection).names), [name for name, in cursor.fetchall()])
+
+    @override_settings(DASHBOARD_PREPARED_STATEMENTS=True)
+    def test_server_side_cursors_run_unprepared(self):
+        executed = []
+        compiler = SimpleNamespace(
+            connection=SimpleNamespace(vendor='postgresql'),
+            as_sql=lambda: ('SELECT %s', (1, )),
+            execute_sql=lambda result_type, chunked_fetch: executed.append(compiler.as_sql())
+        )
+
+        prepared.use_prepared(compiler, 'SELECT %s', (1, ))
+
+        with mock.patch.object(prepared, 'prepare', return_value='EXECUTE dashboard_1 (%s)') as prepare:
+            compiler.execute_sql(chunked_fetch=True)
+            compiler.execute_sql()
+
+        prepare.assert_called_once_with(compiler.connection, 'SELECT %s', (1, ))
+        self.assertEqual([('SELECT %s', (1, )), ('EXECUTE dashboard_1 (%s)', (1, ))], executed)
+
+    @override_settings(DASHBOARD_PREPARED_STATEMENTS=True)
+    @skipUnless(connection.vendor == 'postgresql', 'Prepared statements only run on PostgreSQL')
+    def test_streams(self):
+        for _ in range(3):
+            response = self.client.get('/dashboard/list/club/?stream=1&fields=name,parties_count')
+            clubs = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+            self.assertEqual([('Club 0', 1), ('Club 1', 1), ('Club 2', 1)], [
+                (club['name'], club['parties_count']) for club in clubs
+            ])
+
+        self.assertFalse(prepared.session_statements(connection).invalid)
+
+    def test_endpoint(self):
+        self.assertEqual(403, self.client.get('/dashboard/prepared-statements/').status_code)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/dashboard/prepared-statements/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, response.data['saved_time'])
+        self.assertEqual([], response.data['statements'])
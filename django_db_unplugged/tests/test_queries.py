@@ -0,0 +1,84 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from dashboard.models import (
+    Club,
+    Party,
+    Invoice,
+    Visitor,
+    InvoiceRow,
+    VisitorToParty,
+)
+from dashboard.queries import QueryBudgetExceeded, check_budget, count_queries
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+            party = Party.objects.create(name='Boro', club=club)
+            invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=invoice,
+                tax_rate=0.5,
+                quantity=2,
+                unit_price=5
+            )
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                invoice=invoice,
+                party=party
+            )
+
+    def test_count_queries(self):
+        with count_queries() as stats:
+            parties = list(Party.objects.all())
+
+            with count_queries() as nested_stats:
+                for party in parties:
+                    party.club.name
+
+        self.assertEqual(4, stats.count)
+        self.assertEqual(3, nested_stats.count)
+        self.assertGreater(stats.time, 0)
+        self.assertEqual([3], list(stats.duplicates().values()))
+        self.assertNotIn('_prepare_cursor', connection.__dict__)
+
+        self.assertEqual([], check_budget(stats, budget=4, duplicate_limit=3))
+        self.assertEqual(2, len(check_budget(stats, budget=3, duplicate_limit=2)))
+
+    @override_settings(
+        DASHBOARD_QUERY_BUDGET_ACTION='raise',
+        DASHBOARD_QUERY_BUDGETS={'dashboard:party-list': 0, 'default': 1}
+    )
+    def test_middleware(self):
+        response = self.client.get('/dashboard/list/club/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/dashboard/list/party/')
+
+    @override_settings(
+        DASHBOARD_QUERY_BUDGET_ACTION='log',
+        DASHBOARD_QUERY_BUDGETS={'dashboard:club-list': 0, 'default': 10}
+    )
+    def test_middleware_logs(self):
+        with self.assertLogs('dashboard.middleware', 'WARNING') as logs:
+            response = self.client.get('/dashboard/list/club/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('GET dashboard:club-list (1 queries', logs.output[0])
+
+        with self.assertLogs('dashboard.middleware', 'WARNING') as logs:
+            response = self.client.get('/dashboard/list/club/', {'stream': '1'})
+            b''.join(response.streaming_content)
+
+        self.assertIn('1 queries exceed the budget of 0', logs.output[0])
+
+    def test_middleware_is_off_by_default(self):
+        response = self.client.get('/dashboard/list/club/')
+
+        self.assertNotIn('Server-Timing', response)
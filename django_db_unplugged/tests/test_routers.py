@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from dashboard import cache, routers
+from dashboard.middleware import ReplicaPinningMiddleware
+from dashboard.models import Club, Party
+
+
+@override_settings(DASHBOARD_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        Party.objects.create(club=Club.objects.create(name='Club'), name='Party')
+
+        patcher = mock.patch.object(routers, 'selector', routers.ReplicaSelector())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Not pinned by the writes above
+        routers.start_request()
+        self.addCleanup(routers.start_request)
+
+    def collected_db(self):
+        return Club.objects.collect('parties_count').db
+
+    def test_round_robin(self):
+        self.assertEqual(['replica_1', 'replica_2', 'replica_1'], [self.collected_db() for _ in range(3)])
+        self.assertEqual('default', Club.objects.all().db)
+
+    def test_one_replica_per_request(self):
+        with routers.replica_reads() as replica:
+            self.assertEqual([replica, replica], [self.collected_db(), Club.objects.all().on_replica().db])
+            self.assertEqual(1, routers.selector.in_flight[replica])
+
+        self.assertEqual(0, routers.selector.in_flight[replica])
+
+    @override_settings(DASHBOARD_REPLICA_POLICY='least_in_flight')
+    def test_least_in_flight(self):
+        routers.selector.started('replica_1')
+
+        self.assertEqual(['replica_2', 'replica_2'], [self.collected_db() for _ in range(2)])
+
+        routers.selector.started('replica_2')
+        routers.selector.started('replica_2')
+
+        self.assertEqual('replica_1', self.collected_db())
+
+    def test_writes_pin_reads(self):
+        queryset = Club.objects.collect('parties_count')
+        Club.objects.create(name='Other club')
+
+        self.assertEqual('default', queryset.db)
+        self.assertEqual('default', self.collected_db())
+        self.assertTrue(routers.wrote())
+
+        routers.start_request()
+        self.assertEqual('replica_2', self.collected_db())
+
+    @override_settings(DASHBOARD_REPLICA_PIN_SECONDS=0)
+    def test_transactions_pin_reads(self):
+        with transaction.atomic():
+            Club.objects.create(name='Other club')
+            self.assertEqual('default', self.collected_db())
+
+    def test_writes_go_to_primary(self):
+        # Loaded from a replica
+        club = Club.objects.get()
+        club._state.db = 'replica_1'
+
+        self.assertEqual('default', routers.ReplicaRouter().db_for_write(Club, instance=club))
+        self.assertFalse(routers.ReplicaRouter().allow_migrate('replica_1', 'dashboard'))
+
+    def test_middleware(self):
+        def view(request):
+            if request.method == 'POST':
+                Club.objects.create(name='Other club')
+
+            return HttpResponse(self.collected_db())
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+
+        self.assertEqual(b'replica_1', middleware(factory.get('/')).content)
+
+        response = middleware(factory.post('/'))
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        # Read its writes
+        request = factory.get('/')
+        request.COOKIES[ReplicaPinningMiddleware.cookie_name] = '1'
+        response = middleware(request)
+        self.assertEqual(b'default', response.content)
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+
+class ReplicaReadTests(TransactionTestCase):
+    """
+    Reads the list endpoints from a second alias of the test database.
+    """
+
+    def setUp(self):
+        connections.databases['replica_1'] = dict(connections['default'].settings_dict)
+        self.addCleanup(self.remove_replica)
+
+        Party.objects.create(club=Club.objects.create(name='Club'), name='Party')
+
+    def remove_replica(self):
+        connections['replica_1'].close()
+        del connections['replica_1']
+        del connections.databases['replica_1']
+
+    @override_settings(DASHBOARD_REPLICAS=['replica_1'])
+    def test_club_list(self):
+        with CaptureQueriesContext(connections['replica_1']) as replica_queries, \
+                CaptureQueriesContext(connections['default']) as primary_queries:
+            response = self.client.get('/dashboard/list/club/?fields=name,parties_count')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([('Club', 1)], [(club['name'], club['parties_count']) for club in response.data['results']])
+        self.assertEqual(1, len(replica_queries))
+        self.assertEqual(0, len(primary_queries))
+
+    @override_settings(DASHBOARD_REPLICAS=['replica_1'], DASHBOARD_REPLICA_PIN_SECONDS=2)
+    def test_replica_results_are_cached_briefly(self):
+        result_cache = cache.get_cache()
+        routers.start_request()
+
+        with mock.patch.object(result_cache, 'set', wraps=result_cache.set) as set_result:
+            self.assertEqual([1], [club.parties_count for club in Club.objects.collect('parties_count').cached()])
+            list(Club.objects.cached(timeout=60))
+
+        self.assertEqual([2, 60], [timeout for (key, result, timeout), _ in set_result.call_args_list])
@@ -0,0 +1,67 @@
+import pickle
+
+from django.test import TestCase, override_settings
+
+from dashboard import compiled
+from dashboard.models import Club, Invoice, InvoiceRow, Party, Visitor, VisitorToParty
+
+
+class RowTests(TestCase):
+    def setUp(self):
+        compiled.statements.clear()
+        self.addCleanup(compiled.statements.clear)
+
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+
+            for party_idx in range(club_idx):
+                party = Party.objects.create(club=club, name='Party {}'.format(party_idx))
+                invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+                InvoiceRow.objects.create(description='Row', invoice=invoice, tax_rate=0, quantity=2, unit_price=5)
+                VisitorToParty.objects.create(
+                    visitor=Visitor.objects.create(full_name='Visitor', age=20),
+                    invoice=invoice,
+                    party=party
+                )
+
+    def test_records(self):
+        rows = list(Club.objects.collect('parties_count').order_by('pk').rows('pk', '_parties_count', 'name'))
+
+        self.assertEqual(
+            [('Club 0', 0), ('Club 1', 1), ('Club 2', 2)],
+            [(row.name, row._parties_count) for row in rows]
+        )
+        self.assertEqual(rows, pickle.loads(pickle.dumps(rows)))
+        self.assertEqual(rows[0].pk, pickle.loads(pickle.dumps(rows[0])).pk)
+
+    def test_compiled_shapes(self):
+        for _ in range(2):
+            clubs = Club.objects.collect('parties_count').filter(name__gt='Club 0').order_by('pk')
+
+            self.assertEqual([1, 2], [row._parties_count for row in clubs.rows('pk', '_parties_count')])
+            self.assertEqual([1, 2], [club.parties_count for club in clubs])
+            self.assertEqual(['Club 1', 'Club 2'], [row.name for row in clubs.rows('name')])
+
+        self.assertEqual(3, len(compiled.statements))
+
+    def get(self, url):
+        response = self.client.get(url)
+
+        if response.streaming:
+            return b''.join(response.streaming_content)
+
+        return response.content
+
+    def test_same_as_serializers(self):
+        for url in (
+            '/dashboard/list/club/?ordering=-total_incomes',
+            '/dashboard/list/club/?stream=1',
+            '/dashboard/list/party/?fields=name,total_party_income',
+            '/dashboard/list/invoice/',
+            '/dashboard/list/invoice-row/?ordering=amount',
+            '/dashboard/list/visitor-to-party/',
+        ):
+            with override_settings(DASHBOARD_VALUES_ROWS=False):
+                expected = self.get(url)
+
+            self.assertEqual(expected, self.get(url), url)
@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+from dashboard.models import (
+    Club,
+    Invoice,
+    InvoiceRow,
+    VisitorToParty,
+)
+from utilities.setup_db import counts, generate, make_plan
+
+
+class SetupDbTests(TestCase):
+    def test_generate(self):
+        generate(make_plan(clubs=3, parties_per_club=2, visitors=4, rows_per_invoice=2), chunk_size=4)
+
+        self.assertEqual(counts(), {
+            'dashboard.Club': 3,
+            'dashboard.Visitor': 4,
+            'dashboard.Party': 6,
+            'dashboard.Invoice': 24,
+            'dashboard.InvoiceRow': 48,
+            'dashboard.VisitorToParty': 24,
+        })
+        self.assertFalse(Invoice.objects.filter(visitortoparty__isnull=True).exists())
+        self.assertEqual(
+            list(Club.objects.collect('parties_count').values_list('_parties_count', flat=True)),
+            [2, 2, 2]
+        )
+
+        # Sequences continue after the generated ids
+        generate(make_plan(clubs=1, parties_per_club=1, visitors=1, rows_per_invoice=1))
+        Club.objects.create(name='Versai')
+
+        self.assertEqual(Club.objects.count(), 5)
+
+    def test_same_seed_generates_same_data(self):
+        def generated_rows(seed):
+            generate(make_plan(clubs=2, seed=seed), chunk_size=3)
+            rows = list(
+                InvoiceRow.objects
+                .order_by('id')
+                .values_list('description', 'tax_rate', 'quantity', 'unit_price', 'invoice__default_tax_rate')
+            )
+            VisitorToParty.objects.all().delete()
+            Invoice.objects.all().delete()
+
+            return rows
+
+        self.assertEqual(generated_rows(seed=1), generated_rows(seed=1))
+        self.assertNotEqual(generated_rows(seed=1), generated_rows(seed=2))
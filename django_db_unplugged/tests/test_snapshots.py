@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.test import TransactionTestCase, override_settings
+
+from dashboard import snapshots
+from dashboard.models import (
+    Club,
+    Party,
+    Invoice,
+    Visitor,
+    InvoiceRow,
+    VisitorToParty,
+)
+from dashboard.views import ClubListApi, PartyListApi
+
+
+# Background rebuilds use their own connection, so the data has to be committed
+class SnapshotTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        snapshots._rebuilt_at.clear()
+
+        for club_idx in range(15):
+            club = Club.objects.create(name='Club {:02}'.format(club_idx))
+            party = Party.objects.create(name='Party {:02}'.format(club_idx), club=club)
+            invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=invoice,
+                tax_rate=0.5,
+                quantity=club_idx % 4 + 1,
+                unit_price=5
+            )
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                invoice=invoice,
+                party=party
+            )
+
+    def fetch_all(self, url, params):
+        results = []
+
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(200, response.status_code)
+
+            results += response.data['results']
+            url, params = response.data['next'], {}
+
+        return results
+
+    def test_serves_snapshot(self):
+        for view_class in (ClubListApi, PartyListApi):
+            self.assertEqual(15, snapshots.build_snapshot(view_class, self.directory))
+
+        requests = (
+            ('/dashboard/list/club/', {}),
+            ('/dashboard/list/club/', {'fields': 'name,total_incomes', 'ordering': '-total_incomes'}),
+            ('/dashboard/list/club/', {'fields': 'name,parties_count', 'ordering': 'parties_count'}),
+            ('/dashboard/list/party/', {'ordering': '-name'}),
+            ('/dashboard/list/party/', {'ordering': 'invoices_count'}),
+        )
+
+        for url, params in requests:
+            expected = self.fetch_all(url, params)
+
+            with override_settings(DASHBOARD_SNAPSHOT_DIR=self.directory), self.assertNumQueries(0):
+                self.assertEqual(expected, self.fetch_all(url, params))
+
+        with override_settings(DASHBOARD_SNAPSHOT_DIR=self.directory):
+            response = self.client.get('/dashboard/list/club/', {'cursor': 'invalid'})
+
+        self.assertEqual(404, response.status_code)
+
+    @override_settings(DASHBOARD_SNAPSHOT_MAX_AGE=60)
+    def test_stale_while_revalidate(self):
+        with override_settings(DASHBOARD_SNAPSHOT_DIR=self.directory):
+            # Without a snapshot the list is read from the database
+            self.assertEqual('Club 00', self.client.get('/dashboard/list/club/').data['results'][0]['name'])
+
+            snapshots.build_snapshot(ClubListApi)
+            Club.objects.filter(name='Club 00').update(name='Versai')
+
+            response = self.client.get('/dashboard/list/club/')
+            self.assertEqual('Club 00', response.data['results'][0]['name'])
+            self.assertFalse(self.rebuilds())
+
+            stale = time.time() - 120
+            os.utime(snapshots.snapshot_path(ClubListApi), (stale, stale))
+
+            response = self.client.get('/dashboard/list/club/')
+            self.assertEqual('Club 00', response.data['results'][0]['name'])
+            self.assertGreaterEqual(int(response['Age']), 120)
+
+            for thread in self.rebuilds():
+                thread.join()
+
+            response = self.client.get('/dashboard/list/club/')
+            self.assertEqual('Versai', response.data['results'][0]['name'])
+            self.assertLess(int(response['Age']), 60)
+
+    def rebuilds(self):
+        return [thread for thread in threading.enumerate() if thread.name.startswith('snapshot-')]
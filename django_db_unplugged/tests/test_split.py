@@ -0,0 +1,102 @@
+import io
+import json
+import threading
+from unittest import mock
+
+from django.core.exceptions import FieldError
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from dashboard import snapshots, split
+from dashboard.models import Club, Invoice, Party, Visitor, VisitorToParty
+from dashboard.views import ClubListApi
+
+
+def create_clubs():
+    for club_idx in range(3):
+        club = Club.objects.create(name='Club {}'.format(club_idx))
+
+        for party_idx in range(club_idx):
+            party = Party.objects.create(club=club, name='Party {}'.format(party_idx))
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Visitor', age=20),
+                invoice=Invoice.objects.create(stored_total_amount=10 * (party_idx + 1)),
+                party=party
+            )
+
+
+def collected(queryset):
+    return [
+        (club.name, club.first_party_name, club.last_party_income, club.average_income_per_party,
+         club.parties_count, club.total_incomes)
+        for club in queryset.order_by('pk')
+    ]
+
+
+class SplitCollectTests(TestCase):
+    def setUp(self):
+        create_clubs()
+
+    @override_settings(DASHBOARD_PROPERTY_FALLBACKS='strict')
+    def test_same_values_as_collect(self):
+        expected = collected(Club.objects.collect())
+
+        # Inside the test transaction, so in this thread
+        with self.assertNumQueries(1 + len(Club.objects.collectable_fields())):
+            self.assertEqual(expected, collected(Club.objects.collect_split()))
+
+    def test_fields(self):
+        clubs = list(Club.objects.collect_split('parties_count').order_by('pk'))
+
+        self.assertEqual([0, 1, 2], [club._parties_count for club in clubs])
+        self.assertFalse(hasattr(clubs[0], '_total_incomes'))
+
+        with self.assertRaises(FieldError):
+            Club.objects.collect_split('name')
+
+    def test_chunks(self):
+        with mock.patch.object(split, 'CHUNK_SIZE', 2):
+            clubs = list(Club.objects.collect_split('parties_count').order_by('pk').iterator())
+
+        self.assertEqual([0, 1, 2], [club._parties_count for club in clubs])
+
+    @override_settings(DASHBOARD_SPLIT_COLLECT=True)
+    def test_list_endpoint(self):
+        response = self.client.get('/dashboard/list/club/?fields=name,parties_count&ordering=-name')
+
+        self.assertEqual(
+            [('Club 2', 2), ('Club 1', 1), ('Club 0', 0)],
+            [(club['name'], club['parties_count']) for club in response.data['results']]
+        )
+
+    @override_settings(DASHBOARD_SPLIT_COLLECT=True)
+    def test_sorted_by_collected_field(self):
+        response = self.client.get('/dashboard/list/club/?fields=name&ordering=-parties_count')
+
+        self.assertEqual(['Club 2', 'Club 1', 'Club 0'], [club['name'] for club in response.data['results']])
+
+    @override_settings(DASHBOARD_SPLIT_COLLECT=True)
+    def test_snapshot(self):
+        output = io.BytesIO()
+
+        self.assertEqual(3, snapshots.render_snapshot(ClubListApi, output))
+        self.assertEqual([0, 1, 2], [club['parties_count'] for club in json.loads(output.getvalue().decode('utf-8'))])
+
+
+class ConcurrentSplitCollectTests(TransactionTestCase):
+    def setUp(self):
+        create_clubs()
+
+    def test_runs_on_worker_threads(self):
+        threads = set()
+        collect_values = split.collect_values
+
+        def record_thread(*args):
+            threads.add(threading.current_thread().name)
+
+            return collect_values(*args)
+
+        with mock.patch.object(split, 'collect_values', record_thread):
+            clubs = collected(Club.objects.collect_split())
+
+        self.assertEqual(collected(Club.objects.collect()), clubs)
+        self.assertTrue(all(name.startswith('dashboard-split') for name in threads))
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from dashboard import sqlstats
+from dashboard.models import Club
+from dashboard.queries import count_queries
+
+
+class SQLStatsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        sqlstats.stats.reset()
+        self.addCleanup(sqlstats.stats.reset)
+
+    def test_normalize(self):
+        self.assertEqual(
+            sqlstats.normalize(
+                'SELECT "t"."id" AS "140011", U0."name" FROM "t" WHERE ("t"."id" IN (%s, %s, %s) '
+                'AND "t"."name" = \'Boro\')\n LIMIT 21'
+            ),
+            'SELECT "t"."id" AS "?", U0."name" FROM "t" WHERE ("t"."id" IN (...) AND "t"."name" = ?) LIMIT ?'
+        )
+        self.assertEqual(
+            sqlstats.normalize('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            sqlstats.normalize('INSERT INTO "t" ("a", "b") VALUES (%s, %s)')
+        )
+
+    @override_settings(DASHBOARD_SQL_STATS=True)
+    def test_fingerprints(self):
+        # Connections are usually created while a request is being counted
+        with count_queries():
+            sqlstats.install(connection=connection)
+
+        self.addCleanup(self.uninstall)
+
+        for club_idx in range(3):
+            Club.objects.filter(name='Club {}'.format(club_idx)).exists()
+
+        processes, entries = sqlstats.load_stats()
+        (entry, ) = [entry for entry in entries.values() if 'dashboard_club' in entry['sql']]
+
+        self.assertEqual(1, processes)
+        self.assertEqual(3, entry['count'])
+        self.assertEqual(3, sum(entry['buckets'].values()))
+
+        row = sqlstats.summarize({'key': entry})[0]
+        self.assertLessEqual(row['p50'], row['p99'])
+        self.assertGreater(row['total_time'], 0)
+
+    def uninstall(self):
+        del connection.make_cursor
+        del connection.make_debug_cursor
+        del connection.sql_stats_installed
+
+    def test_merges_processes(self):
+        sqlstats.stats.add('SELECT 1', 0.001)
+        sqlstats.stats.flush(self.directory)
+
+        self.write_stats(os.getppid())
+
+        processes, entries = sqlstats.load_stats(self.directory)
+
+        self.assertEqual(2, processes)
+        self.assertEqual([2], [entry['count'] for entry in entries.values()])
+
+    def write_stats(self, pid):
+        path = os.path.join(self.directory, '{}.json'.format(pid))
+
+        with open(path, 'w') as stats_file:
+            json.dump(sqlstats.stats.as_dict(), stats_file)
+
+        return path
+
+    def test_skips_stale_files(self):
+        sqlstats.stats.add('SELECT 1', 0.001)
+
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        exited_path = self.write_stats(exited.pid)
+
+        stale_path = self.write_stats(os.getppid())
+        written_at = time.time() - sqlstats.STALE_AFTER - 1
+        os.utime(stale_path, (written_at, written_at))
+
+        processes, entries = sqlstats.load_stats(self.directory)
+
+        self.assertEqual(1, processes)
+        self.assertEqual([1], [entry['count'] for entry in entries.values()])
+        self.assertFalse(os.path.exists(exited_path))
+        self.assertTrue(os.path.exists(stale_path))
+
+    def test_summarize_with_missing_buckets(self):
+        # Copied between the count and the bucket update, or after lost updates
+        entry = {'sql': 'SELECT ?', 'count': 3, 'time': 0.003, 'buckets': {sqlstats.bucket(0.001): 2}}
+
+        row = sqlstats.summarize({'key': entry})[0]
+        self.assertGreaterEqual(row['p99'], 1)
+        self.assertEqual(row['p50'], row['p99'])
+
+        row = sqlstats.summarize({'key': dict(entry, buckets={})})[0]
+        self.assertIsNone(row['p99'])
+
+    def test_endpoint(self):
+        sqlstats.stats.add('SELECT 1', 0.001)
+
+        self.assertEqual(403, self.client.get('/dashboard/sql-stats/').status_code)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/dashboard/sql-stats/', {'limit': 1})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.data['processes'])
+        self.assertEqual('SELECT ?', response.data['queries'][0]['sql'])
+        self.assertEqual(1, len(response.data['queries']))
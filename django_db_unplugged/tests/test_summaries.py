@@ -0,0 +1,76 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from dashboard.models import (
+    Club,
+    Party,
+    Invoice,
+    Visitor,
+    InvoiceRow,
+    VisitorToParty,
+)
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        for club_idx in range(3):
+            club = Club.objects.create(name='Club {}'.format(club_idx))
+
+            for party_idx in range(club_idx):
+                party = Party.objects.create(name='Party {}'.format(party_idx), club=club)
+                invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+                InvoiceRow.objects.create(
+                    description='Vodka',
+                    invoice=invoice,
+                    tax_rate=0.0,
+                    quantity=party_idx + 1,
+                    unit_price=5
+                )
+                VisitorToParty.objects.create(
+                    visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                    invoice=invoice,
+                    party=party
+                )
+
+        call_command('refresh_summaries', stdout=StringIO())
+
+    def test_collect_summary_matches_collect(self):
+        for model in (Club, Party, Invoice):
+            fields = model.objects.collectable_fields()
+
+            def rows(queryset):
+                return [
+                    tuple(getattr(instance, field) for field in fields)
+                    for instance in queryset.order_by('id')
+                ]
+
+            self.assertEqual(rows(model.objects.collect()), rows(model.objects.collect_summary()))
+
+    def test_summary_is_stale_until_refreshed(self):
+        club = Club.objects.create(name='Versai')
+        party = Party.objects.create(name='Boro', club=club)
+
+        club = Club.objects.collect_summary().get(id=club.id)
+        self.assertEqual(0, club.parties_count)
+        self.assertEqual(0, club.total_incomes)
+        self.assertIsNone(club.first_party_name)
+
+        call_command('refresh_summaries', stdout=StringIO())
+
+        club = Club.objects.collect_summary().get(id=club.id)
+        self.assertEqual(1, club.parties_count)
+        self.assertEqual(party.name, club.first_party_name)
+
+    @override_settings(DASHBOARD_USE_SUMMARIES=True)
+    def test_list_apis_read_summaries(self):
+        for url, table in (('/dashboard/list/club/', 'club'), ('/dashboard/list/party/', 'party')):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+
+            self.assertEqual(200, response.status_code)
+            self.assertIn('dashboard_{}_summary'.format(table), context.captured_queries[0]['sql'])
+            self.assertNotIn('dashboard_visitortoparty', context.captured_queries[0]['sql'])
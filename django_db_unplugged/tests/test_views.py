@@ -0,0 +1,162 @@
+import json
+from base64 import urlsafe_b64encode
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from dashboard.models import (
+    Club,
+    Party,
+    Invoice,
+    Visitor,
+    InvoiceRow,
+    VisitorToParty,
+)
+
+
+class ListApiTests(TestCase):
+    def setUp(self):
+        club = Club.objects.create(name='Versai')
+        party = Party.objects.create(name='Boro', club=club)
+        invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+        InvoiceRow.objects.create(
+            description='Vodka',
+            invoice=invoice,
+            tax_rate=0.5,
+            quantity=2,
+            unit_price=5
+        )
+        VisitorToParty.objects.create(
+            visitor=Visitor.objects.create(full_name='Ivo', age=20),
+            invoice=invoice,
+            party=party
+        )
+
+    def test_club_list(self):
+        response = self.client.get('/dashboard/list/club/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Versai', response.data['results'][0]['name'])
+        self.assertEqual(15, response.data['results'][0]['total_incomes'])
+        self.assertEqual('Boro', response.data['results'][0]['last_party_name'])
+
+    def test_club_list_with_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/dashboard/list/club/', {'fields': 'total_incomes'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'total_incomes': 15}], response.data['results'])
+
+        sql = context.captured_queries[0]['sql']
+        self.assertIn('"_total_incomes"', sql)
+        self.assertNotIn('"_first_party_name"', sql)
+        self.assertNotIn('ROW_NUMBER()', sql)
+        self.assertNotIn('"dashboard_club"."name"', sql)
+
+    def test_invoice_list_with_fields(self):
+        response = self.client.get('/dashboard/list/invoice/', {'fields': 'details,total_amount'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'details': 'Vodka', 'total_amount': 15}], response.data['results'])
+
+    def test_unknown_fields(self):
+        for params in ({'fields': 'name,bogus'}, {'fields': 'bogus', 'stream': '1'}):
+            response = self.client.get('/dashboard/list/club/', params)
+
+            self.assertEqual(400, response.status_code)
+            self.assertIn('bogus', response.data['fields'][0])
+
+    def test_party_list(self):
+        response = self.client.get('/dashboard/list/party/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [{'name': 'Boro', 'total_party_income': 15, 'invoices_count': 1}],
+            response.data['results']
+        )
+
+    def test_invoice_row_list(self):
+        response = self.client.get('/dashboard/list/invoice-row/', {'fields': 'invoice_id,amount'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(15, response.data['results'][0]['amount'])
+        self.assertEqual(['invoice_id', 'amount'], list(response.data['results'][0]))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        for club_idx in range(25):
+            club = Club.objects.create(name='Club {:02}'.format(club_idx))
+
+            party = Party.objects.create(name='Boro', club=club)
+            invoice = Invoice.objects.create(description=None, default_tax_rate=0.5)
+            InvoiceRow.objects.create(
+                description='Vodka',
+                invoice=invoice,
+                tax_rate=0.5,
+                quantity=club_idx % 3 + 1,
+                unit_price=5
+            )
+            VisitorToParty.objects.create(
+                visitor=Visitor.objects.create(full_name='Ivo', age=20),
+                invoice=invoice,
+                party=party
+            )
+
+    def fetch_all(self, url, params):
+        pages = []
+
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+
+            self.assertEqual(200, response.status_code)
+            self.assertFalse(any('COUNT(*)' in query['sql'] for query in context.captured_queries))
+
+            pages.append(response.data['results'])
+            url, params = response.data['next'], {}
+
+        return pages
+
+    def test_pages_by_id(self):
+        pages = self.fetch_all('/dashboard/list/club/', {'fields': 'name'})
+
+        self.assertEqual([10, 10, 5], [len(page) for page in pages])
+        self.assertEqual(
+            ['Club {:02}'.format(idx) for idx in range(25)],
+            [club['name'] for page in pages for club in page]
+        )
+
+    def test_pages_by_annotated_key(self):
+        pages = self.fetch_all('/dashboard/list/club/', {'fields': 'name,total_incomes', 'ordering': '-total_incomes'})
+        clubs = [club for page in pages for club in page]
+
+        self.assertEqual(25, len(clubs))
+        self.assertEqual(25, len({club['name'] for club in clubs}))
+        self.assertEqual(
+            sorted((club['total_incomes'] for club in clubs), reverse=True),
+            [club['total_incomes'] for club in clubs]
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/dashboard/list/club/', {'cursor': 'invalid'})
+
+        self.assertEqual(404, response.status_code)
+
+    def test_tampered_cursor(self):
+        for ordering, position in (('id', ['id', 'x', 'abc']), ('-total_incomes', ['-total_incomes', 'abc', 1])):
+            cursor = urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+            response = self.client.get('/dashboard/list/club/', {'ordering': ordering, 'cursor': cursor})
+
+            self.assertEqual(404, response.status_code)
+
+    def test_stream(self):
+        response = self.client.get('/dashboard/list/club/', {'stream': '1', 'fields': 'name', 'ordering': '-name'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            [{'name': 'Club {:02}'.format(idx)} for idx in reversed(range(25))],
+            json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        )
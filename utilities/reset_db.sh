@@ -9,4 +9,6 @@ sudo -u postgres createdb -O $USERNAME "$DATABASE"
 
 python manage.py migrate
 
-python manage.py shell -c 'from utilities import setup_db'
+python manage.py setup_db "$@"
+
+python manage.py refresh_summaries
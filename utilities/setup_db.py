@@ -1,3 +1,25 @@
+"""
+Generates dashboard data at any scale. Use it through `python manage.py setup_db`.
+
+All ids are assigned up front from the current maximum of every table, so
+the invoices, their rows and the visitor to party connections of any range of
+parties can be written independently - in chunks and in parallel worker
+processes - without reading anything back. On PostgreSQL rows are streamed
+with `COPY`, on other databases they are inserted with `bulk_create()`.
+
+The same `seed` and `chunk_size` always generate the same data.
+"""
+import io
+import random
+from collections import namedtuple
+from decimal import Decimal
+from multiprocessing import Pool
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+
+from dashboard.cache import tables_changed
 from dashboard.models import (
     Invoice,
     Club,
@@ -7,128 +29,258 @@ from dashboard.models import (
     VisitorToParty,
 )
 
+VISITOR_NAMES = (
+    'Ivaylo Donchev',
+    'Pavlin Gergov',
+    'Martin Angelov',
+    'Krasimira Badova',
+    'Alexander Nadjarian',
+    'Radoslav Georgiev',
+    'Dimitar Kotsev',
+    'Kamen Kotsev',
+    'Vasil Slavov',
+    'Tony Yordanova',
+    'Slavyana Monkova',
+)
 
-def create_clubs():
-    clubs = [
-        Club(name='Club {}'.format(i))
-        for i in range(1, 34)
-    ]
-    return Club.objects.bulk_create(clubs)
-
-
-def create_visitors():
-    visitors = [
-        Visitor(full_name='Ivaylo Donchev', age=20),
-        Visitor(full_name='Pavlin Gergov', age=20),
-        Visitor(full_name='Martin Angelov', age=20),
-        Visitor(full_name='Krasimira Badova', age=20),
-        Visitor(full_name='Alexander Nadjarian', age=20),
-        Visitor(full_name='Radoslav Georgiev', age=20),
-        Visitor(full_name='Dimitar Kotsev', age=20),
-        Visitor(full_name='Kamen Kotsev', age=20),
-        Visitor(full_name='Vasil Slavov', age=20),
-        Visitor(full_name='Tony Yordanova', age=20),
-        Visitor(full_name='Slavyana Monkova', age=20),
-    ]
+# (description, quantities, unit prices)
+PRODUCTS = (
+    ('Vodka', (1, 2, 3), ('5.00', '7.50')),
+    ('Beer', (1, 2, 4, 6), ('2.50', '3.00')),
+    ('Whiskey', (1, 2), ('9.00', '12.00')),
+    ('Salfetki', (50, 100), ('0.20', )),
+)
+
+TAX_RATES = ('0.00', '0.20', '0.50')
+
+MODELS = (Club, Visitor, Party, Invoice, InvoiceRow, VisitorToParty)
+
+
+class Plan(namedtuple('Plan', 'clubs parties_per_club visitors rows_per_invoice seed offsets')):
+    """
+    Sizes of the generated dataset and the first id of every model.
+    """
+
+    @property
+    def parties(self):
+        return self.clubs * self.parties_per_club
+
+    def invoice_index(self, party_index, visitor_index):
+        return party_index * self.visitors + visitor_index
+
+    def id(self, model, index):
+        return self.offsets[model._meta.label] + index
+
+
+def make_plan(clubs=33, parties_per_club=10, visitors=11, rows_per_invoice=3, seed=0, using='default'):
+    offsets = {
+        model._meta.label: (model.objects.using(using).aggregate(max_id=Max('pk'))['max_id'] or 0) + 1
+        for model in MODELS
+    }
+
+    return Plan(clubs, parties_per_club, visitors, rows_per_invoice, seed, offsets)
+
+
+def club_rows(plan):
+    for idx in range(plan.clubs):
+        yield plan.id(Club, idx), 'Club {}'.format(idx + 1)
+
+
+def visitor_rows(plan):
+    for idx in range(plan.visitors):
+        name = VISITOR_NAMES[idx % len(VISITOR_NAMES)]
+        yield plan.id(Visitor, idx), name, 20 + idx % 30
+
+
+def party_rows(plan):
+    for club_idx in range(plan.clubs):
+        for idx in range(plan.parties_per_club):
+            party_idx = club_idx * plan.parties_per_club + idx
+            club_name = 'Club {}'.format(club_idx + 1)
+
+            yield plan.id(Party, party_idx), 'Party {} for {}'.format(idx, club_name), plan.id(Club, club_idx)
 
-    return Visitor.objects.bulk_create(visitors)
 
+def invoices_with_rows(plan, parties, rng):
+    """
+    Yields `(invoice, rows)` for every invoice of `parties`, with the stored
+    amounts of the rows and the stored total of the invoice filled in.
+    """
+    for party_idx in parties:
+        for visitor_idx in range(plan.visitors):
+            invoice_idx = plan.invoice_index(party_idx, visitor_idx)
+            invoice_id = plan.id(Invoice, invoice_idx)
+            default_tax_rate = rng.choice(TAX_RATES)
 
-def create_parties(clubs):
-    parties = []
-    for club in clubs:
-        parties += [
-            Party(
-                name='Party {} for {}'.format(i, club.name),
-                club=club
+            rows = []
+            total_amount = Decimal(0)
+
+            for idx in range(plan.rows_per_invoice):
+                description, quantities, unit_prices = rng.choice(PRODUCTS)
+                tax_rate = rng.choice(TAX_RATES)
+                quantity = rng.choice(quantities)
+                unit_price = rng.choice(unit_prices)
+
+                amount_without_tax = quantity * Decimal(unit_price)
+                amount = amount_without_tax * (1 + (Decimal(tax_rate) or Decimal(default_tax_rate)))
+                total_amount += amount
+
+                rows.append((
+                    plan.id(InvoiceRow, invoice_idx * plan.rows_per_invoice + idx),
+                    invoice_id,
+                    description,
+                    tax_rate,
+                    quantity,
+                    unit_price,
+                    amount_without_tax,
+                    amount,
+                ))
+
+            yield (invoice_id, None, default_tax_rate, total_amount), rows
+
+
+def visitor_to_party_rows(plan, parties):
+    for party_idx in parties:
+        for visitor_idx in range(plan.visitors):
+            invoice_idx = plan.invoice_index(party_idx, visitor_idx)
+
+            yield (
+                plan.id(VisitorToParty, invoice_idx),
+                plan.id(Visitor, visitor_idx),
+                plan.id(Party, party_idx),
+                plan.id(Invoice, invoice_idx),
             )
-            for i in range(10)
-        ]
 
-    return Party.objects.bulk_create(parties)
 
+COLUMNS = {
+    Club: ('id', 'name'),
+    Visitor: ('id', 'full_name', 'age'),
+    Party: ('id', 'name', 'club_id'),
+    Invoice: ('id', 'description', 'default_tax_rate', 'stored_total_amount'),
+    InvoiceRow: (
+        'id',
+        'invoice_id',
+        'description',
+        'tax_rate',
+        'quantity',
+        'unit_price',
+        'stored_amount_without_tax',
+        'stored_amount',
+    ),
+    VisitorToParty: ('id', 'visitor_id', 'party_id', 'invoice_id'),
+}
 
-def create_invoices_with_rows(parties, visitors):
-    invoices = []
-    invoice_rows = []
-    for party in parties:
-        for visitor in visitors:
-            invoice = Invoice(description="Invoice for ".format(party.name))
-            invoices.append(invoice)
-
-    invoices = Invoice.objects.bulk_create(invoices)
-
-    for invoice in invoices:
-        invoice_rows += [
-            InvoiceRow(
-                description='Vodka',
-                invoice=invoice,
-                tax_rate=0.5,
-                quantity=2,
-                unit_price=5
-            ),
-            InvoiceRow(
-                description='Beer',
-                invoice=invoice,
-                tax_rate=0.5,
-                quantity=2,
-                unit_price=5
-            ),
-            InvoiceRow(
-                description='Salfetki',
-                invoice=invoice,
-                tax_rate=0.5,
-                quantity=100,
-                unit_price=0.2
+
+def copy_rows(model, rows, using='default'):
+    """
+    Writes `rows` (tuples of the `COLUMNS[model]` fields) with `COPY ... FROM STDIN` on
+    PostgreSQL and with `bulk_create()` elsewhere.
+    """
+    columns = COLUMNS[model]
+    db = connections[using]
+
+    if db.vendor != 'postgresql':
+        model.objects.using(using).bulk_create([
+            model(**dict(zip(columns, row)))
+            for row in rows
+        ])
+        return
+
+    data = io.StringIO()
+
+    for row in rows:
+        data.write('\t'.join('\\N' if value is None else str(value) for value in row))
+        data.write('\n')
+
+    data.seek(0)
+
+    with db.cursor() as cursor:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN'.format(
+                db.ops.quote_name(model._meta.db_table),
+                ', '.join(db.ops.quote_name(model._meta.get_field(column).column) for column in columns)
             ),
-        ]
-    InvoiceRow.objects.bulk_create(invoice_rows)
+            data
+        )
 
-    return invoices
 
+def create_parties_data(plan, start, stop, using='default'):
+    """
+    Creates the invoices with rows and the visitor to party connections of
+    the parties with indexes in [start, stop), in a single transaction.
+    """
+    rng = random.Random('{}-{}'.format(plan.seed, start))
+    parties = range(start, stop)
 
-def create_visitor_to_party_set():
-    invoices = list(Invoice.objects.all())
-    parties = list(Party.objects.all())
-    visitors = list(Visitor.objects.all())
+    invoices = []
+    rows = []
 
-    invoice_idx = 0
-    visitor_to_parties = []
+    for invoice, invoice_rows in invoices_with_rows(plan, parties, rng):
+        invoices.append(invoice)
+        rows.extend(invoice_rows)
 
-    for party in parties:
-        for visitor in visitors:
-            visitor_to_parties.append(
-                VisitorToParty(visitor=visitor, party=party, invoice=invoices[invoice_idx])
-            )
-            invoice_idx += 1
+    with transaction.atomic(using=using):
+        copy_rows(Invoice, invoices, using=using)
+        copy_rows(InvoiceRow, rows, using=using)
+        copy_rows(VisitorToParty, visitor_to_party_rows(plan, parties), using=using)
+
+    return stop - start
 
-    return VisitorToParty.objects.bulk_create(visitor_to_parties)
 
+def _create_parties_data(args):
+    return create_parties_data(*args)
 
-print('Creating Clubs')
-clubs = create_clubs()
-print('Created {} clubs'.format(Club.objects.count()))
 
-print('----------------------------------')
+def reset_sequences(using='default'):
+    db = connections[using]
 
-print('Creating Visitors')
-visitors = create_visitors()
-print('Created {} visitors'.format(Visitor.objects.count()))
+    with db.cursor() as cursor:
+        for sql in db.ops.sequence_reset_sql(no_style(), MODELS):
+            cursor.execute(sql)
+
+
+def generate(plan, chunk_size=1000, workers=1, using='default', log=None):
+    """
+    Creates the data described by `plan`. Parties are processed in chunks of
+    `chunk_size`; with `workers > 1` the chunks are spread across that many
+    processes (PostgreSQL only, every process uses its own connection).
+    """
+    log = log or (lambda message: None)
+
+    with transaction.atomic(using=using):
+        copy_rows(Club, club_rows(plan), using=using)
+        copy_rows(Visitor, visitor_rows(plan), using=using)
+        copy_rows(Party, party_rows(plan), using=using)
+
+    log('Created {} clubs, {} visitors and {} parties'.format(plan.clubs, plan.visitors, plan.parties))
+
+    chunks = [
+        (plan, start, min(start + chunk_size, plan.parties), using)
+        for start in range(0, plan.parties, chunk_size)
+    ]
+    done = 0
 
-print('----------------------------------')
+    if workers > 1 and connections[using].vendor == 'postgresql':
+        # Forked processes must not share the parent's connection
+        connections.close_all()
 
-print('Creating Parties')
-parties = create_parties(clubs)
-print('Created {} parties'.format(Party.objects.count()))
+        with Pool(workers) as pool:
+            for count in pool.imap_unordered(_create_parties_data, chunks):
+                done += count
+                log('Created data for {}/{} parties'.format(done, plan.parties))
+    else:
+        for chunk in chunks:
+            done += _create_parties_data(chunk)
+            log('Created data for {}/{} parties'.format(done, plan.parties))
 
-print('----------------------------------')
+    reset_sequences(using=using)
 
-print('Creating Invoices with InvoiceRows')
-invoices = create_invoices_with_rows(parties, visitors)
-print('Created {} invoices and {} invoice rows'.format(Invoice.objects.count(), InvoiceRow.objects.count()))
+    # `COPY` and the worker processes bypass the result cache invalidation
+    tables_changed([model._meta.db_table for model in MODELS], using=using)
 
-print('----------------------------------')
 
-print('Creating Visitor to parties connections')
-visitor_to_parties = create_visitor_to_party_set()
-print('Created {} visitor_to_party-ies'.format(VisitorToParty.objects.count()))
+def counts(using='default'):
+    return {
+        model._meta.label: model.objects.using(using).count()
+        for model in MODELS
+    }